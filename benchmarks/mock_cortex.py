@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import heapq
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class MockCortex(object):
+    """
+    Stand-in Cortex HTTP server implementing the endpoints used by the module: the analyzers
+    search, running an analyzer, getting a job, waitreport, the job report and the jobs search.
+
+    Jobs complete latency seconds after they start. With workers set, at most workers jobs run
+    at once and the others wait in submission order, like on a busy Cortex; otherwise they start
+    right away. A failure_rate share of them fails, and successful ones return a report of about
+    report_size bytes.
+    """
+
+    def __init__(self, analyzers, latency=0.1, failure_rate=0.0, report_size=2048, seed=0,
+                 requests_counter=None, workers=0):
+        self.analyzers = [{"id": f"analyzer-{index}", "name": name}
+                          for index, name in enumerate(analyzers)]
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.report_size = report_size
+        # Times at which the analyzer workers are free
+        self._workers = [0.0] * workers
+
+        self.jobs = {}
+        self._requests = requests_counter or multiprocessing.Value("i", 0, lock=False)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def requests(self):
+        return self._requests.value
+
+    def count_request(self):
+        self._requests.value += 1
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """
+        Starts the server on a free local port, in a background thread
+
+        :return: URL of the server
+        """
+        handler = type("MockCortexHandler", (_MockCortexHandler,), {"cortex": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._server.request_queue_size = 1024
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        return self.url
+
+    def stop(self):
+        """
+        Stops the server
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def submit(self, analyzer_id, observable):
+        with self._lock:
+            self.count_request()
+            job_id = uuid.uuid4().hex
+            submitted = start = time.monotonic()
+            if self._workers:
+                start = max(start, heapq.heappop(self._workers))
+                heapq.heappush(self._workers, start + self.latency)
+
+            self.jobs[job_id] = {
+                "id": job_id,
+                "analyzerId": analyzer_id,
+                "data": observable.get("data"),
+                "dataType": observable.get("dataType"),
+                "status": "Waiting",
+                "createdAt": int(time.time() * 1000),
+                "_queued": start - submitted,
+                "_end": start + self.latency,
+                "_fails": self._random.random() < self.failure_rate,
+            }
+
+            return self._public(self.jobs[job_id])
+
+    def get_job(self, job_id, with_report=False):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+
+            if job["status"] not in ("Success", "Failure") and time.monotonic() >= job["_end"]:
+                job["status"] = "Failure" if job["_fails"] else "Success"
+                job["startDate"] = job["createdAt"] + int(job["_queued"] * 1000)
+                job["endDate"] = int(time.time() * 1000)
+
+            public = self._public(job)
+
+        if with_report and public["status"] == "Success":
+            public["report"] = self.build_report(public)
+        elif public["status"] == "Failure":
+            public["errorMessage"] = "Mock analyzer failure"
+
+        return public
+
+    def remaining(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return max(0.0, job["_end"] - time.monotonic()) if job else 0.0
+
+    def build_report(self, job):
+        return {
+            "success": True,
+            "summary": {"taxonomies": [{"level": "info", "namespace": "Mock", "predicate": "Score",
+                                        "value": "0"}]},
+            "full": {"data": job["data"], "padding": "x" * max(0, self.report_size - 200)},
+            "artifacts": [],
+            "operations": [],
+        }
+
+    @staticmethod
+    def _public(job):
+        return {key: value for key, value in job.items() if not key.startswith("_")}
+
+
+def _serve(connection, requests_counter, args, kwargs):
+    cortex = MockCortex(*args, requests_counter=requests_counter, **kwargs)
+    connection.send(cortex.start())
+    connection.recv()
+    cortex.stop()
+
+
+class MockCortexProcess(object):
+    """
+    Runs a MockCortex in a child process, so that the server does not compete for the GIL
+    with the module being benchmarked
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self._requests = multiprocessing.Value("i", 0)
+        self._connection = None
+        self._process = None
+        self.url = None
+
+    @property
+    def requests(self):
+        return self._requests.value
+
+    def start(self):
+        """
+        Starts the server process
+
+        :return: URL of the server
+        """
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, daemon=True,
+                                                args=(child_connection, self._requests, self._args,
+                                                      self._kwargs))
+        self._process.start()
+        self.url = self._connection.recv()
+
+        return self.url
+
+    def stop(self):
+        """
+        Stops the server process
+        """
+        if self._process is not None:
+            self._connection.send("stop")
+            self._process.join(timeout=5)
+
+
+class _MockCortexHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cortex = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, code=200):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.cortex.count_request()
+
+        match = re.match(r"/api/job/([^/]+)(?:/(report|waitreport))?$", url.path)
+        if not match:
+            return self._send({"type": "NotFound"}, 404)
+
+        job_id, action = match.groups()
+        if action == "waitreport":
+            at_most = parse_qs(url.query).get("atMost", ["1second"])[0]
+            held = float(re.match(r"(\d+)", at_most).group(1))
+            time.sleep(min(self.cortex.remaining(job_id), held))
+
+        job = self.cortex.get_job(job_id, with_report=action is not None)
+        if job is None:
+            return self._send({"type": "NotFound"}, 404)
+
+        return self._send(job)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._body()
+
+        if url.path == "/api/analyzer/_search":
+            self.cortex.count_request()
+            return self._send(self.cortex.analyzers)
+
+        if url.path == "/api/job/_search":
+            self.cortex.count_request()
+            ids = [clause.get("_id") for clause in (body.get("query") or {}).get("_or", [])]
+            return self._send([job for job in map(self.cortex.get_job, ids) if job is not None])
+
+        match = re.match(r"/api/analyzer/([^/]+)/run$", url.path)
+        if match:
+            return self._send(self.cortex.submit(match.group(1), body))
+
+        self.cortex.count_request()
+        return self._send({"type": "NotFound"}, 404)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+"""
+Offline benchmark of the module. Drives IrisCortexanalyzerInterface.hooks_handler with synthetic
+IOC batches against a mock Cortex server, with the IRIS application stubbed, and reports the
+throughput, the p50/p99 latency from the hook call to the report of each IOC and the peak memory.
+
+    python -m benchmarks.run_benchmark --sizes 1,100,1000,10000 --latency 0.2 --max-in-flight 32
+"""
+
+import argparse
+import gc
+import json
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+
+from benchmarks.mock_cortex import MockCortex, MockCortexProcess
+from tests.iris_stubs import Ioc, install_iris_stubs
+
+ANALYZER = "Benchmark_Analyzer_1_0"
+
+# IRIS types and value patterns of the synthetic IOCs
+IOC_PATTERNS = (
+    ("ip-dst", lambda index: f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}'),
+    ("domain", lambda index: f'host-{index}.example.com'),
+    ("sha256", lambda index: f'{index:064x}'),
+    ("url", lambda index: f'https://example.com/path/{index}'),
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Cortex Analyzer module")
+    parser.add_argument("--sizes", default="1,10,100,1000,10000",
+                        help="Comma separated sizes of the IOC batches (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="Seconds before a mock job completes")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Share of the mock jobs which fail")
+    parser.add_argument("--report-size", type=int, default=2048,
+                        help="Approximate size of the reports in bytes")
+    parser.add_argument("--cortex-workers", type=int, default=0,
+                        help="Number of jobs the mock Cortex runs at once. 0 runs every job right "
+                             "away")
+    parser.add_argument("--duplicates", type=float, default=0.0,
+                        help="Share of the IOCs of a batch repeating the value of another one")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads",
+                        help="Execution engine")
+    parser.add_argument("--max-in-flight", type=int, default=16,
+                        help="Maximum number of jobs in flight")
+    parser.add_argument("--hook", default="on_manual_trigger_ioc", help="Hook to trigger")
+    parser.add_argument("--config", default="{}", help="JSON object of extra module settings")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Measure the peak Python allocations of each batch with tracemalloc "
+                             "instead of the peak RSS of the process. Slows the module down "
+                             "noticeably")
+    parser.add_argument("--in-process-server", action="store_true",
+                        help="Run the mock Cortex server in the benchmark process instead of a "
+                             "child process")
+    parser.add_argument("--json", dest="json_path",
+                        help="Optional path to write the results to as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show the logs of the module")
+    return parser.parse_args(argv)
+
+
+def module_configuration(args, url):
+    import iris_cortexanalyzer_module.IrisCortexanalyzerConfig as interface_conf
+
+    values = {
+        "cortexanalyze_url": url,
+        "cortexanalyze_key": "benchmark",
+        "cortexanalyze_analyzer": ANALYZER,
+        "cortexanalyzer_execution_engine": args.engine,
+        "cortexanalyzer_max_in_flight": args.max_in_flight,
+        "cortexanalyzer_pool_size": args.max_in_flight,
+        "cortexanalyzer_manual_hook_enabled": True,
+        "cortexanalyzer_on_create_hook_enabled": True,
+        "cortexanalyzer_on_update_hook_enabled": True,
+        # Every IOC of every batch is sent to Cortex
+        "cortexanalyzer_report_cache_ttl": 0,
+    }
+    values.update(json.loads(args.config))
+
+    configuration = []
+    for param in interface_conf.module_configuration:
+        param = dict(param)
+        if param["param_name"] in values:
+            param["value"] = values[param["param_name"]]
+        configuration.append(param)
+
+    return configuration
+
+
+def make_batch(size, duplicates, first_id):
+    batch = []
+    for index in range(size):
+        duplicate = duplicates and index and (index * 7919 % 1000) < duplicates * 1000
+        value_index = index - 1 if duplicate else index
+        type_name, pattern = IOC_PATTERNS[value_index % len(IOC_PATTERNS)]
+        batch.append(Ioc(first_id + index, pattern(first_id + value_index), type_name))
+
+    return batch
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+def run_batch(interface, writer, cortex, hook, batch, trace_memory=False):
+    writer.reset()
+    requests = cortex.requests
+    gc.collect()
+
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    status = interface.hooks_handler(hook, None, batch)
+    elapsed = time.perf_counter() - start
+
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        # ru_maxrss is in kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    latencies = [report_time - start for report_time in writer.report_times.values()]
+    return {
+        "iocs": len(batch),
+        "success": status.is_success(),
+        "seconds": round(elapsed, 3),
+        "iocs_per_second": round(len(batch) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "reports": len(writer.report_times),
+        "cortex_requests": cortex.requests - requests,
+        "db_commits": writer.commits,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    server_class = MockCortex if args.in_process_server else MockCortexProcess
+    cortex = server_class([ANALYZER], latency=args.latency, failure_rate=args.failure_rate,
+                          report_size=args.report_size, workers=args.cortex_workers)
+    url = cortex.start()
+    writer = install_iris_stubs(module_configuration(args, url))
+
+    from iris_cortexanalyzer_module.IrisCortexanalyzerInterface import IrisCortexanalyzerInterface
+
+    interface = IrisCortexanalyzerInterface()
+    if not args.verbose:
+        interface.log.setLevel(logging.CRITICAL)
+
+    memory_label = "alloc MB" if args.trace_memory else "RSS MB"
+    print(f'{"IOCs":>7} {"seconds":>9} {"IOCs/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"reports":>8} '
+          f'{"requests":>9} {"commits":>8} {memory_label:>8}')
+
+    results = []
+    first_id = 1
+    for size in [int(size) for size in args.sizes.split(",") if size.strip()]:
+        Ioc.registry.clear()
+        interface.message_queue.clear()
+        batch = make_batch(size, args.duplicates, first_id)
+        first_id += size
+
+        result = run_batch(interface, writer, cortex, args.hook, batch,
+                           trace_memory=args.trace_memory)
+        results.append(result)
+        print(f'{result["iocs"]:>7} {result["seconds"]:>9.3f} '
+              f'{result["iocs_per_second"] or 0:>9.1f} '
+              f'{result["p50_ms"]:>9.1f} {result["p99_ms"]:>9.1f} {result["reports"]:>8} '
+              f'{result["cortex_requests"]:>9} {result["db_commits"]:>8} '
+              f'{result["peak_memory_mb"]:>8.2f}')
+
+    cortex.stop()
+
+    if args.json_path:
+        with open(args.json_path, "w") as results_file:
+            json.dump({"settings": vars(args), "results": results}, results_file, indent=2)
+
+    return 0 if all(result["success"] for result in results) or args.failure_rate else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+"""
+Startup benchmark of the module. Measures, in fresh interpreters, what an IRIS worker pays for the
+module: the import of IrisCortexanalyzerInterface, the registration of the hooks, with the
+validation of the configuration against a mock Cortex server, and the first hook dispatches.
+
+    python -m benchmarks.startup_benchmark --repeat 5 --engine threads
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.mock_cortex import MockCortexProcess
+from benchmarks.run_benchmark import ANALYZER, make_batch, module_configuration
+
+# Libraries whose import dominates the startup of the module
+HEAVY_MODULES = ("cortex4py", "requests", "urllib3", "jinja2", "aiohttp", "ijson", "asyncio",
+                 "sqlite3")
+
+# Measured phases, in the order they run
+PHASES = (
+    ("import_ms", "import"),
+    ("register_ms", "register"),
+    ("register_again_ms", "register again"),
+    ("first_dispatch_ms", "1st dispatch"),
+    ("second_dispatch_ms", "2nd dispatch"),
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Startup benchmark of the Cortex Analyzer module")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of fresh interpreters to measure")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads",
+                        help="Execution engine")
+    parser.add_argument("--max-in-flight", type=int, default=16,
+                        help="Maximum number of jobs in flight")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds before a mock job completes")
+    parser.add_argument("--config", default="{}", help="JSON object of extra module settings")
+    parser.add_argument("--json", dest="json_path",
+                        help="Optional path to write the results to as JSON")
+    parser.add_argument("--child", metavar="URL", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def measure(args):
+    """
+    Runs the phases once in the current interpreter, which must not have imported the module yet
+
+    :param args: Parsed arguments, with the URL of the mock Cortex as child
+    :return: Dict of the durations of the phases and of the modules loaded
+    """
+    from tests.iris_stubs import install_iris_stubs
+
+    install_iris_stubs(module_configuration(args, args.child))
+    logging.basicConfig(level=logging.CRITICAL)
+
+    # IRIS has loaded its module interface before it imports any module
+    import iris_interface.IrisModuleInterface  # noqa: F401
+
+    result = {}
+    modules = set(sys.modules)
+
+    start = time.perf_counter()
+    from iris_cortexanalyzer_module.IrisCortexanalyzerInterface import IrisCortexanalyzerInterface
+    result["import_ms"] = (time.perf_counter() - start) * 1000
+    result["modules_imported"] = len(set(sys.modules) - modules)
+    result["heavy_after_import"] = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    interface = IrisCortexanalyzerInterface()
+    interface.log.setLevel(logging.CRITICAL)
+
+    for phase in ("register_ms", "register_again_ms"):
+        start = time.perf_counter()
+        interface.register_hooks(1)
+        result[phase] = (time.perf_counter() - start) * 1000
+
+    result["heavy_after_register"] = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    for position, phase in enumerate(("first_dispatch_ms", "second_dispatch_ms")):
+        start = time.perf_counter()
+        batch = make_batch(1, 0, position + 1)
+        status = interface.hooks_handler("on_manual_trigger_ioc", None, batch)
+        result[phase] = (time.perf_counter() - start) * 1000
+        result["success"] = result.get("success", True) and status.is_success()
+
+    result["heavy_after_dispatch"] = [name for name in HEAVY_MODULES if name in sys.modules]
+    return result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure(args)))
+        return 0
+
+    cortex = MockCortexProcess([ANALYZER], latency=args.latency)
+    url = cortex.start()
+
+    command = [sys.executable, "-m", "benchmarks.startup_benchmark", "--child", url,
+               "--engine", args.engine, "--max-in-flight", str(args.max_in_flight),
+               "--config", args.config]
+    runs = []
+    try:
+        for _ in range(max(1, args.repeat)):
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        cortex.stop()
+
+    print(" ".join(f'{label:>15}' for _, label in PHASES) + f' {"modules":>8}')
+    print(" ".join(f'{statistics.median(run[phase] for run in runs):>15.1f}'
+                   for phase, _ in PHASES)
+          + f' {runs[0]["modules_imported"]:>8}')
+    print(f'Loaded after import: {", ".join(runs[0]["heavy_after_import"]) or "none"}')
+    print(f'Loaded after register: {", ".join(runs[0]["heavy_after_register"]) or "none"}')
+    print(f'Loaded after dispatch: {", ".join(runs[0]["heavy_after_dispatch"]) or "none"}')
+
+    if args.json_path:
+        with open(args.json_path, "w") as results_file:
+            json.dump({"settings": vars(args), "runs": runs}, results_file, indent=2)
+
+    return 0 if all(run["success"] for run in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
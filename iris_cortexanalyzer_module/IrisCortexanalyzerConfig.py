@@ -13,8 +13,14 @@ module_description = "Integrate with Cortex and run any Analyzer. Anaylzer must
 interface_version = 1.1
 module_version = 1.0
 
-pipeline_support = False
-pipeline_info = {}
+pipeline_support = True
+pipeline_info = {
+    "pipeline_internal_name": "cortexanalyzer_pipeline",
+    "pipeline_human_name": "Cortex Analyzer bulk enrichment",
+    "pipeline_args": [],
+    "pipeline_update_support": True,
+    "pipeline_import_support": True
+}
 
 
 module_configuration = [
@@ -37,11 +43,273 @@ module_configuration = [
     {
         "param_name": "cortexanalyze_analyzer",
         "param_human_name": "Cortex Analyzer",
-        "param_description": "Cortex Analyzer to run - I.E VirusTotal_GetReport_3_0",
+        "param_description": "Cortex Analyzer to run - I.E VirusTotal_GetReport_3_0. Several "
+                             "analyzers can be run concurrently by separating them with commas",
         "default": "VirusTotal_GetReport_3_0",
         "mandatory": True,
         "type": "string",
-    },    
+    },
+    {
+        "param_name": "cortexanalyzer_type_analyzers",
+        "param_human_name": "Analyzers per IOC type",
+        "param_description": "Optional JSON object mapping a Cortex dataType to the list of "
+                             "analyzers to run on it - I.E {\"ip\": [\"AbuseIPDB_1_0\", "
+                             "\"Shodan_Host_1_0\"]}. Types not listed use the Cortex Analyzer "
+                             "setting",
+        "default": "{}",
+        "mandatory": False,
+        "type": "textfield_json",
+    },
+    {
+        "param_name": "cortexanalyzer_type_mapping",
+        "param_human_name": "IOC types mapping",
+        "param_description": "Optional JSON object mapping IRIS IOC types to Cortex dataTypes, on "
+                             "top of the default mapping - I.E {\"btc\": \"other\", "
+                             "\"filename|md5\": {\"data_type\": \"hash\", \"part\": 1}}. part "
+                             "selects the part of composite values to analyze. Map a type to null "
+                             "to stop enriching it",
+        "default": "{}",
+        "mandatory": False,
+        "type": "textfield_json",
+    },
+    {
+        "param_name": "cortexanalyzer_execution_engine",
+        "param_human_name": "Execution engine",
+        "param_description": "Set to threads to run each Cortex job in a worker thread, or to "
+                             "asyncio to run all of them on a single event loop. asyncio requires "
+                             "aiohttp, installed with the async extra of the module, and falls "
+                             "back to threads otherwise",
+        "default": "threads",
+        "mandatory": True,
+        "type": "string",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_max_in_flight",
+        "param_human_name": "Max jobs in flight",
+        "param_description": "Maximum number of Cortex jobs submitted and awaited concurrently "
+                             "for one hook call. Set to 1 to process the IOCs one at a time",
+        "default": 4,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_worker_max_in_flight",
+        "param_human_name": "Max jobs in flight per worker",
+        "param_description": "Maximum number of Cortex jobs in flight for all the hook calls "
+                             "handled by a worker process together. Free slots go to manual "
+                             "triggers first, then to IOC updates, then to IOC creations and bulk "
+                             "enrichment, round robin between cases. Only useful when a worker "
+                             "runs several hook calls at once, I.E with a threads or gevent "
+                             "Celery pool, and then best set slightly above the number of jobs "
+                             "Cortex runs at once. Set to 0 to disable",
+        "default": 0,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_pool_size",
+        "param_human_name": "Connection pool size",
+        "param_description": "Maximum number of keep-alive connections to Cortex shared by the "
+                             "hook calls of a worker. Should be at least the max jobs in flight",
+        "default": 10,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_job_timeout",
+        "param_human_name": "Job timeout",
+        "param_description": "Maximum time, in seconds, to wait for a Cortex job to complete",
+        "default": 300,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_request_timeout",
+        "param_human_name": "Request timeout",
+        "param_description": "Maximum time, in seconds, to wait for Cortex to answer a single "
+                             "request, on top of the time a waitreport request is held by Cortex. "
+                             "Set to 0 to wait forever",
+        "default": 30,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_circuit_failure_threshold",
+        "param_human_name": "Circuit breaker failure threshold",
+        "param_description": "Number of consecutive Cortex requests failing with a connection "
+                             "error, a timeout or a server error after which the module stops "
+                             "calling Cortex, and fails the IOCs right away instead of waiting "
+                             "for each timeout. Set to 0 to disable",
+        "default": 5,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_circuit_reset_timeout",
+        "param_human_name": "Circuit breaker reset timeout",
+        "param_description": "Time, in seconds, during which Cortex is not called once the "
+                             "failure threshold is reached. A single probe request is then sent, "
+                             "and Cortex is called again if it succeeds",
+        "default": 30,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_use_waitreport",
+        "param_human_name": "Use Cortex waitreport",
+        "param_description": "Set to True to wait on jobs with the blocking waitreport endpoint "
+                             "of Cortex, with one long request per job. Set to False to poll all "
+                             "the jobs in flight together, with one job search per round, which "
+                             "scales better with hundreds of concurrent IOCs. The module falls "
+                             "back to polling if the endpoint is not available",
+        "default": True,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_analyzer_cache_ttl",
+        "param_human_name": "Analyzers catalogue cache TTL",
+        "param_description": "Time, in seconds, during which the list of analyzers enabled in "
+                             "Cortex is cached. Set to 0 to fetch it for every IOC",
+        "default": 300,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_force_analysis",
+        "param_human_name": "Force analysis",
+        "param_description": "Set to True to force Cortex to run the analyzer even if it has a "
+                             "recent job for the same observable. Set to False to honour the "
+                             "Cortex job cache",
+        "default": True,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_rate_limits",
+        "param_human_name": "Analyzer rate limits",
+        "param_description": "Optional JSON object mapping an analyzer to its sustained rate, in "
+                             "jobs per minute, and burst - I.E {\"VirusTotal_GetReport_3_0\": "
+                             "{\"rate\": 4, \"burst\": 4}}. The jobs of these analyzers are "
+                             "queued and released at that rate by each worker, manual triggers "
+                             "first",
+        "default": "{}",
+        "mandatory": False,
+        "type": "textfield_json",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_rate_limit_retries",
+        "param_human_name": "Rate limit retries",
+        "param_description": "Number of times a job which failed because the analyzer or Cortex "
+                             "ran out of quota is submitted again, with an exponential backoff, "
+                             "before failing the IOC",
+        "default": 3,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_report_stream_threshold",
+        "param_human_name": "Report streaming threshold",
+        "param_description": "Size, in bytes, above which a Cortex report is not loaded in "
+                             "memory. Its response is spooled to disk and only its summary, "
+                             "taxonomies and the fields of large reports are extracted. Requires "
+                             "the ijson package. Set to 0 to always load the reports in full",
+        "default": 5242880,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_report_cache_ttl",
+        "param_human_name": "Report cache TTL",
+        "param_description": "Time, in seconds, during which a report is reused for the same "
+                             "analyzer, type and value without calling Cortex. Manual triggers "
+                             "always fetch a fresh report. Set to 0 to disable the report cache",
+        "default": 3600,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_report_cache_max_mb",
+        "param_human_name": "Report cache size (MB)",
+        "param_description": "Maximum size, in megabytes of JSON, of the reports kept in the "
+                             "report cache of each worker, and in the report cache database. The "
+                             "least recently used reports are evicted first",
+        "default": 64,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_report_cache_path",
+        "param_human_name": "Report cache database",
+        "param_description": "Optional path of a SQLite database storing the report cache on "
+                             "disk, so that it is shared by the workers and survives restarts. "
+                             "Leave empty to cache in memory only",
+        "default": None,
+        "mandatory": False,
+        "type": "string",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_job_journal_path",
+        "param_human_name": "Job journal database",
+        "param_description": "Optional path of a SQLite database journaling the Cortex jobs in "
+                             "flight. The jobs left running by a worker which stopped are resumed "
+                             "instead of submitted again, once their lease of a minute past the "
+                             "Job timeout expired, and a job already running on the same value is "
+                             "reused. Leave empty to disable",
+        "default": None,
+        "mandatory": False,
+        "type": "string",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_metrics_path",
+        "param_human_name": "Metrics file",
+        "param_description": "Optional path of a file the stage timings and counters of the "
+                             "worker are written to, in the Prometheus text format, after each "
+                             "enrichment - I.E for the textfile collector of the node exporter. "
+                             "{pid} is replaced by the PID of the worker. Leave empty to disable",
+        "default": None,
+        "mandatory": False,
+        "type": "string",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_pipeline_batch_size",
+        "param_human_name": "Pipeline batch size",
+        "param_description": "Number of unique values read from the uploaded IOC lists and "
+                             "enriched together by the bulk enrichment pipeline",
+        "default": 500,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
+    {
+        "param_name": "cortexanalyzer_attribute_flush_size",
+        "param_human_name": "Attribute flush size",
+        "param_description": "Number of IOCs whose report attributes are committed to the "
+                             "database together. Set to 1 to commit each IOC on its own",
+        "default": 100,
+        "mandatory": True,
+        "type": "int",
+        "section": "Performance"
+    },
     {
         "param_name": "cortexanalyzer_manual_hook_enabled",
         "param_human_name": "Manual triggers on IOCs",
@@ -69,6 +337,29 @@ module_configuration = [
         "type": "bool",
         "section": "Triggers"
     },
+    {
+        "param_name": "cortexanalyzer_update_freshness",
+        "param_human_name": "Update freshness window",
+        "param_description": "Time, in seconds, during which an updated IOC is not enriched "
+                             "again, unless its value or type changed or an analyzer is missing "
+                             "from its last report. Set to 0 to enrich IOCs on every update",
+        "default": 86400,
+        "mandatory": True,
+        "type": "int",
+        "section": "Triggers"
+    },
+    {
+        "param_name": "cortexanalyzer_deferred_mode",
+        "param_human_name": "Deferred mode",
+        "param_description": "Set to True to only submit the Cortex jobs when an IOC is created "
+                             "or updated, and add the report once they complete, so that IOC "
+                             "saves are not slowed down by the analyzers. Manual triggers still "
+                             "wait for the report",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Triggers"
+    },
     {
         "param_name": "cortexanalyzer_report_as_attribute",
         "param_human_name": "Add cortexanalyzer report as new IOC attribute",
@@ -78,15 +369,112 @@ module_configuration = [
         "mandatory": True,
         "type": "bool",
         "section": "Insights"
+    },
+    {
+        "param_name": "cortexanalyzer_report_storage_mode",
+        "param_human_name": "Report storage mode",
+        "param_description": "Set to full to render the full Cortex report in the IOC attribute. "
+                             "Set to summary to only render the summary and taxonomies. The full "
+                             "report is then not stored on the IOC, and stays available in "
+                             "Cortex",
+        "default": "full",
+        "mandatory": True,
+        "type": "string",
+        "section": "Insights"
+    },
+    {
+        "param_name": "cortexanalyzer_report_max_size",
+        "param_human_name": "Report size cap",
+        "param_description": "Maximum size, in bytes, of the full report stored on an IOC, as "
+                             "compact JSON. In full mode, larger reports are replaced by their "
+                             "summary. Set to 0 to disable the cap",
+        "default": 1048576,
+        "mandatory": True,
+        "type": "int",
+        "section": "Insights"
+    },
+    {
+        "param_name": "cortexanalyzer_report_fields",
+        "param_human_name": "Fields of large reports",
+        "param_description": "Comma separated JSON paths of the report kept, along with its "
+                             "summary and taxonomies, when a report exceeds the streaming "
+                             "threshold - I.E full.verdict,full.score. Array elements are matched "
+                             "with item - I.E full.signatures.item.name",
+        "default": "",
+        "mandatory": False,
+        "type": "string",
+        "section": "Insights"
     },# TODO: careful here, remove backslashes from \{\{ results| tojson(indent=4) \}\}
     {
         "param_name": "cortexanalyzer_domain_report_template",
         "param_human_name": "Cortex Analyzer report template",
-        "param_description": "Cortex Analyzer template used to add a new custom attribute to the target IOC",
+        "param_description": "Cortex Analyzer template used to add a new custom attribute to the "
+                             "target IOC. Also used for the IOC types without a template of their "
+                             "own, I.E the types other than IP, hash, FQDN, URL, mail and "
+                             "filename, and those whose template is left empty",
         "default": "<div class=\"row\">\n    <div class=\"col-12\">\n        <div class=\"accordion\">\n            <h2 class=\"text-center\"><a href=\"https://www.socfortress.co/contact_form.html\">SOCFortress Professional Services</a></h2>\n            <h3>Cortex Analyzer raw results</h3>\n\n            <div class=\"card\">\n                <div class=\"card-header collapsed\" id=\"drop_r_cortexanalyzer\" data-toggle=\"collapse\" data-target=\"#drop_raw_cortexanalyzer\" aria-expanded=\"false\" aria-controls=\"drop_raw_cortexanalyzer\" role=\"button\">\n                    <div class=\"span-icon\">\n                        <div class=\"flaticon-file\"></div>\n                    </div>\n                    <div class=\"span-title\">\n                        Cortex Analyzer results\n                    </div>\n                    <div class=\"span-mode\"></div>\n                </div>\n                <div id=\"drop_raw_cortexanalyzer\" class=\"collapse\" aria-labelledby=\"drop_r_cortexanalyzer\" style=\"\">\n                    <div class=\"card-body\">\n                        <div id='cortexanalyzer_raw_ace'>{{ results| tojson(indent=4) }}</div>\n                    </div>\n                </div>\n            </div>\n        </div>\n    </div>\n</div> \n<script>\nvar cortexanalyzer_in_raw = ace.edit(\"cortexanalyzer_raw_ace\",\n{\n    autoScrollEditorIntoView: true,\n    minLines: 30,\n});\ncortexanalyzer_in_raw.setReadOnly(true);\ncortexanalyzer_in_raw.setTheme(\"ace/theme/tomorrow\");\ncortexanalyzer_in_raw.session.setMode(\"ace/mode/json\");\ncortexanalyzer_in_raw.renderer.setShowGutter(true);\ncortexanalyzer_in_raw.setOption(\"showLineNumbers\", true);\ncortexanalyzer_in_raw.setOption(\"showPrintMargin\", false);\ncortexanalyzer_in_raw.setOption(\"displayIndentGuides\", true);\ncortexanalyzer_in_raw.setOption(\"maxLines\", \"Infinity\");\ncortexanalyzer_in_raw.session.setUseWrapMode(true);\ncortexanalyzer_in_raw.setOption(\"indentedSoftWrap\", true);\ncortexanalyzer_in_raw.renderer.setScrollMargin(8, 5);\n</script> ",
         "mandatory": False,
         "type": "textfield_html",
         "section": "Templates"
+    },
+    {
+        "param_name": "cortexanalyzer_ip_report_template",
+        "param_human_name": "Cortex Analyzer IP report template",
+        "param_description": "Optional template used for IP IOCs. Leave empty to use the Cortex "
+                             "Analyzer report template",
+        "default": "",
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "cortexanalyzer_hash_report_template",
+        "param_human_name": "Cortex Analyzer hash report template",
+        "param_description": "Optional template used for hash IOCs. Leave empty to use the Cortex "
+                             "Analyzer report template",
+        "default": "",
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "cortexanalyzer_fqdn_report_template",
+        "param_human_name": "Cortex Analyzer FQDN report template",
+        "param_description": "Optional template used for FQDN IOCs. Leave empty to use the Cortex "
+                             "Analyzer report template",
+        "default": "",
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "cortexanalyzer_url_report_template",
+        "param_human_name": "Cortex Analyzer URL report template",
+        "param_description": "Optional template used for URL IOCs. Leave empty to use the Cortex "
+                             "Analyzer report template",
+        "default": "",
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "cortexanalyzer_mail_report_template",
+        "param_human_name": "Cortex Analyzer mail report template",
+        "param_description": "Optional template used for mail IOCs. Leave empty to use the Cortex "
+                             "Analyzer report template",
+        "default": "",
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "cortexanalyzer_filename_report_template",
+        "param_human_name": "Cortex Analyzer filename report template",
+        "param_description": "Optional template used for filename IOCs. Leave empty to use the "
+                             "Cortex Analyzer report template",
+        "default": "",
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
     }
-    
-]
\ No newline at end of file
+]
@@ -8,6 +8,7 @@
 #
 #  License MIT
 
+import json
 import traceback
 from pathlib import Path
 
@@ -15,12 +16,27 @@ import iris_interface.IrisInterfaceStatus as InterfaceStatus
 from iris_interface.IrisModuleInterface import IrisPipelineTypes, IrisModuleInterface, IrisModuleTypes
 
 import iris_cortexanalyzer_module.IrisCortexanalyzerConfig as interface_conf
-from iris_cortexanalyzer_module.cortexanalyzer_handler.cortexanalyzer_handler import CortexanalyzerHandler
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import route_value
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_file_parser import IocFileError
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_file_parser import iter_batches
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_file_parser import iter_ioc_values
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_file_parser import iter_unique
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_normalizer import match_key
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_BULK
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import hook_priority
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_PERSIST
+
+# Settings enabling the hooks of the module
+HOOK_SETTINGS = ('cortexanalyzer_on_create_hook_enabled', 'cortexanalyzer_on_update_hook_enabled',
+                 'cortexanalyzer_manual_hook_enabled')
 
 
 class IrisCortexanalyzerInterface(IrisModuleInterface):
     """
-    Provide the interface between Iris and cortexanalyzerHandler
+    Provide the interface between Iris and cortexanalyzerHandler.
+
+    The interface is imported by every IRIS worker, so the handler and the Cortex, HTTP and
+    templating libraries it relies on are only imported once a hook or pipeline needs them.
     """
     name = "IrisCortexanalyzerInterface"
     _module_name = interface_conf.module_name
@@ -31,7 +47,8 @@ class IrisCortexanalyzerInterface(IrisModuleInterface):
     _pipeline_info = interface_conf.pipeline_info
     _module_configuration = interface_conf.module_configuration
     
-    _module_type = IrisModuleTypes.module_processor
+    # Modules providing a pipeline have to be of type pipeline, their hooks still work the same
+    _module_type = IrisModuleTypes.module_pipeline
     
      
     def register_hooks(self, module_id: int):
@@ -43,6 +60,8 @@ class IrisCortexanalyzerInterface(IrisModuleInterface):
         """
         self.module_id = module_id
         module_conf = self.module_dict_conf
+        self._validate_configuration(module_conf)
+
         if module_conf.get('cortexanalyzer_on_create_hook_enabled'):
             status = self.register_to_hook(module_id, iris_hook_name='on_postload_ioc_create')
             if status.is_failure():
@@ -78,6 +97,39 @@ class IrisCortexanalyzerInterface(IrisModuleInterface):
         else:
             self.deregister_from_hook(module_id=self.module_id, iris_hook_name='on_manual_trigger_ioc')
 
+    def _validate_configuration(self, module_conf):
+        """
+        Checks the templates, Cortex and the analyzers once per configuration, and warms the caches
+        of the hooks. Nothing is checked while no hook is enabled, and a failed validation only
+        logs, as the hooks are registered anyway.
+
+        :param module_conf: Module configuration
+        :return: Nothing
+        """
+        if not any(module_conf.get(setting) for setting in HOOK_SETTINGS):
+            self.log.info("No hook enabled. Skipping the validation of the module configuration")
+            return
+
+        if not module_conf.get('cortexanalyze_url') or not module_conf.get('cortexanalyze_key'):
+            self.log.error("The Cortex URL and API key must be set. The hooks are registered, but "
+                           "will fail")
+            return
+
+        try:
+            from iris_cortexanalyzer_module.cortexanalyzer_handler.config_validation import (
+                validate_configuration)
+
+            status = validate_configuration(self._get_handler(module_conf))
+
+        except Exception:
+            self.log.error(traceback.format_exc())
+            self.log.error("Unable to validate the module configuration. The hooks are "
+                           "registered, but may fail")
+            return
+
+        if status.is_failure():
+            self.log.error("The module configuration is not valid. The hooks are registered, but "
+                           "may fail")
 
     def hooks_handler(self, hook_name: str, hook_ui_name: str, data: any):
         """
@@ -90,8 +142,14 @@ class IrisCortexanalyzerInterface(IrisModuleInterface):
         """
 
         self.log.info(f'Received {hook_name}')
-        if hook_name in ['on_postload_ioc_create', 'on_postload_ioc_update', 'on_manual_trigger_ioc']:
-            status = self._handle_ioc(data=data)
+        if hook_name in ['on_postload_ioc_create', 'on_postload_ioc_update']:
+            deferred = self.module_dict_conf.get('cortexanalyzer_deferred_mode') is True
+            status = self._handle_ioc(data=data, deferred=deferred,
+                                      update=hook_name == 'on_postload_ioc_update',
+                                      priority=hook_priority(hook_name))
+
+        elif hook_name == 'on_manual_trigger_ioc':
+            status = self._handle_ioc(data=data, priority=hook_priority(hook_name))
 
         else:
             self.log.critical(f'Received unsupported hook {hook_name}')
@@ -104,46 +162,401 @@ class IrisCortexanalyzerInterface(IrisModuleInterface):
         self.log.info(f"Successfully processed hook {hook_name}")
         return InterfaceStatus.I2Success(data=data, logs=list(self.message_queue))
 
-
-    def _handle_ioc(self, data) -> InterfaceStatus.IIStatus:
+    def _handle_ioc(self, data, deferred=False, update=False,
+                    priority=PRIORITY_BULK) -> InterfaceStatus.IIStatus:
         """
         Handle the IOC data the module just received. The module registered
         to on_postload hooks, so it receives instances of IOC object.
         These objects are attached to a dedicated SQlAlchemy session so data can
         be modified safely.
 
+        The Cortex jobs of all the IOCs and analyzers are run concurrently, up to the
+        configured max in flight. The reports are added to the IOCs on this thread, as
+        the SQLAlchemy session cannot be shared with the workers.
+
+        In deferred mode, the jobs are only submitted and the reports are added later
+        by the deferred completer, so the hook returns at once.
+
+        If the job journal is enabled, the jobs left running by a previous worker are
+        resumed on the first call, instead of being submitted again.
+
+        On update, the IOCs whose last enrichment is still fresh are skipped.
+
+        The jobs share the slots of the worker with the other hook calls, according to their
+        priority class, so that manual triggers are not queued behind bulk enrichment.
+
         :param data: Data associated to the hook, here IOC object
+        :param deferred: Set to True to submit the jobs without waiting for them
+        :param update: Set to True if the IOCs were updated
+        :param priority: Priority class of the jobs - I.E PRIORITY_MANUAL
         :return: IIStatus
         """
 
-        cortexanalyzer_handler = CortexanalyzerHandler(mod_config=self.module_dict_conf,
-                               server_config=self.server_dict_conf,
-                               logger=self.log)
+        cortexanalyzer_handler = self._get_handler(self.module_dict_conf)
+        self._resume_jobs(cortexanalyzer_handler)
 
-        in_status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeNoError)
+        if update:
+            data = self._skip_fresh_iocs(cortexanalyzer_handler, data)
+
+        if deferred:
+            status = self._defer_iocs(cortexanalyzer_handler, data)
+        else:
+            status = self._enrich_iocs(cortexanalyzer_handler, data, priority=priority)
+
+        self._log_metrics(cortexanalyzer_handler)
+        return status
+
+    def _skip_fresh_iocs(self, cortexanalyzer_handler, data):
+        """
+        Returns the updated IOCs which need to be enriched again, I.E those whose value or type
+        changed since their last enrichment, or whose last enrichment is no longer fresh
 
+        :param cortexanalyzer_handler: CortexanalyzerHandler instance
+        :param data: List of IOC objects
+        :return: List of IOC objects
+        """
+        stale = []
+        for element in data:
+            if cortexanalyzer_handler.is_enrichment_fresh(element):
+                self.log.info(f'Skipped {element.ioc_value}: enrichment still fresh and value '
+                              'unchanged')
+            else:
+                stale.append(element)
+
+        if len(stale) < len(data):
+            self.log.info(f'Re-enriching {len(stale)} of {len(data)} updated IOCs')
+
+        return stale
+
+    def _log_metrics(self, cortexanalyzer_handler):
+        """
+        Logs the stage timings and counters of a handler as JSON, so they are returned with the
+        logs of the hook, and exports the metrics of the worker
+
+        :param cortexanalyzer_handler: CortexanalyzerHandler instance
+        :return: Nothing
+        """
+        self.log.info('Cortex enrichment metrics: '
+                      f'{json.dumps(cortexanalyzer_handler.timings.as_dict())}')
+        cortexanalyzer_handler.export_metrics()
+
+    def _get_handler(self, module_conf):
+        """
+        Returns a handler for a module configuration. The handler is imported on the first call
+
+        :param module_conf: Module configuration
+        :return: CortexanalyzerHandler instance
+        """
+        from iris_cortexanalyzer_module.cortexanalyzer_handler.cortexanalyzer_handler import (
+            CortexanalyzerHandler,
+        )
+
+        return CortexanalyzerHandler(mod_config=module_conf, server_config=self.server_dict_conf,
+                                     logger=self.log)
+
+    def _resume_jobs(self, cortexanalyzer_handler):
+        """
+        Resumes the jobs of the job journal left by the workers which stopped, once per worker
+        process
+
+        :param cortexanalyzer_handler: CortexanalyzerHandler instance
+        :return: Nothing
+        """
+        from iris_cortexanalyzer_module.cortexanalyzer_handler.deferred import (
+            resume_journaled_jobs,
+        )
+
+        try:
+            mod_config = cortexanalyzer_handler.mod_config
+            max_workers = int(mod_config.get('cortexanalyzer_max_in_flight') or 1)
+            resumed = resume_journaled_jobs(cortexanalyzer_handler, self.log,
+                                            max_workers=max_workers)
+            if resumed:
+                self.log.info(f'Resumed the Cortex jobs of {resumed} IOCs from the job journal')
+
+        except Exception:
+            self.log.error(traceback.format_exc())
+
+    def _dispatch_iocs(self, cortexanalyzer_handler, data):
+        """
+        Returns the IOCs the module can handle, with their Cortex dataType, report label and
+        the value to analyze. The types are routed with a lookup in the IOC types mapping.
+
+        :param cortexanalyzer_handler: CortexanalyzerHandler instance
+        :param data: List of IOC objects
+        :return: List of (IOC object, Cortex dataType, report label, value to analyze)
+        """
+
+        routes = cortexanalyzer_handler.get_ioc_routes()
+
+        dispatch = []
         for element in data:
             # Check that the IOC we receive is of type the module can handle and dispatch
-            if "domain" in element.ioc_type.type_name:
-                status = cortexanalyzer_handler.handle_domain(ioc=element)
+            route = routes.get(element.ioc_type.type_name)
+            if route is None:
+                self.log.error(f'IOC type {element.ioc_type.type_name} not handled by cortexanalyzer module. Skipping')
+                continue
+
+            self.log.info(f"Getting {route.label} report for {element.ioc_value}")
+            dispatch.append((element, route.data_type, route.label,
+                             route_value(route, element.ioc_value)))
+
+        return dispatch
+
+    def _enrich_iocs(self, cortexanalyzer_handler, data, priority=PRIORITY_BULK,
+                     case=None) -> InterfaceStatus.IIStatus:
+        """
+        Runs the analyzers on a list of IOC objects and adds the reports to them
+
+        :param cortexanalyzer_handler: CortexanalyzerHandler instance
+        :param data: List of IOC objects
+        :param priority: Priority class of the jobs with the scheduler of the worker
+        :param case: Key of the case of the IOCs. Defaults to their case ID, or to this call if
+                     they have none
+        :return: IIStatus
+        """
+        if case is None:
+            case = next((element.case_id for element in data
+                         if getattr(element, 'case_id', None) is not None), None) or object()
+
+        in_status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeNoError)
+        dispatch = self._dispatch_iocs(cortexanalyzer_handler, data)
+        job_journal = cortexanalyzer_handler.get_job_journal()
+
+        iocs = [((element, data_type, label), value, data_type, element.ioc_id)
+                for element, data_type, label, value in dispatch]
+
+        results = cortexanalyzer_handler.analyze_iocs(iocs, priority=priority, case=case)
+        for (element, data_type, label), status in results:
+            if status.get_data():
+                add_status = cortexanalyzer_handler.add_report_attribute(
+                    element, status.get_data(), label, data_type=data_type)
+                in_status = InterfaceStatus.merge_status(in_status, add_status)
+
+            if status.is_failure():
                 in_status = InterfaceStatus.merge_status(in_status, status)
 
-            elif "ip-" in element.ioc_type.type_name:
-                status = cortexanalyzer_handler.handle_ip(ioc=element)
+        in_status = InterfaceStatus.merge_status(in_status,
+                                                 cortexanalyzer_handler.flush_attributes())
+
+        # The jobs leave the journal once their reports are committed
+        if job_journal is not None:
+            for element, _, _, _ in dispatch:
+                job_journal.complete(element.ioc_id)
+
+        return in_status(data=data)
+
+    def _defer_iocs(self, cortexanalyzer_handler, data) -> InterfaceStatus.IIStatus:
+        """
+        Submits the Cortex jobs of a list of IOC objects and hands them over to the deferred
+        completer. A placeholder listing the job IDs is stored on the IOCs until their report
+        is added.
+
+        :param cortexanalyzer_handler: CortexanalyzerHandler instance
+        :param data: List of IOC objects
+        :return: IIStatus
+        """
+        from iris_cortexanalyzer_module.cortexanalyzer_handler.deferred import (
+            get_deferred_completer,
+        )
+        from iris_cortexanalyzer_module.cortexanalyzer_handler.deferred import (
+            render_pending_report,
+        )
+
+        in_status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeNoError)
+        dispatch = self._dispatch_iocs(cortexanalyzer_handler, data)
+        mod_config = cortexanalyzer_handler.mod_config
+        max_workers = int(mod_config.get('cortexanalyzer_max_in_flight') or 1)
+        completer = get_deferred_completer(self.log, max_workers=max_workers)
+
+        iocs = [((element, data_type, label, value), value, data_type, element.ioc_id)
+                for element, data_type, label, value in dispatch]
+
+        deferred = []
+        submissions = cortexanalyzer_handler.submit_iocs(iocs)
+        for (element, data_type, label, value), reports, jobs, status in submissions:
+            if status.is_failure():
                 in_status = InterfaceStatus.merge_status(in_status, status)
 
-            elif element.ioc_type.type_name in ['md5', 'sha224', 'sha256', 'sha512']:
-               status = cortexanalyzer_handler.handle_hash(ioc=element)
-               in_status = InterfaceStatus.merge_status(in_status, status)
+            if not jobs:
+                # Every report came from the cache, or every submission failed
+                if reports:
+                    add_status = cortexanalyzer_handler.add_report_attribute(
+                        element, reports, label, data_type=data_type)
+                    in_status = InterfaceStatus.merge_status(in_status, add_status)
+                continue
 
-            #elif element.ioc_type.type_name in ['md5', 'sha224', 'sha256', 'sha512']:
-            #    status = cortexanalyzer_handler.handle_hash(ioc=element)
-            #    in_status = InterfaceStatus.merge_status(in_status, status)
-            #
-            # elif element.ioc_type.type_name in etc...
+            try:
+                attributes = [("HTML report", "html", render_pending_report(jobs))]
+                cortexanalyzer_handler.run_stage(STAGE_PERSIST, element, attributes)
+            except Exception:
+                self.log.error(traceback.format_exc())
 
-            else:
-                self.log.error(f'IOC type {element.ioc_type.type_name} not handled by cortexanalyzer module. Skipping')
+            deferred.append((element, value, data_type, label, reports, jobs))
+
+        # The placeholders are committed before the completer can write the reports over them
+        in_status = InterfaceStatus.merge_status(in_status,
+                                                 cortexanalyzer_handler.flush_attributes())
+
+        for element, value, data_type, label, reports, jobs in deferred:
+            self.log.info(f'Deferred the Cortex jobs of {element.ioc_value}: {jobs}')
+            completer.enqueue(element.ioc_id, value, data_type, label, reports, jobs,
+                              mod_config, cortexanalyzer_handler.server_config)
 
         return in_status(data=data)
-    
+
+    def pipeline_files_upload(self, base_path, file_handle, case_customer, case_name, is_update):
+        """
+        Saves an IOC list uploaded with the enrichment pipeline
+
+        :param base_path: Path base where the files should be saved
+        :param file_handle: Handle of the file to save
+        :param case_customer: Name of the customer
+        :param case_name: Name of the case
+        :param is_update: True if the call is an update
+        :return: IIStatus
+        """
+        if not base_path or not Path(base_path).is_dir():
+            self.log.error(f'Pipeline path {base_path} is not a directory')
+            return InterfaceStatus.I2Error(f'Pipeline path {base_path} is not a directory')
+
+        # Only keep the name of the file, so that it cannot be saved outside of base_path
+        file_path = Path(base_path, Path(file_handle.filename).name)
+        file_handle.save(file_path)
+        self.log.info(f'Saved {file_path.name} for the enrichment pipeline')
+
+        return InterfaceStatus.I2Success(f'Saved {file_path.name}')
+
+    def pipeline_handler(self, pipeline_type, pipeline_data):
+        """
+        Pipeline handler. Enriches in bulk the IOCs of the case listed in the uploaded files.
+
+        :param pipeline_type: Type of the pipeline to handle
+        :param pipeline_data: Data associated to the pipeline, with the case ID and the path of the
+                              files
+        :return: IIStatus
+        """
+        if pipeline_type not in [IrisPipelineTypes.pipeline_type_import,
+                                 IrisPipelineTypes.pipeline_type_update]:
+            self.log.critical(f'Received unsupported pipeline type {pipeline_type}')
+            return InterfaceStatus.I2Error(logs=list(self.message_queue))
+
+        status = self._pipeline_enrich(case_id=pipeline_data.get('case_id'),
+                                       path=pipeline_data.get('path'))
+        if status.is_failure():
+            self.log.error("Encountered error processing the enrichment pipeline")
+            return InterfaceStatus.I2Error(logs=list(self.message_queue))
+
+        self.log.info("Successfully processed the enrichment pipeline")
+        return InterfaceStatus.I2Success(logs=list(self.message_queue))
+
+    def _pipeline_enrich(self, case_id, path) -> InterfaceStatus.IIStatus:
+        """
+        Stream-parses the IOC values of the uploaded files, deduplicates them, and enriches the
+        matching IOCs of the case in batches of cortexanalyzer_pipeline_batch_size values.
+
+        The values are matched with the IOCs of the case on their normalized form, and with the
+        part of the composite IOCs which is analyzed, I.E the IP of an ip-dst|port IOC. The values
+        without a matching IOC in the case are not enriched, and are listed in the logs.
+
+        :param case_id: ID of the case the files were uploaded to
+        :param path: Path of the uploaded files
+        :return: IIStatus
+        """
+        from app.models import Ioc
+
+        if not path or not Path(path).exists():
+            self.log.error(f'Pipeline path {path} does not exist')
+            return InterfaceStatus.I2Error(f'Pipeline path {path} does not exist')
+
+        module_conf = self.module_dict_conf
+        batch_size = max(1, int(module_conf.get('cortexanalyzer_pipeline_batch_size') or 500))
+        cortexanalyzer_handler = self._get_handler(module_conf)
+        self._resume_jobs(cortexanalyzer_handler)
+
+        case_iocs = self._index_iocs(cortexanalyzer_handler.get_ioc_routes(),
+                                     self._list_case_iocs(case_id))
+
+        in_status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeNoError)
+        values_count = 0
+        enriched_count = 0
+        unmatched_count = 0
+
+        values = iter_unique(iter_ioc_values(path), key=match_key)
+        try:
+            for batch in iter_batches(values, batch_size):
+                values_count += len(batch)
+                ioc_ids = set()
+                unmatched = []
+                for value in batch:
+                    matches = case_iocs.get(match_key(value))
+                    if matches:
+                        ioc_ids.update(matches)
+                    else:
+                        unmatched.append(value)
+
+                if unmatched:
+                    unmatched_count += len(unmatched)
+                    self.log.warning(f'{len(unmatched)} values have no matching IOC in the case '
+                                     f'and are not enriched: {", ".join(unmatched)}')
+
+                iocs = Ioc.query.filter(Ioc.ioc_id.in_(sorted(ioc_ids))).all() if ioc_ids else []
+                enriched_count += len(iocs)
+                self.log.info(f'Enriching {len(iocs)} IOCs of the case matching '
+                              f'{len(batch) - len(unmatched)} values')
+                if iocs:
+                    # The statuses are not merged, as they would keep every batch of IOCs in
+                    # memory
+                    status = self._enrich_iocs(cortexanalyzer_handler, iocs, case=case_id)
+                    if status.is_failure():
+                        in_status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                                             message=status.get_message())
+
+        except IocFileError as e:
+            self.log.error(f'{e}. The values after the error are not enriched')
+            in_status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError, message=str(e))
+
+        self.log.info(f'Read {values_count} unique values, {enriched_count} matching IOCs of the '
+                      f'case, {unmatched_count} values without IOC in the case')
+        self._log_metrics(cortexanalyzer_handler)
+        return in_status
+
+    @staticmethod
+    def _list_case_iocs(case_id):
+        """
+        Returns the ID, value and type name of every IOC of a case, without loading the IOCs
+
+        :param case_id: ID of the case
+        :return: List of (IOC ID, IOC value, IRIS type name)
+        """
+        from app.models import Ioc, IocLink, IocType
+
+        return Ioc.query.with_entities(Ioc.ioc_id, Ioc.ioc_value, IocType.type_name).join(
+            IocLink, IocLink.ioc_id == Ioc.ioc_id
+        ).join(
+            IocType, IocType.type_id == Ioc.ioc_type_id
+        ).filter(
+            IocLink.case_id == case_id
+        ).all()
+
+    @staticmethod
+    def _index_iocs(routes, iocs):
+        """
+        Indexes IOCs by the match keys of their value, and of the part of their value analyzed
+        for their type
+
+        :param routes: Dict of IRIS type name to IocRoute
+        :param iocs: Iterable of (IOC ID, IOC value, IRIS type name)
+        :return: Dict of match key to set of IOC IDs
+        """
+        index = {}
+        for ioc_id, ioc_value, type_name in iocs:
+            keys = {match_key(ioc_value)}
+            route = routes.get(type_name)
+            if route is not None:
+                keys.add(match_key(route_value(route, ioc_value)))
+
+            for key in keys:
+                index.setdefault(key, set()).add(ioc_id)
+
+        return index
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import hashlib
+import threading
+import time
+
+# Catalogues of enabled analyzers, shared by every handler of the worker process.
+# Keyed by (Cortex URL, API key hash), valued by (fetch time, {analyzer name: analyzer id})
+_catalogues = {}
+_catalogues_lock = threading.Lock()
+# Held while a catalogue is fetched, so that concurrent lookups wait for it instead of fetching it
+# too
+_fetch_lock = threading.Lock()
+# Last failed fetch of each catalogue, as (failure time, exception), shared with the lookups which
+# waited for it
+_failures = {}
+
+# Seconds after a fetch during which an analyzer missing from the catalogue is reported missing
+# without fetching the catalogue again
+MISS_REFRESH_INTERVAL = 60
+
+
+def _catalogue_key(url, api_key):
+    return url, hashlib.sha256((api_key or '').encode()).hexdigest()
+
+
+def get_enabled_analyzers(api, url, api_key, ttl=300, refresh=False) -> dict:
+    """
+    Returns the analyzers enabled in Cortex, as a dict of analyzer name to analyzer ID.
+    The catalogue is fetched once and reused until it is older than ttl seconds.
+
+    :param api: cortex4py Api instance used to fetch the catalogue when needed
+    :param url: Cortex URL
+    :param api_key: Cortex API key
+    :param ttl: Time in seconds after which the catalogue is fetched again
+    :param refresh: Set to True to fetch the catalogue even if the cached one is still valid
+    :return: Dict of analyzer name to analyzer ID
+    """
+    key = _catalogue_key(url, api_key)
+
+    with _catalogues_lock:
+        cached = _catalogues.get(key)
+
+    if cached and not refresh and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    requested_at = time.monotonic()
+    with _fetch_lock:
+        with _catalogues_lock:
+            cached = _catalogues.get(key)
+
+        # Another thread fetched it while we were waiting for the lock
+        if cached and cached[0] >= requested_at:
+            return cached[1]
+
+        # Or failed to, in which case Cortex is not asked again by every waiting lookup in turn
+        failed = _failures.get(key)
+        if failed and failed[0] >= requested_at:
+            raise failed[1]
+
+        try:
+            analyzers = {analyzer.name: analyzer.id
+                         for analyzer in api.analyzers.find_all({}, range='all')}
+
+        except Exception as e:
+            _failures[key] = (time.monotonic(), e)
+            raise
+
+        _failures.pop(key, None)
+        with _catalogues_lock:
+            _catalogues[key] = (time.monotonic(), analyzers)
+
+    return analyzers
+
+
+def find_analyzer_id(api, url, api_key, analyzer, ttl=300):
+    """
+    Returns the ID of an enabled analyzer from the catalogue. An analyzer missing from the
+    catalogue triggers a refresh, in case it was enabled since the catalogue was fetched, unless
+    the catalogue is less than MISS_REFRESH_INTERVAL seconds old. The lookups of a missing analyzer
+    thus fetch the catalogue at most once per interval, or once per ttl if shorter.
+
+    :param api: cortex4py Api instance used to fetch the catalogue when needed
+    :param url: Cortex URL
+    :param api_key: Cortex API key
+    :param analyzer: Name of the analyzer
+    :param ttl: Time in seconds after which the catalogue is fetched again
+    :return: ID of the analyzer, or None if it is not enabled
+    """
+    analyzers = get_enabled_analyzers(api, url, api_key, ttl=ttl)
+    if analyzer in analyzers:
+        return analyzers[analyzer]
+
+    with _catalogues_lock:
+        cached = _catalogues.get(_catalogue_key(url, api_key))
+
+    if cached is not None and time.monotonic() - cached[0] >= MISS_REFRESH_INTERVAL:
+        analyzers = get_enabled_analyzers(api, url, api_key, ttl=ttl, refresh=True)
+
+    return analyzers.get(analyzer)
+
+
+def invalidate_analyzers(url, api_key):
+    """
+    Drops the cached catalogue of a Cortex instance, so that the next lookup fetches it again
+
+    :param url: Cortex URL
+    :param api_key: Cortex API key
+    :return: Nothing
+    """
+    with _catalogues_lock:
+        _catalogues.pop(_catalogue_key(url, api_key), None)
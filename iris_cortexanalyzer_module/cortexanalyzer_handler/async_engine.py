@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import traceback
+from contextlib import nullcontext
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitOpenError
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortex_client import CONNECT_TIMEOUT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import JOB_FINAL_STATES
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import AsyncJobTracker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_waiter import JobWaiter
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import RATE_LIMIT_STATUS_CODES
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import is_rate_limited
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_stream import CHUNK_SIZE
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_BULK
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import retry_delay
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_AWAIT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_CORTEX_QUEUE
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_FETCH
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_SUBMIT
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+def is_available() -> bool:
+    """
+    Returns True if the asyncio engine can be used, I.E aiohttp is installed
+    """
+    return aiohttp is not None
+
+
+def is_unavailable(error) -> bool:
+    """
+    Tells whether an aiohttp exception means that Cortex is down or too slow, I.E a connection
+    error, a timeout or a server error, as opposed to an error answered by Cortex for the request.
+    Throttling answers are left to the rate limiting retries.
+
+    :param error: Exception raised by aiohttp
+    :return: bool
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 and error.status not in RATE_LIMIT_STATUS_CODES
+
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+class AsyncSession(object):
+    """
+    aiohttp session kept open to a Cortex instance, with the event loop it is bound to.
+
+    An aiohttp session only lives as long as its event loop, so the loop runs forever on a
+    daemon thread of its own and every runner of the worker runs its jobs on it. The pooled
+    connections to Cortex are thus reused across hook calls, like the ones of the Cortex client.
+    """
+
+    def __init__(self, api_key, pool_size=10, verify_cert=False):
+        self.api_key = api_key
+        self.pool_size = max(1, pool_size)
+        self.verify_cert = verify_cert
+        self._session = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True,
+                                        name="cortexanalyzer-aiohttp")
+        self._thread.start()
+
+    def run(self, coroutine_function):
+        """
+        Runs a coroutine function on the event loop of the session, and waits for its result.
+        Can be called from any thread, including one running an event loop of its own.
+
+        :param coroutine_function: Coroutine function called with the aiohttp session
+        :return: Result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(self._run(coroutine_function), self._loop).result()
+
+    async def _run(self, coroutine_function):
+        # Created on the loop, so that it is bound to it. Nothing is awaited in between, so the
+        # concurrent calls share a single session
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size,
+                                             ssl=None if self.verify_cert else False)
+            self._session = aiohttp.ClientSession(
+                connector=connector, headers={'Authorization': f'Bearer {self.api_key}'},
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT))
+
+        return await coroutine_function(self._session)
+
+
+# Sessions shared by every runner of the worker process, keyed by their settings
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_async_session(url, api_key, pool_size=10, verify_cert=False) -> AsyncSession:
+    """
+    Returns the process-wide aiohttp session matching the settings, creating it if needed
+
+    :param url: Cortex URL
+    :param api_key: Cortex API key
+    :param pool_size: Maximum number of connections kept open to Cortex
+    :param verify_cert: Set to True to verify the certificate of Cortex
+    :return: AsyncSession
+    """
+    # The loop thread does not survive a fork, so forked workers get sessions of their own
+    key = (os.getpid(), url, hashlib.sha256((api_key or '').encode()).hexdigest(), pool_size,
+           verify_cert)
+
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = AsyncSession(api_key, pool_size=pool_size, verify_cert=verify_cert)
+
+        return _sessions[key]
+
+
+class AsyncCortexRunner(object):
+    """
+    Runs Cortex jobs on a single asyncio event loop with aiohttp.
+
+    Submission, waiting and report retrieval of every job are coroutines, so hundreds of
+    jobs can be in flight without a thread per job. Waiting follows the same strategy as
+    JobWaiter: blocking waitreport requests, or polling all the outstanding jobs together
+    with one job search per round. Jobs of rate limited analyzers wait for their token before
+    taking an in-flight slot. With a scheduler, the jobs also wait for a slot of the worker.
+    With a circuit breaker, the requests fail fast while Cortex is unavailable.
+
+    The jobs run on the long-lived session of the Cortex instance, see get_async_session.
+    """
+
+    def __init__(self, url, api_key, logger, proxies=None, verify_cert=False, max_in_flight=4,
+                 pool_size=10, timeout=300, use_waitreport=True, force=True, rate_limiters=None,
+                 retries=0, timings=None, reader=None, scheduler=None, priority=PRIORITY_BULK,
+                 case=None, request_timeout=None, breaker=None):
+        self.url = url
+        self.base_url = f'{url}/api/'
+        self.api_key = api_key
+        self.log = logger
+        self.proxy = (proxies or {}).get('https' if url.startswith('https') else 'http')
+        self.verify_cert = verify_cert
+        self.max_in_flight = max(1, max_in_flight)
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.use_waitreport = use_waitreport
+        self.force = force
+        # Token buckets keyed by analyzer ID, and number of retries of the rate limited jobs
+        self.rate_limiters = {analyzer_id: bucket
+                              for analyzer_id, bucket in (rate_limiters or {}).items()
+                              if bucket is not None}
+        self.retries = retries
+        self.timings = timings
+        # Reads the responses holding reports in chunks, if set
+        self.reader = reader
+        # Slots shared with the other hooks of the worker, and the priority class and case of
+        # the jobs
+        self.scheduler = scheduler
+        self.priority = priority
+        self.case = case
+        # Seconds to wait for an answer of Cortex, and circuit breaker of the Cortex instance
+        self.request_timeout = request_timeout
+        self.breaker = breaker
+        self._tracker = None
+
+    def run(self, jobs, on_submitted=None, on_discarded=None):
+        """
+        Synchronous entry point. Runs the jobs on an event loop and returns once all completed.
+
+        :param jobs: List of (analyzer ID, IOC value, Cortex dataType, job ID). If the job ID is
+                     not None, the job is already in flight and is only waited for
+        :param on_submitted: Optional callback called with the position of a job and its job ID
+                             once it was submitted
+        :param on_discarded: Optional callback called with the position of a job and its job ID
+                             once it failed and is submitted again
+        :return: List of IIStatus, in the order of the jobs, with the Cortex report as data on
+                 success
+        """
+        session = get_async_session(self.url, self.api_key, pool_size=self.pool_size,
+                                    verify_cert=self.verify_cert)
+        return session.run(lambda aiohttp_session: self.run_jobs(aiohttp_session, jobs,
+                                                                 on_submitted, on_discarded))
+
+    async def run_jobs(self, session, jobs, on_submitted=None, on_discarded=None):
+        """
+        Runs the jobs concurrently, up to max_in_flight at once
+
+        :param session: aiohttp session to send the requests with
+        :param jobs: List of (analyzer ID, IOC value, Cortex dataType, job ID)
+        :param on_submitted: Optional callback called with the position of a job and its job ID
+        :param on_discarded: Optional callback called with the position of a job and its job ID
+        :return: List of IIStatus, in the order of the jobs
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._tracker = AsyncJobTracker(
+            lambda method, endpoint, **kwargs: self._request(session, method, endpoint, **kwargs),
+            self.log)
+        return await asyncio.gather(*[
+            self._run_job(session, semaphore, position, job, on_submitted, on_discarded)
+            for position, job in enumerate(jobs)
+        ])
+
+    async def _run_job(self, session, semaphore, position, job, on_submitted, on_discarded):
+        analyzer_id, ioc_value, data_type, job_id = job
+        rate_limiter = self.rate_limiters.get(analyzer_id)
+
+        try:
+            attempt = 0
+            while True:
+                if job_id is None and rate_limiter is not None:
+                    await rate_limiter.acquire_async(self.priority, self.case)
+
+                async with semaphore:
+                    if self.scheduler is not None:
+                        await self.scheduler.acquire_async(self.priority, self.case)
+
+                    try:
+                        status, job_id = await self._run_attempt(
+                            session, position, analyzer_id, ioc_value, data_type, job_id,
+                            on_submitted, can_retry=attempt < self.retries)
+                    finally:
+                        if self.scheduler is not None:
+                            self.scheduler.release()
+
+                if status is not None and (status.is_success() or attempt >= self.retries
+                                           or not is_rate_limited(status.get_message())):
+                    return status
+
+                delay = retry_delay(attempt)
+                self.log.warning(f'Cortex job of {ioc_value} was rate limited. Retrying in '
+                                 f'{delay:.1f} seconds')
+                self._count("retries")
+                # The failed job must not be reused by the IOCs on the same value
+                if job_id is not None and on_discarded is not None:
+                    on_discarded(position, job_id)
+
+                await asyncio.sleep(delay)
+                attempt += 1
+                job_id = None
+
+        except CircuitOpenError as e:
+            self._count("circuit_rejections")
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError, message=str(e))
+
+        except Exception:
+            self.log.error(traceback.format_exc())
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                            message=f'Cortex job failed for {ioc_value}')
+
+    def _measure(self, stage):
+        return self.timings.measure(stage) if self.timings is not None else nullcontext()
+
+    def _count(self, counter):
+        if self.timings is not None:
+            self.timings.count(counter)
+
+    async def _run_attempt(self, session, position, analyzer_id, ioc_value, data_type, job_id,
+                           on_submitted, can_retry):
+        """
+        Submits a job, or reuses the one in flight, and waits for it. Returns the IIStatus and the
+        job ID, the status being None if the submission was throttled and can be retried.
+        """
+        if job_id is not None:
+            self.log.info(f'Reusing job {job_id} in flight for {ioc_value}')
+            return await self._wait(session, {"id": job_id, "status": "InProgress"}), job_id
+
+        try:
+            with self._measure(STAGE_SUBMIT):
+                r_json = await self._submit(session, analyzer_id, ioc_value, data_type)
+
+        except aiohttp.ClientResponseError as e:
+            if can_retry and is_rate_limited(e):
+                return None, None
+            raise
+
+        self.log.info(f'Job ID is: {r_json["id"]}')
+        self._count("jobs_submitted")
+        if on_submitted is not None:
+            on_submitted(position, r_json["id"])
+
+        return await self._wait(session, r_json), r_json["id"]
+
+    def _held_timeout(self, held_for):
+        """
+        Returns the timeout argument of a request which Cortex may hold held_for seconds before
+        answering
+        """
+        if not self.request_timeout:
+            return {}
+
+        return {"timeout": aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT,
+                                                 sock_read=self.request_timeout + held_for)}
+
+    def _guard(self):
+        return self.breaker.guard(is_unavailable) if self.breaker is not None else nullcontext()
+
+    async def _request(self, session, method, endpoint, **kwargs):
+        kwargs = {**self._held_timeout(0), **kwargs}
+        with self._guard():
+            async with session.request(method, f'{self.base_url}{endpoint}', proxy=self.proxy,
+                                       **kwargs) as response:
+                response.raise_for_status()
+                return await response.json()
+
+    async def _request_job(self, session, endpoint, **kwargs):
+        """
+        Returns a job returned with its report by Cortex, read in chunks with the report reader if
+        set
+        """
+        if self.reader is None:
+            return await self._request(session, 'GET', endpoint, **kwargs)
+
+        kwargs = {**self._held_timeout(0), **kwargs}
+        with self._guard():
+            async with session.request('GET', f'{self.base_url}{endpoint}', proxy=self.proxy,
+                                       **kwargs) as response:
+                response.raise_for_status()
+                return await self.reader.read_async(response.content.iter_chunked(CHUNK_SIZE))
+
+    async def _submit(self, session, analyzer_id, ioc_value, data_type):
+        observable = {
+            "data": ioc_value,
+            "dataType": data_type,
+            "tlp": 1,
+            "pap": 2,
+            "message": "custom message sent to analyzer",
+        }
+        params = {"force": 1} if self.force else {}
+
+        return await self._request(session, 'POST', f'analyzer/{analyzer_id}/run', json=observable,
+                                   params=params)
+
+    async def _wait(self, session, r_json):
+        with self._measure(STAGE_AWAIT):
+            r_json = await self._await_job(session, r_json)
+
+        job_id = r_json["id"]
+        job_state = r_json.get("status")
+        if job_state == "Success":
+            self.log.info("Job completed successfully")
+            if self.timings is not None and isinstance(r_json.get("createdAt"), (int, float)) \
+                    and isinstance(r_json.get("startDate"), (int, float)):
+                queued = max(0, r_json["startDate"] - r_json["createdAt"]) / 1000
+                self.timings.add(STAGE_CORTEX_QUEUE, queued)
+
+            if "report" not in r_json:
+                with self._measure(STAGE_FETCH):
+                    r_json = await self._request_job(session, f'job/{job_id}/report')
+
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                            data=r_json["report"])
+
+        if job_state in JOB_FINAL_STATES:
+            error_message = r_json.get("errorMessage") \
+                or r_json.get("report", {}).get("errorMessage")
+            self.log.error(f'Cortex Failure: {error_message}')
+            self._count("job_failures")
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                            message=f'Cortex Failure: {error_message}')
+
+        self.log.error(f'Job {job_id} failed to complete after {self.timeout} seconds.')
+        self._count("timeouts")
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                        message=f'Job failed to complete after {self.timeout} '
+                                                'seconds.')
+
+    async def _await_job(self, session, r_json):
+        job_id = r_json["id"]
+        deadline = time.monotonic() + self.timeout
+
+        if self.use_waitreport:
+            try:
+                while r_json.get("status") not in JOB_FINAL_STATES:
+                    remaining = int(deadline - time.monotonic())
+                    if remaining < 1:
+                        break
+
+                    at_most = min(remaining, JobWaiter.waitreport_slice)
+                    r_json = await self._request_job(session, f'job/{job_id}/waitreport',
+                                                     params={"atMost": f'{at_most}seconds'},
+                                                     **self._held_timeout(at_most))
+
+            except aiohttp.ClientResponseError as e:
+                if e.status in (404, 405):
+                    self.log.warning(f'waitreport is not available ({e.status}). Falling back to '
+                                     'polling')
+                    self.use_waitreport = False
+                else:
+                    # Most likely transient, so only this job is polled
+                    self.log.warning(f'waitreport failed for job {job_id} ({e.status}). Polling '
+                                     'the job')
+
+        if r_json.get("status") not in JOB_FINAL_STATES:
+            r_json = await self._tracker.wait(r_json, max(0.0, deadline - time.monotonic()))
+
+        return r_json
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import threading
+import traceback
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+
+
+class AttributeBatch(object):
+    """
+    Collects the attribute fields written to IOCs and persists them in one transaction per
+    flush_size IOCs, instead of the commit per field of add_tab_attribute_field.
+
+    The fields are set on the custom attributes of the IOCs right away, the same way as
+    add_tab_attribute_field does. Only the commit is deferred, until flush_size IOCs are pending
+    or flush is called. A flush_size of 1 commits every IOC on its own.
+    """
+
+    def __init__(self, flush_size=100, logger=None):
+        self.flush_size = max(1, int(flush_size or 1))
+        self.log = logger
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, obj, tab_name, fields) -> InterfaceStatus.IIStatus:
+        """
+        Sets fields in a tab of the custom attributes of an object, and commits the pending
+        objects once flush_size of them are waiting
+
+        :param obj: IOC instance
+        :param tab_name: Name of the attributes tab
+        :param fields: List of (field name, field type, field value)
+        :return: IIStatus of the flush, if one was triggered
+        """
+        from sqlalchemy.orm.attributes import flag_modified
+
+        with self._lock:
+            attributes = dict(obj.custom_attributes or {})
+            tab = dict(attributes.get(tab_name) or {})
+            for field_name, field_type, field_value in fields:
+                tab[field_name] = {
+                    "type": field_type,
+                    "value": field_value,
+                    "mandatory": False,
+                }
+
+            attributes[tab_name] = tab
+            obj.custom_attributes = attributes
+            flag_modified(obj, "custom_attributes")
+
+            self._pending[id(obj)] = obj
+            if len(self._pending) < self.flush_size:
+                return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess)
+
+        return self.flush()
+
+    def flush(self) -> InterfaceStatus.IIStatus:
+        """
+        Commits the pending objects in one transaction. The transaction is rolled back on failure.
+
+        :return: IIStatus
+        """
+        from app import db
+
+        with self._lock:
+            if not self._pending:
+                return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess)
+
+            count = len(self._pending)
+            self._pending = {}
+
+            try:
+                db.session.commit()
+
+            except Exception:
+                db.session.rollback()
+                if self.log is not None:
+                    self.log.error(f'Unable to persist the attributes of {count} IOCs')
+                    self.log.error(traceback.format_exc())
+                return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                                message='Unable to persist the attributes of '
+                                                        f'{count} IOCs',
+                                                data=traceback.format_exc())
+
+        if self.log is not None:
+            self.log.info(f'Persisted the attributes of {count} IOCs')
+
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import threading
+import time
+from contextlib import contextmanager
+
+from cortex4py.exceptions import CortexException
+
+# States of a circuit breaker
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(CortexException):
+    """
+    Raised instead of sending a request to Cortex while its circuit is open
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to a Cortex instance which is down or too slow to answer.
+
+    The circuit is closed while Cortex answers. After failure_threshold consecutive failed
+    requests, I.E connection errors, timeouts or server errors, it opens: the requests then
+    fail right away with CircuitOpenError instead of each waiting for its own timeout. Once
+    reset_timeout seconds passed, the circuit is half-open and a single probe request goes
+    through. It closes again if the probe succeeds, and opens for another reset_timeout
+    seconds otherwise. Every state change is logged.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, logger=None):
+        """
+        :param name: Name of the protected service in the logs - I.E the Cortex URL
+        :param failure_threshold: Number of consecutive failures opening the circuit
+        :param reset_timeout: Seconds the circuit stays open before a probe is let through
+        :param logger: Logger
+        """
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = max(0, reset_timeout)
+        self.log = logger
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def is_available(self) -> bool:
+        """
+        Tells whether a request could go through now, without taking the probe of a half-open
+        circuit
+
+        :return: False while the circuit is open, or half-open with its probe in flight
+        """
+        with self._lock:
+            if self._state == STATE_OPEN:
+                return self.retry_after() <= 0
+            return not (self._state == STATE_HALF_OPEN and self._probing)
+
+    def retry_after(self) -> float:
+        """
+        Returns the number of seconds before the open circuit lets a probe through, 0 if it is not
+        open
+        """
+        if self._state != STATE_OPEN:
+            return 0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        Tells whether a request may be sent, and takes the probe of the circuit if it is due.
+        The outcome of an allowed request must be recorded with record.
+
+        :return: bool
+        """
+        with self._lock:
+            if self._state == STATE_CLOSED:
+                return True
+
+            if self._state == STATE_OPEN:
+                if self.retry_after() > 0:
+                    return False
+                self._set_state(STATE_HALF_OPEN)
+
+            if self._probing:
+                return False
+
+            self._probing = True
+            return True
+
+    def check(self):
+        """
+        Raises CircuitOpenError unless a request may be sent, see allow
+        """
+        if not self.allow():
+            raise CircuitOpenError(f'Cortex at {self.name} is unavailable. Requests are suspended '
+                                   f'for {self.retry_after():.0f} more seconds')
+
+    def record(self, success):
+        """
+        Records the outcome of an allowed request
+
+        :param success: True if Cortex answered, False if the request failed, None if it was
+                        cancelled and tells nothing about Cortex
+        :return: Nothing
+        """
+        with self._lock:
+            probe = self._state == STATE_HALF_OPEN and self._probing
+            if probe:
+                self._probing = False
+
+            if success is None:
+                return
+
+            if success:
+                self._failures = 0
+                if self._state != STATE_CLOSED:
+                    self._set_state(STATE_CLOSED)
+                return
+
+            self._failures += 1
+            if probe or (self._state == STATE_CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._set_state(STATE_OPEN)
+
+    @contextmanager
+    def guard(self, is_failure):
+        """
+        Runs a request in the block if the circuit allows it, and records its outcome.
+        Raises CircuitOpenError otherwise.
+
+        :param is_failure: Callable telling whether an exception raised by the request means that
+                           Cortex is unavailable, as opposed to an error answered by Cortex
+        """
+        self.check()
+        try:
+            yield
+
+        except Exception as e:
+            self.record(not is_failure(e))
+            raise
+
+        except BaseException:
+            self.record(None)
+            raise
+
+        self.record(True)
+
+    def _set_state(self, state):
+        """
+        Changes the state of the circuit. Must be called with the lock held.
+        """
+        previous, self._state = self._state, state
+        if self.log is None:
+            return
+
+        if state == STATE_OPEN:
+            self.log.warning(f'Cortex circuit {previous} -> open for {self.name} after '
+                             f'{self._failures} consecutive failures. Failing fast for '
+                             f'{self.reset_timeout} seconds')
+        elif state == STATE_HALF_OPEN:
+            self.log.info(f'Cortex circuit open -> half-open for {self.name}. Probing Cortex')
+        else:
+            self.log.info(f'Cortex circuit {previous} -> closed for {self.name}. Cortex is '
+                          'available again')
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url, failure_threshold=5, reset_timeout=30, logger=None) -> CircuitBreaker:
+    """
+    Returns the process-wide circuit breaker of a Cortex instance, creating it on first use
+
+    :param url: Cortex URL
+    :param failure_threshold: Number of consecutive failures opening the circuit
+    :param reset_timeout: Seconds the circuit stays open before a probe is let through
+    :param logger: Logger used by the breaker
+    :return: CircuitBreaker
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(url)
+        if breaker is None:
+            breaker = _breakers[url] = CircuitBreaker(url, failure_threshold, reset_timeout,
+                                                      logger)
+        else:
+            breaker.failure_threshold = max(1, failure_threshold)
+            breaker.reset_timeout = max(0, reset_timeout)
+
+        return breaker
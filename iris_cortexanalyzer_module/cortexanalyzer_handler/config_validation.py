@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import hashlib
+import json
+import threading
+import time
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.analyzer_cache import get_enabled_analyzers
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import parse_rate_limits
+
+# Seconds after which a failed validation is run again for the same configuration.
+# Successful validations are kept until the configuration changes
+FAILURE_TTL = 60
+
+# Results of the validations of the worker, keyed by the fingerprint of the configuration,
+# valued by (validation time, IIStatus)
+_validations = {}
+_validations_lock = threading.Lock()
+
+
+def configuration_key(mod_config, server_config) -> str:
+    """
+    Returns the fingerprint of a module and server configuration
+
+    :param mod_config: Module configuration
+    :param server_config: Server configuration
+    :return: Hex digest
+    """
+    settings = json.dumps([mod_config, server_config], sort_keys=True, default=str)
+    return hashlib.sha256(settings.encode()).hexdigest()
+
+
+def validate_configuration(handler, refresh=False) -> InterfaceStatus.IIStatus:
+    """
+    Checks the configuration of a handler: the report templates compile, Cortex answers with the
+    configured key, and every analyzer configured for the enriched IOC types is enabled in Cortex.
+
+    The result is cached for the configuration, as IRIS registers the hooks again every time a
+    parameter is saved. The catalogue of analyzers fetched on the way is kept in the analyzers
+    cache of the worker.
+
+    :param handler: CortexanalyzerHandler instance
+    :param refresh: Set to True to validate again even if the configuration was already validated
+    :return: IIStatus, with the list of the problems found as data
+    """
+    key = configuration_key(handler.mod_config, handler.server_config)
+
+    with _validations_lock:
+        cached = _validations.get(key)
+
+    if cached and not refresh and (cached[1].is_success()
+                                   or time.monotonic() - cached[0] < FAILURE_TTL):
+        handler.log.info("Module configuration already validated")
+        return cached[1]
+
+    problems = _check(handler)
+    if problems:
+        for problem in problems:
+            handler.log.error(problem)
+        status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                          message="; ".join(problems),
+                                          data=problems)
+    else:
+        handler.log.info("Module configuration validated")
+        status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                          data=[])
+
+    with _validations_lock:
+        _validations[key] = (time.monotonic(), status)
+
+    return status
+
+
+def _check(handler):
+    """
+    Returns the list of the problems of the configuration of a handler
+    """
+    problems = []
+
+    if handler.compile_report_templates().is_failure():
+        problems.append("Unable to compile the report templates. Check the module configuration")
+
+    problems.extend(parse_rate_limits(handler.mod_config.get("cortexanalyzer_rate_limits"))[1])
+
+    url = handler.mod_config.get("cortexanalyze_url")
+    api_key = handler.mod_config.get("cortexanalyze_key")
+    if not url or not api_key:
+        problems.append("The Cortex URL and API key must be set")
+        return problems
+
+    ttl = int(handler.mod_config.get("cortexanalyzer_analyzer_cache_ttl") or 0)
+    try:
+        enabled = get_enabled_analyzers(handler.cortexanalyzer, url, api_key, ttl=ttl,
+                                        refresh=True)
+
+    except Exception as e:
+        problems.append(f'Unable to reach Cortex at {url} with the configured API key: {e}')
+        return problems
+
+    missing = [analyzer for analyzer in handler.get_configured_analyzers()
+               if analyzer not in enabled]
+    if missing:
+        problems.append(f'Analyzers not enabled in Cortex: {", ".join(missing)}')
+
+    return problems
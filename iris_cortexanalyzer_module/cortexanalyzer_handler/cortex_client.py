@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import hashlib
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from cortex4py.api import Api
+from cortex4py.exceptions import AuthenticationError
+from cortex4py.exceptions import AuthorizationError
+from cortex4py.exceptions import CortexError
+from cortex4py.exceptions import InvalidInputError
+from cortex4py.exceptions import NotFoundError
+from cortex4py.exceptions import ServerError
+from cortex4py.exceptions import ServiceUnavailableError
+from requests.adapters import HTTPAdapter
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import RATE_LIMIT_STATUS_CODES
+
+# Seconds allowed to open a connection to Cortex
+CONNECT_TIMEOUT = 10
+
+
+def is_unavailable(error) -> bool:
+    """
+    Tells whether a requests exception means that Cortex is down or too slow, I.E a connection
+    error, a timeout or a server error, as opposed to an error answered by Cortex for the request.
+    Throttling answers are left to the rate limiting retries.
+
+    :param error: Exception raised by requests
+    :return: bool
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+
+    response = getattr(error, "response", None)
+    return (response is not None and response.status_code >= 500
+            and response.status_code not in RATE_LIMIT_STATUS_CODES)
+
+
+def held_for(endpoint, params) -> int:
+    """
+    Returns the number of seconds Cortex may hold a request before answering, I.E the atMost
+    duration of a waitreport request, 0 for the other requests. atMost is read from the query
+    parameters, or from the query string of the endpoint as cortex4py builds it.
+
+    :param endpoint: Endpoint of the request, relative to the API
+    :param params: Query parameters of the request
+    :return: int
+    """
+    path, query = urlsplit(endpoint)[2:4]
+    at_most = str((params or {}).get('atMost') or parse_qs(query).get('atMost', [''])[0])
+    if not path.endswith('/waitreport') or not at_most.endswith('seconds'):
+        return 0
+
+    try:
+        return int(at_most[:-len('seconds')])
+    except ValueError:
+        return 0
+
+
+def raise_cortex_error(error):
+    """
+    Raises the cortex4py exception matching a requests exception, as the cortex4py client does,
+    with the requests exception as its cause
+
+    :param error: Exception raised while sending a request
+    :return: Nothing, always raises
+    """
+    if isinstance(error, requests.HTTPError):
+        status_code = error.response.status_code
+        if status_code == 404:
+            raise NotFoundError("Resource not found") from error
+        if status_code == 401:
+            raise AuthenticationError("Authentication error") from error
+        if status_code == 403:
+            raise AuthorizationError("Authorization error") from error
+        raise InvalidInputError("Invalid input exception") from error
+
+    if isinstance(error, requests.ConnectionError):
+        raise ServiceUnavailableError("Cortex service is unavailable") from error
+
+    if isinstance(error, requests.RequestException):
+        raise ServerError("Cortex request exception") from error
+
+    raise CortexError("Unexpected exception") from error
+
+
+class CortexClient(Api):
+    """
+    cortex4py Api sending its requests through a keep-alive requests session.
+
+    cortex4py opens a new connection, and thus does a new TLS handshake, for every request.
+    This client keeps up to pool_size connections open to Cortex and reuses them for every
+    request, from any thread.
+
+    Requests time out after timeout seconds without an answer, plus the time Cortex may hold
+    a waitreport request, and go through the circuit breaker of the Cortex instance if one is
+    set, so that they fail fast while it is down.
+    """
+
+    def __init__(self, url, api_key, pool_size=10, timeout=None, breaker=None, **kwargs):
+        super().__init__(url, api_key, **kwargs)
+        self.base_url = f'{url}/api/'
+        self.proxies = kwargs.get('proxies', {})
+
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {api_key}'
+        self.session.verify = kwargs.get('verify_cert', kwargs.get('cert', True))
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.timeout = timeout
+        self.breaker = breaker
+
+    def _request(self, method, endpoint, **kwargs):
+        if self.timeout:
+            read_timeout = self.timeout + held_for(endpoint, kwargs.get('params'))
+            kwargs.setdefault('timeout', (CONNECT_TIMEOUT, read_timeout))
+
+        if self.breaker is None:
+            return self._send(method, endpoint, **kwargs)
+
+        with self.breaker.guard(lambda ex: is_unavailable(ex.__cause__)):
+            return self._send(method, endpoint, **kwargs)
+
+    def _send(self, method, endpoint, **kwargs):
+        try:
+            # Proxies are given per request, as requests lets the environment override the
+            # session ones
+            response = self.session.request(method, f'{self.base_url}{endpoint}',
+                                            proxies=self.proxies, **kwargs)
+            response.raise_for_status()
+            return response
+
+        except Exception as ex:
+            raise_cortex_error(ex)
+
+    def do_get(self, endpoint, params={}):
+        return self._request('GET', endpoint, params=params)
+
+    def do_get_stream(self, endpoint, params={}):
+        """
+        Sends a GET request without reading its body, so that it can be read in chunks.
+        The response must be closed by the caller.
+        """
+        return self._request('GET', endpoint, params=params, stream=True)
+
+    def do_file_post(self, endpoint, data, **kwargs):
+        return self._request('POST', endpoint, data=data, **kwargs)
+
+    def do_post(self, endpoint, data, params={}, **kwargs):
+        return self._request('POST', endpoint, json=data, params=params, **kwargs)
+
+    def do_patch(self, endpoint, data, params={}):
+        return self._request('PATCH', endpoint, json=data, params=params)
+
+    def do_delete(self, endpoint):
+        self._request('DELETE', endpoint)
+        return True
+
+
+# Clients shared by every handler of the worker process, keyed by their settings
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_cortex_client(url, api_key, proxies=None, pool_size=10, verify_cert=False, timeout=None,
+                      breaker=None) -> CortexClient:
+    """
+    Returns the process-wide Cortex client matching the settings, creating it if needed. The
+    timeout and breaker are part of the settings, so that a client is never changed while
+    another handler uses it
+
+    :param url: Cortex URL
+    :param api_key: Cortex API key
+    :param proxies: Dict of proxies to use, as expected by requests
+    :param pool_size: Maximum number of connections kept open to Cortex
+    :param verify_cert: Set to True to verify the certificate of Cortex
+    :param timeout: Seconds to wait for an answer of Cortex. None waits forever
+    :param breaker: CircuitBreaker of the Cortex instance, if any
+    :return: CortexClient
+    """
+    proxies = proxies or {}
+    key = (url, hashlib.sha256((api_key or '').encode()).hexdigest(),
+           tuple(sorted(proxies.items())), pool_size, verify_cert, timeout, id(breaker))
+
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = CortexClient(url, api_key, pool_size=pool_size, timeout=timeout,
+                                         breaker=breaker, proxies=proxies,
+                                         verify_cert=verify_cert)
+
+        return _clients[key]
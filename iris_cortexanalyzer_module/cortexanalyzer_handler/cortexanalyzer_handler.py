@@ -10,46 +10,137 @@
 
 
 import traceback
-import asyncio
-import urllib3
-import cortex4py
-import json
-import requests
+import threading
 import time
-from cortex4py.api import Api
-from jinja2 import Template
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from cortex4py.exceptions import CortexException, NotFoundError
 
 import iris_interface.IrisInterfaceStatus as InterfaceStatus
-from app.datamgmt.manage.manage_attribute_db import add_tab_attribute_field
+from iris_cortexanalyzer_module.cortexanalyzer_handler.attribute_batch import AttributeBatch
+from iris_cortexanalyzer_module.cortexanalyzer_handler.analyzer_cache import find_analyzer_id
+from iris_cortexanalyzer_module.cortexanalyzer_handler.analyzer_cache import invalidate_analyzers
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitOpenError
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import get_circuit_breaker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortex_client import get_cortex_client
+from iris_cortexanalyzer_module.cortexanalyzer_handler.enrichment_fingerprint import (
+    FINGERPRINT_FIELD,
+)
+from iris_cortexanalyzer_module.cortexanalyzer_handler.enrichment_fingerprint import is_fresh
+from iris_cortexanalyzer_module.cortexanalyzer_handler.enrichment_fingerprint import (
+    make_fingerprint,
+)
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import DEFAULT_ROUTES
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import get_routes
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_normalizer import group_iocs
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_journal import get_job_journal
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_waiter import JOB_FINAL_STATES
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_waiter import JobWaiter
+from iris_cortexanalyzer_module.cortexanalyzer_handler.metrics import get_metrics_registry
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import get_rate_limiter
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import is_rate_limited
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import parse_rate_limits
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import retry_delay
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_cache import cache_source
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_cache import get_report_cache
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_storage import STORAGE_FULL
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_storage import STORAGE_SUMMARY
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_storage import bound_results
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_storage import summarize_report
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_stream import ReportReader
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_templates import get_template
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_BULK
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_MANUAL
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import get_job_scheduler
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_AWAIT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_CLIENT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_CORTEX_QUEUE
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_FETCH
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_PERSIST
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_RENDER
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_RESOLVE
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_SUBMIT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import StageTimings
+
+
+class _JobContext(threading.local):
+    """
+    Priority class, case and scheduler of the job run by the current thread
+    """
+    priority = PRIORITY_BULK
+    case = None
+    scheduler = None
 
 
 class CortexanalyzerHandler(object):
-    def __init__(self, mod_config, server_config, logger):
+    """
+    Enriches IOCs of any type with Cortex. Every IOC goes through the same stages: resolve
+    the analyzer, submit the job, await it, fetch the report, render it and persist it on
+    the IOC. The per-type behavior, I.E the dataType, analyzers and template, comes from the
+    module configuration. Each stage can be replaced with the stages argument, and is timed.
+
+    The persisted attributes are committed in batches of cortexanalyzer_attribute_flush_size
+    IOCs. Callers must call flush_attributes once they are done with the handler.
+    """
+
+    def __init__(self, mod_config, server_config, logger, stages=None):
         self.mod_config = mod_config
         self.server_config = server_config
-        self.cortexanalyzer = self.get_cortexanalyzer_instance()
         self.log = logger
+        self.timings = StageTimings(registry=get_metrics_registry())
+        with self.timings.measure(STAGE_CLIENT):
+            self.cortexanalyzer = self.get_cortexanalyzer_instance()
+        self.attributes = AttributeBatch(
+            flush_size=int(mod_config.get("cortexanalyzer_attribute_flush_size") or 1),
+            logger=logger,
+        )
+
+        self.stages = {
+            STAGE_RESOLVE: self.resolve_analyzer,
+            STAGE_SUBMIT: self.submit_job,
+            STAGE_AWAIT: self.await_job,
+            STAGE_FETCH: self.fetch_report,
+            STAGE_RENDER: self.render_report,
+            STAGE_PERSIST: self.persist_report,
+        }
+        self.stages.update(stages or {})
+        self._custom_stages = set(stages or {})
+        self._job = _JobContext()
+        self._rate_limits = None
+
+    def run_stage(self, stage, *args, **kwargs):
+        """
+        Runs a stage of the enrichment and adds its duration to the timings
+
+        :param stage: Name of the stage
+        :return: Result of the stage
+        """
+        with self.timings.measure(stage):
+            return self.stages[stage](*args, **kwargs)
 
     def get_cortexanalyzer_instance(self):
         """
-        Returns an cortexanalyzer API instance depending if the key is premium or not
+        Returns a Cortex API client. The client is shared by every handler of the worker with
+        the same URL, key and proxies, so its pooled connections are reused across hook calls.
+        Its requests go through the circuit breaker of the Cortex instance.
 
-        :return: { cookiecutter.keyword }} Instance
+        :return: CortexClient instance
         """
-        url = self.mod_config.get('cortexanalyzer_url')
-        key = self.mod_config.get('cortexanalyzer_key')
+        url = self.mod_config.get('cortexanalyze_url')
+        key = self.mod_config.get('cortexanalyze_key')
+        pool_size = int(self.mod_config.get('cortexanalyzer_pool_size') or 10)
         proxies = {}
 
         if self.server_config.get('http_proxy'):
-            proxies['https'] = self.server_config.get('HTTPS_PROXY')
+            proxies['http'] = self.server_config.get('http_proxy')
 
         if self.server_config.get('https_proxy'):
-            proxies['http'] = self.server_config.get('HTTP_PROXY')
+            proxies['https'] = self.server_config.get('https_proxy')
 
-        # TODO!
-        # Here get your cortexanalyzer instance and return it
-        # ex: return cortexanalyzerApi(url, key)
-        return "<TODO>"
+        return get_cortex_client(url, key, proxies=proxies, pool_size=pool_size, verify_cert=False,
+                                 timeout=self.get_request_timeout(),
+                                 breaker=self.get_circuit_breaker())
 
     def gen_report_from_template(
         self, html_template, cortexanalyzer_report
@@ -60,12 +151,11 @@ class CortexanalyzerHandler(object):
         :param misp_report: The JSON report fetched with cortexanalyze API
         :return: InterfaceStatus
         """
-        template = Template(html_template)
-        context = cortexanalyzer_report
         pre_render = dict({"results": []})
         pre_render["results"] = cortexanalyzer_report
 
         try:
+            template = get_template(html_template)
             rendered = template.render(pre_render)
 
         except Exception:
@@ -75,362 +165,998 @@ class CortexanalyzerHandler(object):
 
         return InterfaceStatus.I2Success(data=rendered)
 
-    def handle_domain(self, ioc):
+    def analyze_iocs(self, iocs, max_in_flight=None, priority=PRIORITY_BULK, case=None):
         """
-        Handles an IOC of type domain and adds Cortex Analyzer insights
-        :param ioc: IOC instance
-        :return: IIStatus
+        Runs every analyzer configured for their type on a list of IOC values. The values are
+        normalized and deduplicated first, so equivalent IOCs share a single job per analyzer.
+        All the (value, analyzer) jobs are run concurrently, up to max_in_flight at once, and the
+        results of the IOCs of a value are yielded as soon as all of its analyzers completed.
+        Nothing here touches the IRIS database session, so the jobs run in worker threads.
+        The jobs also take their slots from the scheduler shared by all the hooks of the worker.
+
+        :param iocs: List of (key, IOC value, Cortex dataType, IOC ID). The key is yielded back
+                     with the results. The IOC ID, which may be None, is recorded in the job
+                     journal
+        :param max_in_flight: Maximum number of jobs run at once. Defaults to the module
+                              configuration
+        :param priority: Priority class of the jobs with the scheduler - I.E PRIORITY_MANUAL
+        :param case: Key of the case of the IOCs, so that the scheduler shares the slots fairly
+                     between cases
+        :return: Generator of (key, IIStatus), with a dict of analyzer name to Cortex report as
+                 data. The status is a failure if any analyzer failed, but holds the reports of the
+                 others.
         """
+        if max_in_flight is None:
+            max_in_flight = int(self.mod_config.get("cortexanalyzer_max_in_flight") or 1)
+
+        groups = self._group_iocs(iocs)
+
+        jobs = []
+        for index, (ioc_value, data_type, members) in enumerate(groups):
+            analyzers = self.get_analyzers(data_type)
+            if not analyzers:
+                self.log.error(f'No analyzer configured for type {data_type}')
+                for key, _ in members:
+                    yield key, InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                                        message='No analyzer configured for type '
+                                                                f'{data_type}')
+                continue
+
+            # Jobs are journaled with the first IOC of the value
+            for analyzer in analyzers:
+                jobs.append((index, analyzer, ioc_value, data_type, members[0][1]))
+
+        if not jobs:
+            return
+
+        breaker = self.get_circuit_breaker()
+        if breaker is not None and not breaker.is_available():
+            # Cortex is down, so the IOCs fail right away instead of holding slots until their
+            # timeouts
+            message = ('Cortex is unavailable. Requests are suspended for '
+                       f'{breaker.retry_after():.0f} more seconds')
+            self.log.warning(f'{message}. Skipping {len(groups)} IOC values')
+            self.timings.count("circuit_rejections", len(jobs))
+            for index in sorted({index for index, *_ in jobs}):
+                for key, _ in groups[index][2]:
+                    yield key, InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                                        message=message)
+            return
+
+        pending = {}
+        results = {}
+        for index, _, _, _, _ in jobs:
+            pending[index] = pending.get(index, 0) + 1
+            results[index] = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess,
+                                                      message="Success", data={})
+
+        # The asyncio engine runs its own submit, await and fetch coroutines, so custom ones need
+        # the threads
+        if self.get_async_engine() is not None \
+                and not self._custom_stages & {STAGE_SUBMIT, STAGE_AWAIT, STAGE_FETCH}:
+            completions = self._run_jobs_async(jobs, max_in_flight, priority, case)
+        else:
+            completions = self._run_jobs_threaded(jobs, max_in_flight, priority, case)
 
-        self.log.info(f"Getting domain report for {ioc.ioc_value}")
-        url = self.mod_config.get("cortexanalyze_url")
-        apikey = self.mod_config.get("cortexanalyze_key")
-        analyzer = self.mod_config.get("cortexanalyze_analyzer")
+        for (index, analyzer), status in completions:
+            if status.is_success():
+                results[index].data[analyzer] = status.get_data()
+            else:
+                results[index].code = InterfaceStatus.I2CodeError
+                results[index].message = status.get_message()
+
+            pending[index] -= 1
+            if pending[index] == 0:
+                result = results.pop(index)
+                # Each IOC gets its own status, as the statuses are merged by the callers
+                for key, _ in groups[index][2]:
+                    yield key, InterfaceStatus.IIStatus(code=result.code, message=result.message,
+                                                        data=dict(result.get_data()))
+
+    def _group_iocs(self, iocs):
+        """
+        Normalizes and deduplicates IOCs, see group_iocs
+        """
+        groups = group_iocs(iocs)
+        count = sum(len(members) for _, _, members in groups)
+        if count > len(groups):
+            self.log.info(f'Deduplicated {count} IOCs into {len(groups)} unique values')
 
+        return groups
+
+    def _run_jobs_threaded(self, jobs, max_in_flight, priority=PRIORITY_BULK, case=None):
         """
-        Call Cortex via Cortex4py
-        :param ioc: IOC instance
-        :return: IIStatus
+        Runs the jobs with run_analyzer in a thread pool and yields ((index, analyzer), IIStatus)
+        as they complete
+        """
+        scheduler = self.get_job_scheduler()
+
+        def run(analyzer, ioc_value, data_type, ioc_id):
+            self._job.priority, self._job.case = priority, case
+            if scheduler is None:
+                return self.run_analyzer(analyzer, ioc_value, data_type, ioc_id=ioc_id)
+
+            with scheduler.slot(priority, case):
+                self._job.scheduler = scheduler
+                try:
+                    return self.run_analyzer(analyzer, ioc_value, data_type, ioc_id=ioc_id)
+                finally:
+                    self._job.scheduler = None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(jobs)))) as executor:
+            futures = {
+                executor.submit(run, analyzer, ioc_value, data_type, ioc_id): (index, analyzer)
+                for index, analyzer, ioc_value, data_type, ioc_id in jobs
+            }
+
+            for future in as_completed(futures):
+                index, analyzer = futures[future]
+                try:
+                    status = future.result()
+                except CircuitOpenError as e:
+                    self.timings.count("circuit_rejections")
+                    status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                                      message=str(e))
+                except Exception:
+                    self.log.error(traceback.format_exc())
+                    status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                                      message=f'{analyzer} job failed')
+
+                yield (index, analyzer), status
+
+    def _run_jobs_async(self, jobs, max_in_flight, priority=PRIORITY_BULK, case=None):
+        """
+        Runs the jobs on a single event loop with the asyncio engine and yields ((index, analyzer),
+        IIStatus). Cached reports and analyzer IDs are resolved first, the remaining jobs are then
+        run together.
+        """
+        report_cache = self.get_report_cache()
+        job_journal = self.get_job_journal()
+        api = self.cortexanalyzer
+
+        to_run = []
+        for index, analyzer, ioc_value, data_type, ioc_id in jobs:
+            report = self.get_cached_report(analyzer, ioc_value, data_type, priority=priority)
+            if report is not None:
+                yield (index, analyzer), InterfaceStatus.IIStatus(
+                    code=InterfaceStatus.I2CodeSuccess, message="Success", data=report)
+                continue
+
+            try:
+                analyzer_id = self.run_stage(STAGE_RESOLVE, analyzer)
+            except CircuitOpenError as e:
+                self.timings.count("circuit_rejections")
+                yield (index, analyzer), InterfaceStatus.IIStatus(
+                    code=InterfaceStatus.I2CodeError, message=str(e))
+                continue
+            except Exception:
+                self.log.error(traceback.format_exc())
+                yield (index, analyzer), InterfaceStatus.IIStatus(
+                    code=InterfaceStatus.I2CodeError, message=f'{analyzer} job failed')
+                continue
+
+            if analyzer_id is None:
+                self.log.error(f'{analyzer} was not found to be enabled. Enable the Analyzer in '
+                               'Cortex to continue')
+                yield (index, analyzer), InterfaceStatus.IIStatus(
+                    code=InterfaceStatus.I2CodeError, message=f'{analyzer} is not enabled')
+                continue
+
+            job_id = None
+            if job_journal is not None:
+                job_id = job_journal.find_running(analyzer, data_type, ioc_value)
+                if job_id is not None:
+                    # Journaled for this IOC too, so that its report is resumed along the job
+                    job_journal.record(job_id, ioc_id, ioc_value, data_type, analyzer,
+                                       self.get_job_lease())
+            to_run.append((index, analyzer, analyzer_id, ioc_value, data_type, ioc_id, job_id))
+
+        if not to_run:
+            return
+
+        runner = self.get_async_engine().AsyncCortexRunner(
+            self.mod_config.get("cortexanalyze_url"), self.mod_config.get("cortexanalyze_key"),
+            self.log, proxies=api.proxies, max_in_flight=max_in_flight,
+            pool_size=int(self.mod_config.get("cortexanalyzer_pool_size") or 10),
+            timeout=int(self.mod_config.get("cortexanalyzer_job_timeout") or 300),
+            use_waitreport=self.mod_config.get("cortexanalyzer_use_waitreport", True) is not False,
+            force=self.mod_config.get("cortexanalyzer_force_analysis", True) is not False,
+            rate_limiters={analyzer_id: self.get_rate_limiter(analyzer)
+                           for _, analyzer, analyzer_id, *_ in to_run},
+            retries=self.get_rate_limit_retries(), timings=self.timings,
+            reader=self.get_report_reader(),
+            scheduler=self.get_job_scheduler(), priority=priority, case=case,
+            request_timeout=self.get_request_timeout(), breaker=self.get_circuit_breaker())
+
+        def on_submitted(position, job_id):
+            if job_journal is not None:
+                _, analyzer, _, ioc_value, data_type, ioc_id, _ = to_run[position]
+                job_journal.record(job_id, ioc_id, ioc_value, data_type, analyzer,
+                                   self.get_job_lease())
+
+        def on_discarded(position, job_id):
+            if job_journal is not None:
+                job_journal.discard(job_id)
+
+        statuses = runner.run([(analyzer_id, ioc_value, data_type, job_id)
+                               for _, _, analyzer_id, ioc_value, data_type, _, job_id in to_run],
+                              on_submitted=on_submitted, on_discarded=on_discarded)
+
+        for (index, analyzer, _, ioc_value, data_type, _, _), status in zip(to_run, statuses):
+            if status.is_success() and report_cache is not None:
+                report_cache.set(analyzer, data_type, ioc_value, status.get_data())
+
+            yield (index, analyzer), status
+
+    def submit_iocs(self, iocs, max_in_flight=None):
+        """
+        Submits the jobs of every analyzer configured for their type on a list of IOC values,
+        without waiting for them. Cached reports are returned instead of submitting a job.
+        Equivalent IOCs share the jobs of their normalized value.
+
+        :param iocs: List of (key, IOC value, Cortex dataType, IOC ID)
+        :param max_in_flight: Maximum number of submissions done at once. Defaults to the module
+                              configuration
+        :return: List of (key, dict of analyzer name to report, dict of analyzer name to job ID,
+                 IIStatus)
         """
+        if max_in_flight is None:
+            max_in_flight = int(self.mod_config.get("cortexanalyzer_max_in_flight") or 1)
 
-        api = Api(url, apikey, verify_cert=False)
+        def submit(analyzer, ioc_value, data_type, ioc_id):
+            report = self.get_cached_report(analyzer, ioc_value, data_type)
+            if report is not None:
+                return report, None, None
 
+            status = self.submit_analyzer(analyzer, ioc_value, data_type, ioc_id=ioc_id)
+            if not status.is_success():
+                return None, None, status
+
+            return None, status.get_data()["id"], None
+
+        job_journal = self.get_job_journal()
+        submissions = []
+        with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+            for ioc_value, data_type, members in self._group_iocs(iocs):
+                futures = {analyzer: executor.submit(submit, analyzer, ioc_value, data_type,
+                                                     members[0][1])
+                           for analyzer in self.get_analyzers(data_type)}
+                submissions.append((ioc_value, data_type, members, futures))
+
+            results = []
+            for ioc_value, data_type, members, futures in submissions:
+                reports = {}
+                jobs = {}
+                status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess,
+                                                  message="Success")
+                if not futures:
+                    self.log.error(f'No analyzer configured for type {data_type}')
+                    status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                                      message='No analyzer configured for type '
+                                                              f'{data_type}')
+
+                for analyzer, future in futures.items():
+                    try:
+                        report, job_id, error = future.result()
+                    except CircuitOpenError as e:
+                        self.timings.count("circuit_rejections")
+                        report, job_id, error = None, None, InterfaceStatus.IIStatus(
+                            code=InterfaceStatus.I2CodeError, message=str(e))
+                    except Exception:
+                        self.log.error(traceback.format_exc())
+                        report, job_id, error = None, None, InterfaceStatus.IIStatus(
+                            code=InterfaceStatus.I2CodeError,
+                            message=f'{analyzer} submission failed')
+
+                    if report is not None:
+                        reports[analyzer] = report
+                    elif job_id is not None:
+                        jobs[analyzer] = job_id
+                    else:
+                        status = error
+
+                for key, ioc_id in members:
+                    # The other IOCs of the value are journaled too, so they are resumed with the
+                    # first one
+                    if job_journal is not None and ioc_id is not None and ioc_id != members[0][1]:
+                        for analyzer, job_id in jobs.items():
+                            job_journal.record(job_id, ioc_id, ioc_value, data_type, analyzer,
+                                               self.get_job_lease())
+
+                    results.append((key, dict(reports), dict(jobs), status))
+
+        return results
+
+    def get_analyzers(self, data_type):
         """
-        Call Cortex via Cortex4py To check if Analyzer is Enabled
-        :param ioc: IOC instance
-        :return: IIStatus
+        Returns the analyzers to run on an IOC type. cortexanalyzer_type_analyzers can map a
+        Cortex dataType to a list of analyzers, otherwise the comma separated list of
+        cortexanalyze_analyzer is used.
+
+        :param data_type: Cortex dataType of the IOC
+        :return: List of analyzer names
+        """
+        type_analyzers = self.mod_config.get("cortexanalyzer_type_analyzers") or {}
+        if isinstance(type_analyzers, str):
+            try:
+                type_analyzers = json.loads(type_analyzers) if type_analyzers.strip() else {}
+            except ValueError:
+                self.log.error("cortexanalyzer_type_analyzers is not valid JSON. Ignoring it")
+                type_analyzers = {}
+
+        analyzers = type_analyzers.get(data_type)
+        if analyzers is None:
+            analyzers = self.mod_config.get("cortexanalyze_analyzer") or ""
+
+        if isinstance(analyzers, str):
+            analyzers = analyzers.split(",")
+
+        return [analyzer.strip() for analyzer in analyzers if analyzer.strip()]
+
+    def get_configured_analyzers(self):
+        """
+        Returns the analyzers configured for any of the enriched IOC types
+
+        :return: Sorted list of analyzer names
         """
+        analyzers = set()
+        for route in self.get_ioc_routes().values():
+            analyzers.update(self.get_analyzers(route.data_type))
+
+        return sorted(analyzers)
 
-        available_analyzers = api.analyzers.find_all({}, range='all')
-        
-        all_analyzers = []
-        for available in available_analyzers:
-            all_analyzers.append(available.name)
-        if analyzer not in all_analyzers:
+    def run_analyzer(self, analyzer, ioc_value, data_type,
+                     ioc_id=None) -> InterfaceStatus.IIStatus:
+        """
+        Runs an analyzer on an IOC value and waits for its report. A fresh IIStatus is
+        returned each time, as the I2* statuses are shared instances.
+
+        :param analyzer: Name of the analyzer
+        :param ioc_value: Value of the IOC to analyze
+        :param data_type: Cortex dataType of the IOC - I.E domain, ip, hash
+        :param ioc_id: ID of the IOC, recorded in the job journal
+        :return: IIStatus, with the Cortex report as data on success
+        """
+
+        """
+        Reuse a recent report of the same analyzer on the same value, if any
+        """
+
+        report = self.get_cached_report(analyzer, ioc_value, data_type,
+                                        priority=self._job.priority)
+        if report is not None:
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                            data=report)
+
+        status = self.submit_analyzer(analyzer, ioc_value, data_type, ioc_id=ioc_id)
+        if not status.is_success():
+            return status
+
+        r_json = status.get_data()
+        return self.collect_report(analyzer, r_json["id"], ioc_value, data_type, r_json=r_json,
+                                   ioc_id=ioc_id)
+
+    def get_cached_report(self, analyzer, ioc_value, data_type, priority=PRIORITY_BULK):
+        """
+        Returns the cached report of an analyzer on an IOC value. Manual triggers always get a
+        fresh report from Cortex, which is then cached for the other hooks.
+
+        :param analyzer: Name of the analyzer
+        :param ioc_value: Value of the IOC
+        :param data_type: Cortex dataType of the IOC
+        :param priority: Priority class of the job
+        :return: Cortex report, or None if not cached
+        """
+        report_cache = self.get_report_cache()
+        if report_cache is None or priority == PRIORITY_MANUAL:
+            return None
+
+        report = report_cache.get(analyzer, data_type, ioc_value)
+        if report is not None:
+            self.log.info(f'Using cached {analyzer} report for {ioc_value}')
+            self.timings.count("report_cache_hits")
+        else:
+            self.timings.count("report_cache_misses")
+
+        return report
+
+    def submit_analyzer(self, analyzer, ioc_value, data_type,
+                        ioc_id=None) -> InterfaceStatus.IIStatus:
+        """
+        Submits a job of an analyzer on an IOC value, without waiting for it. If the job
+        journal holds a job of the analyzer on the same value still in flight, it is
+        reused instead of submitting the same work again.
+
+        :param analyzer: Name of the analyzer
+        :param ioc_value: Value of the IOC to analyze
+        :param data_type: Cortex dataType of the IOC - I.E domain, ip, hash
+        :param ioc_id: ID of the IOC, recorded in the job journal
+        :return: IIStatus, with the submitted job as data on success
+        """
+
+        job_journal = self.get_job_journal()
+
+        if job_journal is not None:
+            job_id = job_journal.find_running(analyzer, data_type, ioc_value)
+            if job_id is not None:
+                self.log.info(f'Reusing {analyzer} job {job_id} in flight for {ioc_value}')
+                job_journal.record(job_id, ioc_id, ioc_value, data_type, analyzer,
+                                   self.get_job_lease())
+                return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess,
+                                                message="Success",
+                                                data={"id": job_id, "status": "InProgress"})
+
+        """
+        Call Cortex via Cortex4py To check if Analyzer is Enabled. The catalogue of
+        enabled analyzers is cached for the whole worker
+        """
+
+        analyzer_id = self.run_stage(STAGE_RESOLVE, analyzer)
+        if analyzer_id is None:
             self.log.error(f'{analyzer} was not found to be enabled. Enable the Analyzer in Cortex to continue')
-            return InterfaceStatus.I2Error()
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                            message=f'{analyzer} is not enabled')
         else:
             self.log.info(f'{analyzer} was found to be enabled. Continuing')
 
-        #for analyzers in available_analyzers:
-        #    if not analyzer in analyzers.name:
-        #        return 
-
         """
-        Call Cortex via Cortex4py To run Analyzer and Return Results
-        :param ioc: IOC instance
-        :return: IIStatus
+        Call Cortex via Cortex4py To run Analyzer
         """
 
-        job1 = api.analyzers.run_by_name(
-            analyzer,
-            {
-                "data": ioc.ioc_value,
-                "dataType": "domain",
-                "tlp": 1,
-                "message": "custom message sent to analyzer",
-            },
-            force=1,
-        )
-        r_json = job1.json()
-
-        job_id = r_json["id"]
-        self.log.info(f'Job ID is: {job_id}')
-
-        job_state = r_json["status"]
-        timer = 0
-        while job_state != "Success":
-            if timer == 60:
-                self.log.error("Job failed to complete after 5 minutes.")
-                report = "Job failed to complete after 5 minutes."
-                break
-            timer = timer + 1
-            self.log.info(f'Timer is: {timer}')
-
-            if job_state == "Failure":
-                error_message = r_json["errorMessage"]
-                self.log.error(f'Cortex Failure: {error_message}')
-                return InterfaceStatus.I2Error()
+        rate_limiter = self.get_rate_limiter(analyzer)
+        retries = self.get_rate_limit_retries()
 
-            else:
-                time.sleep(5)
-            followup_request = api.jobs.get_by_id(job_id)
-            r_json = followup_request.json()
-            job_state = r_json["status"]
+        attempt = 0
+        while True:
+            # Jobs of rate limited analyzers are released at the permitted rate, most urgent first
+            if rate_limiter is not None and not rate_limiter.try_acquire():
+                with self.slot_released():
+                    rate_limiter.acquire(self._job.priority, self._job.case)
 
-        if job_state == "Success":
-            self.log.info("Job completed successfully")
-            report = api.jobs.get_report(job_id).report
-            final_report = report["full"]
+            try:
+                r_json = self.run_stage(STAGE_SUBMIT, analyzer_id, ioc_value, data_type)
+
+            except NotFoundError:
+                # The analyzer was disabled or re-enabled since the catalogue was cached
+                self.log.warning(f'{analyzer} not found with ID {analyzer_id}. Refreshing the '
+                                 'analyzers catalogue')
+                analyzer_id = self.run_stage(STAGE_RESOLVE, analyzer, refresh=True)
+                if analyzer_id is None:
+                    self.log.error(f'{analyzer} was not found to be enabled. Enable the Analyzer '
+                                   'in Cortex to continue')
+                    return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                                    message=f'{analyzer} is not enabled')
+
+                r_json = self.run_stage(STAGE_SUBMIT, analyzer_id, ioc_value, data_type)
+
+            except CortexException as e:
+                if attempt >= retries or not is_rate_limited(e):
+                    raise
+
+                delay = retry_delay(attempt)
+                self.log.warning(f'Cortex throttled the {analyzer} submission. Retrying in '
+                                 f'{delay:.1f} seconds')
+                self.timings.count("retries")
+                with self.slot_released():
+                    time.sleep(delay)
+                attempt += 1
+                continue
+
+            break
+
+        self.log.info(f'Job ID is: {r_json["id"]}')
+        self.timings.count("jobs_submitted")
+
+        if job_journal is not None:
+            job_journal.record(r_json["id"], ioc_id, ioc_value, data_type, analyzer,
+                               self.get_job_lease())
+
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                        data=r_json)
+
+    def wait_report(self, analyzer, job_id, ioc_value, data_type,
+                    r_json=None) -> InterfaceStatus.IIStatus:
+        """
+        Waits for a submitted job and returns its report, which is added to the report cache
+
+        :param analyzer: Name of the analyzer of the job
+        :param job_id: ID of the Cortex job
+        :param ioc_value: Value of the analyzed IOC
+        :param data_type: Cortex dataType of the IOC
+        :param r_json: Job as returned on submission, if any
+        :return: IIStatus, with the Cortex report as data on success
+        """
+        status = self.run_stage(STAGE_AWAIT, job_id, r_json)
+        job = status.get_data() or {}
+        if not status.is_success():
+            failed = job.get("status") in JOB_FINAL_STATES
+            self.timings.count("job_failures" if failed else "timeouts")
+            return status
+
+        self.add_queue_time(job)
+        report = self.run_stage(STAGE_FETCH, job_id, job)
+        report_cache = self.get_report_cache()
+        if report_cache is not None:
+            report_cache.set(analyzer, data_type, ioc_value, report)
+
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                        data=report)
+
+    def collect_report(self, analyzer, job_id, ioc_value, data_type, r_json=None, ioc_id=None):
+        """
+        Waits for a submitted job and returns its report. A job which failed because the analyzer
+        ran out of quota is submitted again after a backoff, up to
+        cortexanalyzer_rate_limit_retries times, instead of failing the IOC.
+
+        :param analyzer: Name of the analyzer of the job
+        :param job_id: ID of the Cortex job
+        :param ioc_value: Value of the analyzed IOC
+        :param data_type: Cortex dataType of the IOC
+        :param r_json: Job as returned on submission, if any
+        :param ioc_id: ID of the IOC, recorded in the job journal
+        :return: IIStatus, with the Cortex report as data on success
+        """
+        retries = self.get_rate_limit_retries()
+        job_journal = self.get_job_journal()
+
+        attempt = 0
+        while True:
+            # Keeps the job leased to this worker while it waits for it
+            if job_journal is not None:
+                job_journal.renew(job_id, self.get_job_lease())
+
+            status = self.wait_report(analyzer, job_id, ioc_value, data_type, r_json=r_json)
+            if status.is_success() or attempt >= retries \
+                    or not is_rate_limited(status.get_message()):
+                return status
 
-        if self.mod_config.get("cortexanalyzer_report_as_attribute") is True:
-            self.log.info("Adding new attribute CORTEX Domain Report to IOC")
+            # The failed job must not be reused by the IOCs on the same value
+            if job_journal is not None:
+                job_journal.discard(job_id)
 
-            status = self.gen_report_from_template(
-                html_template=self.mod_config.get(
-                    "cortexanalyzer_domain_report_template"
-                ),
-                cortexanalyzer_report=final_report,
-        
-            )
+            delay = retry_delay(attempt)
+            self.log.warning(f'{analyzer} job {job_id} was rate limited. Retrying in {delay:.1f} '
+                             'seconds')
+            self.timings.count("retries")
+            with self.slot_released():
+                time.sleep(delay)
+            attempt += 1
 
+            status = self.submit_analyzer(analyzer, ioc_value, data_type, ioc_id=ioc_id)
             if not status.is_success():
                 return status
 
-            rendered_report = status.get_data()
+            r_json = status.get_data()
+            job_id = r_json["id"]
 
-            try:
-                add_tab_attribute_field(
-                    ioc,
-                    tab_name="CORTEX Report",
-                    field_name="HTML report",
-                    field_type="html",
-                    field_value=rendered_report,
-                )
+    @contextmanager
+    def slot_released(self):
+        """
+        Gives the scheduler slot of the job of the current thread back for the duration of the
+        block, I.E while it waits for a rate limit token or a backoff, and takes one again
+        afterwards with the priority of the job. The other jobs of the worker run meanwhile.
+        """
+        scheduler = self._job.scheduler
+        if scheduler is None:
+            yield
+            return
 
-            except Exception:
+        scheduler.release()
+        try:
+            yield
+        finally:
+            scheduler.acquire(self._job.priority, self._job.case)
 
-                self.log.error(traceback.format_exc())
-                return InterfaceStatus.I2Error(traceback.format_exc())
+    def add_queue_time(self, job):
+        """
+        Adds the time a completed job spent queued in Cortex, before an analyzer worker started it,
+        to the timings
+
+        :param job: Completed job
+        :return: Nothing
+        """
+        created_at = job.get("createdAt")
+        start_date = job.get("startDate")
+        if isinstance(created_at, (int, float)) and isinstance(start_date, (int, float)):
+            self.timings.add(STAGE_CORTEX_QUEUE, max(0, start_date - created_at) / 1000)
+
+    def export_metrics(self):
+        """
+        Writes the metrics of the worker to cortexanalyzer_metrics_path, if set
+
+        :return: Nothing
+        """
+        metrics_path = self.mod_config.get("cortexanalyzer_metrics_path")
+        if not metrics_path:
+            return
+
+        try:
+            get_metrics_registry().write(metrics_path)
+
+        except Exception:
+            self.log.warning(f'Unable to write the metrics to {metrics_path}')
+            self.log.warning(traceback.format_exc())
+
+    def resolve_analyzer(self, analyzer, refresh=False):
+        """
+        Resolve stage. Returns the ID of an enabled analyzer
+
+        :param analyzer: Name of the analyzer
+        :param refresh: Set to True to refresh the catalogue of analyzers first
+        :return: ID of the analyzer, or None if it is not enabled
+        """
+        return self.get_analyzer_id(self.cortexanalyzer, analyzer, refresh=refresh)
+
+    def submit_job(self, analyzer_id, ioc_value, data_type):
+        """
+        Submit stage. Runs an analyzer on an IOC value
+
+        :param analyzer_id: ID of the analyzer
+        :param ioc_value: Value of the IOC to analyze
+        :param data_type: Cortex dataType of the IOC
+        :return: Submitted job
+        """
+        observable = {
+            "data": ioc_value,
+            "dataType": data_type,
+            "tlp": 1,
+            "message": "custom message sent to analyzer",
+        }
+        # Without force, Cortex may answer with a cached job of its own
+        force = self.mod_config.get("cortexanalyzer_force_analysis", True) is not False
+        run_options = {"force": 1} if force else {}
+
+        return self.cortexanalyzer.analyzers.run_by_id(analyzer_id, observable,
+                                                       **run_options).json()
+
+    def await_job(self, job_id, r_json=None) -> InterfaceStatus.IIStatus:
+        """
+        Await stage. Waits for a job to complete
+
+        :param job_id: ID of the Cortex job
+        :param r_json: Job as returned on submission, if any
+        :return: IIStatus, with the completed job as data on success
+        """
+        use_waitreport = self.mod_config.get("cortexanalyzer_use_waitreport", True) is not False
+        waiter = JobWaiter(self.cortexanalyzer, self.log,
+                           timeout=int(self.mod_config.get("cortexanalyzer_job_timeout") or 300),
+                           use_waitreport=use_waitreport, reader=self.get_report_reader())
+        return waiter.wait(job_id, r_json)
+
+    def fetch_report(self, job_id, r_json):
+        """
+        Fetch stage. Returns the report of a completed job, fetching it unless the job already
+        holds it
+
+        :param job_id: ID of the Cortex job
+        :param r_json: Completed job
+        :return: Cortex report
+        """
+        if "report" in r_json:
+            return r_json["report"]
+
+        return JobWaiter(self.cortexanalyzer, self.log,
+                         reader=self.get_report_reader()).fetch_report(job_id)
+
+    def render_report(self, reports, data_type) -> InterfaceStatus.IIStatus:
+        """
+        Render stage. Renders the reports of an IOC with the template of its type. In summary
+        storage mode, only their summaries are rendered, and the full reports are not stored on
+        the IOC. They stay available in Cortex.
+
+        :param reports: Dict of analyzer name to Cortex report
+        :param data_type: Cortex dataType of the IOC
+        :return: IIStatus, with the rendered HTML as data on success
+        """
+        storage_mode = self.mod_config.get("cortexanalyzer_report_storage_mode") or STORAGE_FULL
+        max_size = int(self.mod_config.get("cortexanalyzer_report_max_size") or 0)
+
+        # The shape of the results depends on the configuration only, not on which analyzers
+        # succeeded
+        keyed = len(self.get_analyzers(data_type)) > 1
+        summaries = self.combine_reports(reports, keyed, summarize=True)
+        if storage_mode == STORAGE_SUMMARY:
+            results = summaries
         else:
-            self.log.info("Skipped adding attribute report. Option disabled")
+            results = bound_results(self.combine_reports(reports, keyed), summaries, max_size)
 
-        return InterfaceStatus.I2Success()
-    
-    def handle_ip(self, ioc):
+        return self.gen_report_from_template(
+            html_template=self.get_report_template(data_type),
+            cortexanalyzer_report=results,
+        )
+
+    def persist_report(self, ioc, fields):
         """
-        Handles an IOC of type IP and adds Cortex Analyzer insights
+        Persist stage. Writes the fields of the report in the CORTEX Report tab of the IOC.
+        The IOC is committed with the next batch of attributes.
+
         :param ioc: IOC instance
+        :param fields: List of (field name, field type, field value)
+        :return: IIStatus
+        """
+        return self.attributes.add(ioc, "CORTEX Report", fields)
+
+    def flush_attributes(self):
+        """
+        Commits the attributes persisted since the last batch
+
         :return: IIStatus
         """
+        with self.timings.measure(STAGE_PERSIST):
+            return self.attributes.flush()
 
-        self.log.info(f"Getting IP report for {ioc.ioc_value}")
+    def get_analyzer_id(self, api, analyzer, refresh=False):
+        """
+        Returns the ID of an enabled analyzer from the cached catalogue. An unknown analyzer
+        triggers a refresh of the catalogue, in case it was enabled since it was cached, at most
+        once per minute, see find_analyzer_id.
+
+        :param api: cortex4py Api instance
+        :param analyzer: Name of the analyzer
+        :param refresh: Set to True to drop the cached catalogue first
+        :return: ID of the analyzer, or None if it is not enabled
+        """
         url = self.mod_config.get("cortexanalyze_url")
         apikey = self.mod_config.get("cortexanalyze_key")
-        analyzer = self.mod_config.get("cortexanalyze_analyzer")
+        ttl = int(self.mod_config.get("cortexanalyzer_analyzer_cache_ttl") or 0)
+
+        if refresh:
+            invalidate_analyzers(url, apikey)
 
+        return find_analyzer_id(api, url, apikey, analyzer, ttl=ttl)
+
+    def get_report_cache(self):
         """
-        Call Cortex via Cortex4py
-        :param ioc: IOC instance
-        :return: IIStatus
+        Returns the report cache matching the module configuration
+
+        :return: ReportCache, or None if the cache is disabled
+        """
+        ttl = int(self.mod_config.get("cortexanalyzer_report_cache_ttl") or 0)
+        max_mb = float(self.mod_config.get("cortexanalyzer_report_cache_max_mb") or 0)
+        max_bytes = int(max_mb * 1024 * 1024)
+        if ttl <= 0 or max_bytes <= 0:
+            return None
+
+        source = cache_source(self.mod_config.get("cortexanalyze_url"),
+                              self.mod_config.get("cortexanalyze_key"))
+        return get_report_cache(source, ttl, max_bytes,
+                                db_path=self.mod_config.get("cortexanalyzer_report_cache_path"))
+
+    def get_async_engine(self):
+        """
+        Returns the asyncio engine if it is configured and aiohttp is installed. It is imported on
+        first use, so that the workers running the threads engine never load aiohttp.
+
+        :return: async_engine module, or None to run the jobs in threads
         """
+        if self.mod_config.get("cortexanalyzer_execution_engine") != "asyncio":
+            return None
 
-        api = Api(url, apikey, verify_cert=False)
+        from iris_cortexanalyzer_module.cortexanalyzer_handler import async_engine
+        return async_engine if async_engine.is_available() else None
 
+    def get_report_reader(self):
         """
-        Call Cortex via Cortex4py To check if Analyzer is Enabled
-        :param ioc: IOC instance
-        :return: IIStatus
+        Returns the reader of the reports matching the module configuration
+
+        :return: ReportReader, or None if the reports are always loaded in full
         """
+        threshold = int(self.mod_config.get("cortexanalyzer_report_stream_threshold") or 0)
+        if threshold <= 0:
+            return None
 
-        available_analyzers = api.analyzers.find_all({}, range='all')
-        
-        all_analyzers = []
-        for available in available_analyzers:
-            all_analyzers.append(available.name)
-        if analyzer not in all_analyzers:
-            self.log.error(f'{analyzer} was not found to be enabled. Enable the Analyzer in Cortex to continue')
-            return InterfaceStatus.I2Error()
-        else:
-            self.log.info(f'{analyzer} was found to be enabled. Continuing')
+        return ReportReader(threshold, fields=self.mod_config.get("cortexanalyzer_report_fields"),
+                            logger=self.log)
 
-        #for analyzers in available_analyzers:
-        #    if not analyzer in analyzers.name:
-        #        return 
+    def get_job_scheduler(self):
+        """
+        Returns the scheduler sharing the Cortex job slots between the hooks of the worker
 
+        :return: JobScheduler, or None if cortexanalyzer_worker_max_in_flight is 0
         """
-        Call Cortex via Cortex4py To run Analyzer and Return Results
-        :param ioc: IOC instance
-        :return: IIStatus
+        slots = int(self.mod_config.get("cortexanalyzer_worker_max_in_flight") or 0)
+        if slots <= 0:
+            return None
+
+        return get_job_scheduler(slots)
+
+    def get_circuit_breaker(self):
         """
+        Returns the circuit breaker of the configured Cortex instance
 
-        job1 = api.analyzers.run_by_name(
-            analyzer,
-            {
-                "data": ioc.ioc_value,
-                "dataType": "ip",
-                "tlp": 1,
-                "message": "custom message sent to analyzer",
-            },
-            force=1,
-        )
-        r_json = job1.json()
-
-        job_id = r_json["id"]
-        self.log.info(f'Job ID is: {job_id}')
-
-        job_state = r_json["status"]
-        timer = 0
-        while job_state != "Success":
-            if timer == 60:
-                self.log.error("Job failed to complete after 5 minutes.")
-                report = "Job failed to complete after 5 minutes."
-                break
-            timer = timer + 1
-            self.log.info(f'Timer is: {timer}')
-
-            if job_state == "Failure":
-                error_message = r_json["errorMessage"]
-                self.log.error(f'Cortex Failure: {error_message}')
-                return InterfaceStatus.I2Error()
+        :return: CircuitBreaker, or None if cortexanalyzer_circuit_failure_threshold is 0
+        """
+        failure_threshold = int(self.mod_config.get("cortexanalyzer_circuit_failure_threshold")
+                                or 0)
+        if failure_threshold <= 0:
+            return None
 
-            else:
-                time.sleep(5)
-            followup_request = api.jobs.get_by_id(job_id)
-            r_json = followup_request.json()
-            job_state = r_json["status"]
+        reset_timeout = int(self.mod_config.get("cortexanalyzer_circuit_reset_timeout") or 0)
+        return get_circuit_breaker(self.mod_config.get('cortexanalyze_url'), failure_threshold,
+                                   reset_timeout, logger=self.log)
 
-        if job_state == "Success":
-            self.log.info("Job completed successfully")
-            report = api.jobs.get_report(job_id).report
-            final_report = report["full"]
+    def get_request_timeout(self):
+        """
+        Returns the time, in seconds, to wait for an answer of Cortex to a request, or None to wait
+        forever
+        """
+        timeout = int(self.mod_config.get("cortexanalyzer_request_timeout") or 0)
+        return timeout if timeout > 0 else None
 
-        if self.mod_config.get("cortexanalyzer_report_as_attribute") is True:
-            self.log.info("Adding new attribute CORTEX IP Report to IOC")
+    def get_job_journal(self):
+        """
+        Returns the job journal matching the module configuration
 
-            status = self.gen_report_from_template(
-                html_template=self.mod_config.get(
-                    "cortexanalyzer_domain_report_template"
-                ),
-                cortexanalyzer_report=final_report,
-        
-            )
+        :return: JobJournal, or None if the journal is disabled
+        """
+        db_path = self.mod_config.get("cortexanalyzer_job_journal_path")
+        if not db_path:
+            return None
 
-            if not status.is_success():
-                return status
+        return get_job_journal(db_path)
 
-            rendered_report = status.get_data()
+    def get_ioc_routes(self):
+        """
+        Returns the routes of the IRIS IOC types to the Cortex dataTypes, I.E the default
+        ones updated with cortexanalyzer_type_mapping
 
-            try:
-                add_tab_attribute_field(
-                    ioc,
-                    tab_name="CORTEX Report",
-                    field_name="HTML report",
-                    field_type="html",
-                    field_value=rendered_report,
-                )
+        :return: Dict of IRIS type name to IocRoute
+        """
+        try:
+            return get_routes(self.mod_config.get("cortexanalyzer_type_mapping"))
 
-            except Exception:
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.log.error("cortexanalyzer_type_mapping is not valid. Using the default IOC types "
+                           "mapping")
+            return DEFAULT_ROUTES
 
-                self.log.error(traceback.format_exc())
-                return InterfaceStatus.I2Error(traceback.format_exc())
-        else:
-            self.log.info("Skipped adding attribute report. Option disabled")
+    def get_report_label(self, data_type):
+        """
+        Returns the label of the reports of a Cortex dataType, I.E the one of its first IOC route
 
-        return InterfaceStatus.I2Success()
-    
-    def handle_hash(self, ioc):
+        :param data_type: Cortex dataType
+        :return: Label of the report - I.E Domain, IP
+        """
+        return next((route.label for route in self.get_ioc_routes().values()
+                     if route.data_type == data_type), data_type.capitalize())
+
+    def is_enrichment_fresh(self, ioc):
         """
-        Handles an IOC of type Hash and adds Cortex Analyzer insights
+        Tells whether the last enrichment of an IOC can be kept on update, I.E its value and type
+        did not change, it covers the configured analyzers and it is younger than
+        cortexanalyzer_update_freshness seconds
+
         :param ioc: IOC instance
-        :return: IIStatus
+        :return: True if the IOC does not need to be enriched again
         """
+        freshness = int(self.mod_config.get("cortexanalyzer_update_freshness") or 0)
+        route = self.get_ioc_routes().get(ioc.ioc_type.type_name)
+        if freshness <= 0 or route is None:
+            return False
 
-        self.log.info(f"Getting IP report for {ioc.ioc_value}")
-        url = self.mod_config.get("cortexanalyze_url")
-        apikey = self.mod_config.get("cortexanalyze_key")
-        analyzer = self.mod_config.get("cortexanalyze_analyzer")
+        return is_fresh(ioc, self.get_analyzers(route.data_type), freshness)
 
+    def get_rate_limiter(self, analyzer):
         """
-        Call Cortex via Cortex4py
-        :param ioc: IOC instance
-        :return: IIStatus
+        Returns the token bucket of an analyzer, as set in cortexanalyzer_rate_limits
+
+        :param analyzer: Name of the analyzer
+        :return: TokenBucket, or None if the analyzer is not rate limited
         """
+        if self._rate_limits is None:
+            # Parsed once per handler, so that an invalid entry is reported once per hook call
+            self._rate_limits, problems = parse_rate_limits(
+                self.mod_config.get("cortexanalyzer_rate_limits"))
+            for problem in problems:
+                self.log.error(f'{problem}. Ignoring it')
 
-        api = Api(url, apikey, verify_cert=False)
+        limit = self._rate_limits.get(analyzer)
+        if limit is None:
+            return None
 
+        return get_rate_limiter(analyzer, *limit)
+
+    def get_rate_limit_retries(self):
         """
-        Call Cortex via Cortex4py To check if Analyzer is Enabled
-        :param ioc: IOC instance
-        :return: IIStatus
+        Returns the number of times a rate limited job is retried
         """
+        return max(0, int(self.mod_config.get("cortexanalyzer_rate_limit_retries") or 0))
 
-        available_analyzers = api.analyzers.find_all({}, range='all')
-        
-        all_analyzers = []
-        for available in available_analyzers:
-            all_analyzers.append(available.name)
-        if analyzer not in all_analyzers:
-            self.log.error(f'{analyzer} was not found to be enabled. Enable the Analyzer in Cortex to continue')
-            return InterfaceStatus.I2Error()
+    def get_job_lease(self):
+        """
+        Returns the time, in seconds, during which a journaled job belongs to the worker which
+        submitted it
+        """
+        return int(self.mod_config.get("cortexanalyzer_job_timeout") or 300) + 60
+
+    @staticmethod
+    def combine_reports(reports, keyed, summarize=False):
+        """
+        Returns the results rendered by the template. A single configured analyzer renders its
+        full report as before, several analyzers render a dict of analyzer name to full report,
+        even if only one of them succeeded.
+
+        :param reports: Dict of analyzer name to Cortex report
+        :param keyed: Set to True if several analyzers are configured for the IOC type
+        :param summarize: Set to True to only keep the summary of the reports, with their
+                          taxonomies
+        :return: Results to render
+        """
+        if summarize:
+            results = {analyzer: summarize_report(report) for analyzer, report in reports.items()}
         else:
-            self.log.info(f'{analyzer} was found to be enabled. Continuing')
+            results = {analyzer: report["full"] for analyzer, report in reports.items()}
 
-        #for analyzers in available_analyzers:
-        #    if not analyzer in analyzers.name:
-        #        return 
+        if keyed or len(results) != 1:
+            return results
 
+        return next(iter(results.values()))
+
+    def get_report_template(self, data_type):
         """
-        Call Cortex via Cortex4py To run Analyzer and Return Results
-        :param ioc: IOC instance
+        Returns the report template of an IOC type, I.E cortexanalyzer_<dataType>_report_template.
+        The module configuration declares one for the ip, hash, fqdn, url, mail and filename
+        dataTypes. The other dataTypes, such as registry or the custom ones of
+        cortexanalyzer_type_mapping, and the types whose template is left empty, fall back to the
+        default report template.
+
+        :param data_type: Cortex dataType of the IOC
+        :return: Template source
+        """
+        template = self.mod_config.get(f"cortexanalyzer_{data_type}_report_template")
+        if template:
+            return template
+
+        return self.mod_config.get("cortexanalyzer_domain_report_template")
+
+    def compile_report_templates(self):
+        """
+        Compiles the configured report templates, so that the first reports do not pay for it
+
         :return: IIStatus
         """
+        for param_name, source in self.mod_config.items():
+            if not param_name.endswith("_report_template") or not source:
+                continue
 
-        job1 = api.analyzers.run_by_name(
-            analyzer,
-            {
-                "data": ioc.ioc_value,
-                "dataType": "hash",
-                "tlp": 1,
-                "message": "custom message sent to analyzer",
-            },
-            force=1,
-        )
-        r_json = job1.json()
-
-        job_id = r_json["id"]
-        self.log.info(f'Job ID is: {job_id}')
-
-        job_state = r_json["status"]
-        timer = 0
-        while job_state != "Success":
-            if timer == 60:
-                self.log.error("Job failed to complete after 5 minutes.")
-                report = "Job failed to complete after 5 minutes."
-                break
-            timer = timer + 1
-            self.log.info(f'Timer is: {timer}')
-
-            if job_state == "Failure":
-                error_message = r_json["errorMessage"]
-                self.log.error(f'Cortex Failure: {error_message}')
-                return InterfaceStatus.I2Error()
+            try:
+                get_template(source)
 
-            else:
-                time.sleep(5)
-            followup_request = api.jobs.get_by_id(job_id)
-            r_json = followup_request.json()
-            job_state = r_json["status"]
+            except Exception:
+                self.log.error(f'Unable to compile {param_name}')
+                self.log.error(traceback.format_exc())
+                return InterfaceStatus.I2Error(traceback.format_exc())
 
-        if job_state == "Success":
-            self.log.info("Job completed successfully")
-            report = api.jobs.get_report(job_id).report
-            final_report = report["full"]
+        return InterfaceStatus.I2Success()
 
-        if self.mod_config.get("cortexanalyzer_report_as_attribute") is True:
-            self.log.info("Adding new attribute CORTEX IP Report to IOC")
+    def add_report_attribute(self, ioc, reports, report_label, data_type=None):
+        """
+        Renders the Cortex reports of an IOC and adds them as an attribute of the IOC.
+        This writes to the IRIS database session, so it must run on the hook thread.
+
+        :param ioc: IOC instance
+        :param reports: Dict of analyzer name to Cortex report, as returned by analyze
+        :param report_label: Label of the report used in the logs - I.E Domain, IP
+        :param data_type: Cortex dataType of the IOC, used to pick its report template
+        :return: IIStatus
+        """
 
-            status = self.gen_report_from_template(
-                html_template=self.mod_config.get(
-                    "cortexanalyzer_domain_report_template"
-                ),
-                cortexanalyzer_report=final_report,
-        
-            )
+        if self.mod_config.get("cortexanalyzer_report_as_attribute") is True:
+            self.log.info(f"Adding new attribute CORTEX {report_label} Report to IOC")
 
+            status = self.run_stage(STAGE_RENDER, reports, data_type)
             if not status.is_success():
                 return status
 
-            rendered_report = status.get_data()
+            fields = [
+                ("HTML report", "html", status.get_data()),
+                (FINGERPRINT_FIELD, "raw", make_fingerprint(ioc, reports)),
+            ]
 
             try:
-                add_tab_attribute_field(
-                    ioc,
-                    tab_name="CORTEX Report",
-                    field_name="HTML report",
-                    field_type="html",
-                    field_value=rendered_report,
-                )
+                status = self.run_stage(STAGE_PERSIST, ioc, fields)
+                if status is not None and not status.is_success():
+                    return status
 
             except Exception:
 
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortexanalyzer_handler import (
+    CortexanalyzerHandler,
+)
+
+
+def render_pending_report(jobs):
+    """
+    Returns the HTML placeholder stored on an IOC while its Cortex jobs are running
+
+    :param jobs: Dict of analyzer name to Cortex job ID
+    :return: HTML string
+    """
+    rows = "".join(f"<li>{analyzer}: job {job_id}</li>" for analyzer, job_id in jobs.items())
+    return ("<p>Cortex analysis pending. The report will be added once these jobs complete:</p>"
+            f"<ul>{rows}</ul>")
+
+
+class DeferredCompleter(object):
+    """
+    Background completion stage of the deferred mode.
+
+    The hooks only submit the Cortex jobs and return. The IOCs and their job IDs are then
+    handed over to this completer, which waits for the jobs in its own threads, and adds the
+    reports to the IOCs in a dedicated application context and database session.
+    """
+
+    def __init__(self, logger, max_workers=4):
+        self.log = logger
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="cortexanalyzer-deferred")
+
+    def enqueue(self, ioc_id, ioc_value, data_type, report_label, reports, jobs, mod_config,
+                server_config):
+        """
+        Queues the completion of the jobs of an IOC
+
+        :param ioc_id: ID of the IOC
+        :param ioc_value: Value of the IOC
+        :param data_type: Cortex dataType of the IOC
+        :param report_label: Label of the report used in the logs - I.E Domain, IP
+        :param reports: Dict of analyzer name to report, for the analyzers already completed
+        :param jobs: Dict of analyzer name to job ID, for the analyzers still running
+        :param mod_config: Module configuration at the time of the submission
+        :param server_config: Server configuration at the time of the submission
+        :return: Future of the completion
+        """
+        return self._executor.submit(self._complete, ioc_id, ioc_value, data_type, report_label,
+                                     dict(reports), dict(jobs), mod_config, server_config)
+
+    def _complete(self, ioc_id, ioc_value, data_type, report_label, reports, jobs, mod_config,
+                  server_config):
+        try:
+            cortexanalyzer_handler = CortexanalyzerHandler(mod_config=mod_config,
+                                                           server_config=server_config,
+                                                           logger=self.log)
+
+            # The jobs run concurrently in Cortex, so waiting for them in turn costs the slowest
+            # one
+            for analyzer, job_id in jobs.items():
+                status = cortexanalyzer_handler.collect_report(analyzer, job_id, ioc_value,
+                                                               data_type, ioc_id=ioc_id)
+                if status.is_success():
+                    reports[analyzer] = status.get_data()
+                else:
+                    self.log.error(f'Deferred {analyzer} job {job_id} of IOC {ioc_id} failed: '
+                                   f'{status.get_message()}')
+
+            status = self._write_reports(cortexanalyzer_handler, ioc_id, data_type, report_label,
+                                         reports)
+            self.log.info(f'Stage timings of IOC {ioc_id}: '
+                          f'{cortexanalyzer_handler.timings.summary()}')
+            cortexanalyzer_handler.export_metrics()
+
+            job_journal = cortexanalyzer_handler.get_job_journal()
+            if job_journal is not None:
+                job_journal.complete(ioc_id)
+
+            return status
+
+        except Exception:
+            self.log.error(traceback.format_exc())
+            return InterfaceStatus.I2Error(traceback.format_exc())
+
+    def _write_reports(self, cortexanalyzer_handler, ioc_id, data_type, report_label, reports):
+        from app import app, db
+        from app.models import Ioc
+
+        with app.app_context():
+            try:
+                ioc = Ioc.query.filter(Ioc.ioc_id == ioc_id).first()
+                if ioc is None:
+                    self.log.warning(f'IOC {ioc_id} was deleted before its Cortex jobs completed')
+                    return InterfaceStatus.I2Error(f'IOC {ioc_id} not found')
+
+                if not reports:
+                    return InterfaceStatus.I2Error(f'All the Cortex jobs of IOC {ioc_id} failed')
+
+                status = cortexanalyzer_handler.add_report_attribute(ioc, reports, report_label,
+                                                                     data_type=data_type)
+                return InterfaceStatus.merge_status(cortexanalyzer_handler.flush_attributes(),
+                                                    status)
+
+            finally:
+                db.session.remove()
+
+
+_completer = None
+_completer_lock = threading.Lock()
+
+# Journals whose orphan jobs were already resumed by this worker process
+_resumed_journals = set()
+
+
+def get_deferred_completer(logger, max_workers=4) -> DeferredCompleter:
+    """
+    Returns the completer of the worker process, creating it on first use
+
+    :param logger: Logger used by the completer
+    :param max_workers: Number of IOCs completed concurrently
+    :return: DeferredCompleter
+    """
+    global _completer
+    with _completer_lock:
+        if _completer is None:
+            _completer = DeferredCompleter(logger, max_workers=max_workers)
+
+        return _completer
+
+
+def resume_journaled_jobs(cortexanalyzer_handler, logger, max_workers=4):
+    """
+    Hands over to the deferred completer the jobs left in the job journal by the workers
+    which stopped before adding their reports. Only done once per worker process.
+
+    :param cortexanalyzer_handler: CortexanalyzerHandler instance
+    :param logger: Logger used by the completer
+    :param max_workers: Number of IOCs completed concurrently
+    :return: Number of IOCs resumed
+    """
+    job_journal = cortexanalyzer_handler.get_job_journal()
+    if job_journal is None:
+        return 0
+
+    with _completer_lock:
+        if job_journal.db_path in _resumed_journals:
+            return 0
+        _resumed_journals.add(job_journal.db_path)
+
+    orphans = job_journal.claim_orphans(cortexanalyzer_handler.get_job_lease())
+    if not orphans:
+        return 0
+
+    completer = get_deferred_completer(logger, max_workers=max_workers)
+    for ioc_id, (ioc_value, data_type, jobs) in orphans.items():
+        logger.info(f'Resuming the Cortex jobs of IOC {ioc_id}: {jobs}')
+        completer.enqueue(ioc_id, ioc_value, data_type,
+                          cortexanalyzer_handler.get_report_label(data_type), {}, jobs,
+                          cortexanalyzer_handler.mod_config, cortexanalyzer_handler.server_config)
+
+    return len(orphans)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import json
+import time
+
+# Field of the CORTEX Report tab holding the fingerprint of the last enrichment of an IOC
+FINGERPRINT_FIELD = "Enrichment fingerprint"
+
+
+def make_fingerprint(ioc, analyzers, enriched_at=None):
+    """
+    Returns the fingerprint of an enrichment of an IOC, I.E what it was enriched from and when
+
+    :param ioc: IOC instance
+    :param analyzers: Names of the analyzers which returned a report
+    :param enriched_at: Epoch time of the enrichment. Defaults to now
+    :return: JSON string
+    """
+    return json.dumps({
+        "value": ioc.ioc_value,
+        "type": ioc.ioc_type.type_name,
+        "analyzers": sorted(analyzers),
+        "enriched_at": int(enriched_at if enriched_at is not None else time.time()),
+    }, separators=(",", ":"))
+
+
+def read_fingerprint(ioc):
+    """
+    Returns the fingerprint stored on an IOC by its last enrichment
+
+    :param ioc: IOC instance
+    :return: Dict, or None if the IOC has no valid fingerprint
+    """
+    field = ((ioc.custom_attributes or {}).get("CORTEX Report") or {}).get(FINGERPRINT_FIELD)
+    if not isinstance(field, dict):
+        return None
+
+    try:
+        fingerprint = json.loads(field.get("value") or "")
+    except (TypeError, ValueError):
+        return None
+
+    return fingerprint if isinstance(fingerprint, dict) else None
+
+
+def is_fresh(ioc, analyzers, freshness, now=None):
+    """
+    Tells whether the last enrichment of an IOC is still valid: its value and type did not
+    change, every analyzer returned a report, and it is less than freshness seconds old
+
+    :param ioc: IOC instance
+    :param analyzers: Names of the analyzers configured for the IOC
+    :param freshness: Freshness window in seconds. 0 or less never considers an enrichment fresh
+    :param now: Epoch time to compare with. Defaults to now
+    :return: True if the IOC does not need to be enriched again
+    """
+    if freshness <= 0:
+        return False
+
+    fingerprint = read_fingerprint(ioc)
+    if fingerprint is None:
+        return False
+
+    if fingerprint.get("value") != ioc.ioc_value or \
+            fingerprint.get("type") != ioc.ioc_type.type_name:
+        return False
+
+    if not set(analyzers) <= set(fingerprint.get("analyzers") or []):
+        return False
+
+    try:
+        age = (now if now is not None else time.time()) - float(fingerprint.get("enriched_at"))
+    except (TypeError, ValueError):
+        return False
+
+    return 0 <= age < freshness
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import json
+import threading
+from collections import namedtuple
+
+# Route of an IRIS IOC type: the Cortex dataType, the label of its report, and for composite
+# types such as filename|md5 the index of the part of the value which is analyzed
+IocRoute = namedtuple("IocRoute", ["data_type", "label", "part"])
+
+
+def _routes(type_names, data_type, label, part=None):
+    return {type_name: IocRoute(data_type, label, part) for type_name in type_names}
+
+
+# Default routes of the IRIS IOC types to the Cortex dataTypes, built once at module load
+DEFAULT_ROUTES = {
+    **_routes(["domain", "domain|ip"], "domain", "Domain", 0),
+    **_routes(["hostname", "hostname|port"], "fqdn", "FQDN", 0),
+    **_routes(["ip-any", "ip-dst", "ip-src", "ip-dst|port", "ip-src|port"], "ip", "IP", 0),
+    **_routes(["url", "uri", "link"], "url", "URL"),
+    **_routes(["email", "email-src", "email-dst", "email-reply-to", "target-email",
+               "dns-soa-email", "whois-registrant-email"], "mail", "Mail"),
+    **_routes(["email-subject"], "mail_subject", "Mail subject"),
+    **_routes(["md5", "sha1", "sha224", "sha256", "sha384", "sha512", "sha512/224", "sha512/256",
+               "sha3-224", "sha3-256", "sha3-384", "sha3-512", "ssdeep", "imphash", "authentihash",
+               "pehash", "tlsh", "vhash", "impfuzzy", "telfhash"], "hash", "Hash"),
+    **_routes(["filename|md5", "filename|sha1", "filename|sha224", "filename|sha256",
+               "filename|sha384", "filename|sha512", "filename|ssdeep", "filename|imphash",
+               "filename|authentihash", "filename|pehash", "filename|tlsh", "filename|vhash",
+               "filename|impfuzzy"], "hash", "Hash", 1),
+    **_routes(["filename", "email-attachment"], "filename", "Filename"),
+    **_routes(["regkey", "regkey|value"], "registry", "Registry", 0),
+    **_routes(["user-agent"], "user-agent", "User agent"),
+    **_routes(["AS"], "autonomous-system", "AS"),
+}
+
+
+def build_routes(custom_routes=None):
+    """
+    Returns the routes of the IRIS IOC types, I.E the default ones updated with custom ones.
+    A custom route maps an IRIS type name either to a Cortex dataType, or to an object with
+    the data_type, and optionally the label and the part of the value to analyze.
+    A type mapped to null is not routed anymore.
+
+    :param custom_routes: Dict of IRIS type name to custom route
+    :return: Dict of IRIS type name to IocRoute
+    """
+    routes = dict(DEFAULT_ROUTES)
+    for type_name, route in (custom_routes or {}).items():
+        if route is None:
+            routes.pop(type_name, None)
+
+        elif isinstance(route, str):
+            routes[type_name] = IocRoute(route, route.capitalize(), None)
+
+        else:
+            data_type = route["data_type"]
+            routes[type_name] = IocRoute(data_type, route.get("label") or data_type.capitalize(),
+                                         route.get("part"))
+
+    return routes
+
+
+# Routes built for each custom mapping seen by the worker, keyed by its JSON
+_routes_cache = {}
+_routes_lock = threading.Lock()
+
+
+def get_routes(custom_routes=None):
+    """
+    Returns the routes matching a custom mapping, building them the first time the mapping is seen
+
+    :param custom_routes: Dict of IRIS type name to custom route, or its JSON
+    :return: Dict of IRIS type name to IocRoute
+    """
+    if isinstance(custom_routes, str):
+        custom_routes = json.loads(custom_routes) if custom_routes.strip() else {}
+
+    key = json.dumps(custom_routes or {}, sort_keys=True)
+    with _routes_lock:
+        if key not in _routes_cache:
+            _routes_cache[key] = build_routes(custom_routes)
+
+        return _routes_cache[key]
+
+
+def route_value(route, ioc_value):
+    """
+    Returns the part of an IOC value to analyze for a route
+
+    :param route: IocRoute of the type of the IOC
+    :param ioc_value: Value of the IOC
+    :return: Value to submit to Cortex
+    """
+    if route.part is None:
+        return ioc_value
+
+    parts = str(ioc_value).split("|")
+    return parts[route.part].strip() if route.part < len(parts) else ioc_value
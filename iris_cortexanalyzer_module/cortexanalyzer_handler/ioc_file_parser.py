@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import csv
+import json
+from itertools import islice
+from pathlib import Path
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Column or key holding the IOC value in CSV and JSONL files, by order of preference
+VALUE_FIELDS = ("ioc_value", "value", "ioc")
+
+
+class IocFileError(Exception):
+    """
+    Raised when an uploaded file cannot be parsed in its format
+    """
+
+
+def iter_ioc_files(path):
+    """
+    Yields the files to parse below a path, which may be a single file or a directory
+
+    :param path: Path of a file or of a directory
+    :return: Generator of Path
+    """
+    path = Path(path)
+    if path.is_file():
+        yield path
+        return
+
+    for file_path in sorted(path.rglob("*")):
+        if file_path.is_file():
+            yield file_path
+
+
+def iter_ioc_values(path):
+    """
+    Stream-parses IOC values from CSV, JSONL or plain text files, one line at a time, so that
+    files of any size are read in constant memory. The format is chosen from the file extension,
+    anything else than .csv, .json or .jsonl being read as one value per line. A .json file may
+    also hold a single array of entries, which is read incrementally if ijson is installed.
+
+    :param path: Path of a file or of a directory of files
+    :return: Generator of IOC values, stripped and non empty
+    :raises IocFileError: if a JSON or JSONL file is not valid
+    """
+    for file_path in iter_ioc_files(path):
+        suffix = file_path.suffix.lower()
+
+        with open(file_path, newline="", encoding="utf-8", errors="replace") as handle:
+            if suffix == ".csv":
+                values = _iter_csv_values(handle)
+            elif suffix in (".json", ".jsonl"):
+                values = (_entry_value(entry) for entry in _iter_json_entries(file_path, handle))
+            else:
+                values = (line for line in handle if not line.lstrip().startswith("#"))
+
+            for value in values:
+                value = str(value).strip() if value is not None else ""
+                if value:
+                    yield value
+
+
+def _iter_csv_values(handle):
+    reader = csv.reader(handle)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    columns = [column.strip().lower() for column in header]
+    index = next((columns.index(field) for field in VALUE_FIELDS if field in columns), None)
+    if index is None:
+        # No known header, so the first line is already a value
+        index = 0
+        yield header[0] if header else None
+
+    for row in reader:
+        if len(row) > index:
+            yield row[index]
+
+
+def _iter_json_entries(file_path, handle):
+    if _first_character(handle) != "[":
+        yield from _iter_jsonl_entries(file_path, handle)
+        return
+
+    errors = (ValueError, ijson.JSONError) if ijson is not None else ValueError
+    try:
+        # The array is read incrementally when ijson is installed
+        yield from ijson.items(handle.buffer, "item") if ijson is not None else json.load(handle)
+
+    except errors as e:
+        raise IocFileError(f'{file_path.name} is not a valid JSON array: {e}') from e
+
+
+def _iter_jsonl_entries(file_path, handle):
+    for line_number, line in enumerate(handle, start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            # Most likely a pretty-printed JSON object, which would be mostly skipped otherwise
+            raise IocFileError(f'Line {line_number} of {file_path.name} is not a JSON entry. '
+                               'JSON files must hold one entry per line, or an array') from e
+
+
+def _first_character(handle):
+    """
+    Returns the first non blank character of a text file, and rewinds it
+    """
+    character = handle.read(1)
+    while character.isspace():
+        character = handle.read(1)
+
+    handle.seek(0)
+    return character
+
+
+def _entry_value(entry):
+    if isinstance(entry, dict):
+        return next((entry[field] for field in VALUE_FIELDS if field in entry), None)
+
+    return entry if isinstance(entry, str) else None
+
+
+def iter_unique(values, key=None):
+    """
+    Yields the values not seen before
+
+    :param values: Iterable of values
+    :param key: Optional function returning the deduplication key of a value
+    :return: Generator of unique values
+    """
+    seen = set()
+    for value in values:
+        value_key = key(value) if key else value
+        if value_key in seen:
+            continue
+
+        seen.add(value_key)
+        yield value
+
+
+def iter_batches(values, batch_size):
+    """
+    Groups an iterable in lists of at most batch_size items
+
+    :param values: Iterable of values
+    :param batch_size: Maximum size of a batch
+    :return: Generator of lists
+    """
+    iterator = iter(values)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+
+        yield batch
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import ipaddress
+
+# Defanged notations of the dots of domains and IPs, as found in reports and feeds
+_DEFANGED_DOTS = ("[.]", "(.)", "{.}")
+
+
+def _refang(value):
+    for dot in _DEFANGED_DOTS:
+        value = value.replace(dot, ".")
+
+    return value
+
+
+def normalize_value(data_type, value):
+    """
+    Returns the canonical form of an IOC value, so that equivalent values share a job and a cache
+    entry. Domains and FQDNs are lowercased without their trailing dot, IPs are compressed and
+    hashes are lowercased.
+
+    :param data_type: Cortex dataType of the IOC
+    :param value: Value of the IOC
+    :return: Normalized value
+    """
+    value = str(value).strip()
+    if data_type in ("domain", "fqdn"):
+        return _refang(value).rstrip(".").lower()
+
+    if data_type == "ip":
+        value = _refang(value)
+        try:
+            return ipaddress.ip_address(value).compressed
+
+        except ValueError:
+            return value.lower()
+
+    if data_type == "hash":
+        return value.lower()
+
+    return value
+
+
+def match_key(value):
+    """
+    Returns the form under which a value of unknown type, I.E read from an uploaded IOC list, is
+    matched with the IOCs of a case. Defanged, differently cased or trailing-dot domains, and
+    differently written IPs, share a key, as they do with normalize_value.
+
+    :param value: IOC value
+    :return: Key of the value
+    """
+    value = _refang(str(value).strip()).rstrip(".")
+    try:
+        return ipaddress.ip_address(value).compressed
+
+    except ValueError:
+        return value.lower()
+
+
+def group_iocs(iocs):
+    """
+    Groups IOCs by (Cortex dataType, normalized value), keeping the order in which the values first
+    appear
+
+    :param iocs: Iterable of (key, IOC value, Cortex dataType, IOC ID)
+    :return: List of (normalized value, Cortex dataType, list of (key, IOC ID))
+    """
+    groups = {}
+    for key, ioc_value, data_type, ioc_id in iocs:
+        value = normalize_value(data_type, ioc_value)
+        groups.setdefault((data_type, value), (value, data_type, []))[2].append((key, ioc_id))
+
+    return list(groups.values())
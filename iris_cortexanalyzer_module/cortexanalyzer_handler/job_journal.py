@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_normalizer import normalize_value
+
+# Identifies this worker process, even if its PID is reused by a later one
+PROCESS_TOKEN = f'{os.getpid()}:{uuid.uuid4().hex}'
+
+
+class JobJournal(object):
+    """
+    Durable journal of the Cortex jobs in flight, stored in a SQLite database.
+
+    A job is recorded with its IOC when it is submitted, and removed once its report was
+    written to the IOC. The jobs left in the journal by a worker which stopped can then be
+    resumed by another one, instead of being submitted again.
+
+    Each job is leased to the process which submitted or resumed it, which renews the lease
+    whenever it starts waiting for the job. A job is only resumed by another worker once its
+    lease expired. Liveness is never checked with the PID, as the journal may be shared by
+    workers in other containers or PID namespaces.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("CREATE TABLE IF NOT EXISTS cortex_jobs ("
+                         "job_id TEXT NOT NULL, ioc_id INTEGER NOT NULL, ioc_value TEXT NOT NULL, "
+                         "data_type TEXT NOT NULL, analyzer TEXT NOT NULL, owner TEXT NOT NULL, "
+                         "lease_until REAL NOT NULL, PRIMARY KEY (job_id, ioc_id))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS cortex_jobs_observable "
+                         "ON cortex_jobs (analyzer, data_type, ioc_value)")
+        # Left by the versions which journaled the jobs without IOC, which are never completed
+        self._db.execute("DELETE FROM cortex_jobs WHERE ioc_id IS NULL")
+        self._db.commit()
+
+    def record(self, job_id, ioc_id, ioc_value, data_type, analyzer, timeout):
+        """
+        Records a job submitted, or reused, for an IOC. Jobs which are not bound to an IOC are not
+        recorded, as they have no report to resume.
+
+        :param job_id: ID of the Cortex job
+        :param ioc_id: ID of the IOC, or None if the job is not bound to an IOC
+        :param ioc_value: Value of the IOC
+        :param data_type: Cortex dataType of the IOC
+        :param analyzer: Name of the analyzer
+        :param timeout: Time in seconds during which the job is leased to this worker
+        :return: Nothing
+        """
+        if ioc_id is None:
+            return
+
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO cortex_jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (job_id, ioc_id, normalize_value(data_type, ioc_value), data_type,
+                              analyzer, PROCESS_TOKEN, time.time() + timeout))
+            self._db.commit()
+
+    def find_running(self, analyzer, data_type, ioc_value):
+        """
+        Returns the ID of a job of the analyzer on the same value still in flight, if any
+
+        :param analyzer: Name of the analyzer
+        :param data_type: Cortex dataType of the IOC
+        :param ioc_value: Value of the IOC
+        :return: Job ID or None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT job_id FROM cortex_jobs WHERE analyzer = ? "
+                                   "AND data_type = ? AND ioc_value = ? AND lease_until > ? "
+                                   "LIMIT 1",
+                                   (analyzer, data_type, normalize_value(data_type, ioc_value),
+                                    time.time())).fetchone()
+
+        return row[0] if row else None
+
+    def renew(self, job_id, timeout):
+        """
+        Renews the lease of this worker on a job, so that it is not resumed by another worker
+        while this one waits for it
+
+        :param job_id: ID of the Cortex job
+        :param timeout: Time in seconds during which the job is leased to this worker
+        :return: Nothing
+        """
+        with self._lock:
+            self._db.execute("UPDATE cortex_jobs SET lease_until = ? "
+                             "WHERE job_id = ? AND owner = ?",
+                             (time.time() + timeout, job_id, PROCESS_TOKEN))
+            self._db.commit()
+
+    def complete(self, ioc_id, analyzers=None):
+        """
+        Removes the jobs of an IOC, once their reports were written or they failed
+
+        :param ioc_id: ID of the IOC
+        :param analyzers: Optional list of analyzers to remove the jobs of. Defaults to all
+        :return: Nothing
+        """
+        with self._lock:
+            if analyzers is None:
+                self._db.execute("DELETE FROM cortex_jobs WHERE ioc_id = ?", (ioc_id,))
+            else:
+                self._db.executemany("DELETE FROM cortex_jobs WHERE ioc_id = ? AND analyzer = ?",
+                                     [(ioc_id, analyzer) for analyzer in analyzers])
+            self._db.commit()
+
+    def discard(self, job_id):
+        """
+        Removes a job which failed and was submitted again, so that it is not reused
+
+        :param job_id: ID of the Cortex job
+        :return: Nothing
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM cortex_jobs WHERE job_id = ?", (job_id,))
+            self._db.commit()
+
+    def claim_orphans(self, timeout):
+        """
+        Takes over the jobs whose lease expired, I.E whose worker stopped or stopped waiting for
+        them
+
+        :param timeout: Time in seconds during which the claimed jobs belong to this worker
+        :return: Dict of IOC ID to (IOC value, Cortex dataType, dict of analyzer name to job ID)
+        """
+        now = time.time()
+        orphans = {}
+
+        with self._lock:
+            rows = self._db.execute("SELECT job_id, ioc_id, ioc_value, data_type, analyzer, owner "
+                                    "FROM cortex_jobs WHERE owner != ? AND lease_until <= ?",
+                                    (PROCESS_TOKEN, now)).fetchall()
+
+            for job_id, ioc_id, ioc_value, data_type, analyzer, owner in rows:
+                # Only claim the job if no other worker claimed it in between
+                claimed = self._db.execute("UPDATE cortex_jobs SET owner = ?, lease_until = ? "
+                                           "WHERE job_id = ? AND ioc_id = ? AND owner = ?",
+                                           (PROCESS_TOKEN, now + timeout, job_id, ioc_id,
+                                            owner)).rowcount
+                if claimed:
+                    orphans.setdefault(ioc_id, (ioc_value, data_type, {}))[2][analyzer] = job_id
+
+            self._db.commit()
+
+        return orphans
+
+
+# Journals shared by every handler of the worker process, keyed by their path
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_job_journal(db_path) -> JobJournal:
+    """
+    Returns the process-wide journal stored at db_path, opening it if needed
+
+    :param db_path: Path of the SQLite database
+    :return: JobJournal
+    """
+    with _journals_lock:
+        if db_path not in _journals:
+            _journals[db_path] = JobJournal(db_path)
+
+        return _journals[db_path]
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import random
+import threading
+import time
+import traceback
+
+from cortex4py.query import Id, Or
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitOpenError
+
+# Cortex job states after which a job will not change anymore
+JOB_FINAL_STATES = ("Success", "Failure", "Deleted")
+
+# Maximum number of job IDs checked by a single job search
+PAGE_SIZE = 200
+
+# Bounds, in seconds, of the delay between two polling rounds. The delay grows while no job
+# completes
+INITIAL_DELAY = 0.5
+MAX_DELAY = 5
+
+
+def status_query(job_ids):
+    """
+    Returns the job search query matching a list of job IDs, and its range
+
+    :param job_ids: List of job IDs
+    :return: Tuple of (query, range)
+    """
+    return Or(*[Id(job_id) for job_id in job_ids]), f'0-{len(job_ids)}'
+
+
+def next_delay(delay, completed):
+    """
+    Returns the delay before the next polling round, reset when a job completed, backed off
+    otherwise
+    """
+    return INITIAL_DELAY if completed else backoff_delay(delay)
+
+
+def backoff_delay(delay):
+    """
+    Returns the delay after a polling round which found nothing or failed, with an exponential
+    backoff and decorrelated jitter, so that the workers started together do not poll Cortex in
+    lockstep
+
+    :param delay: Previous delay in seconds
+    :return: Delay in seconds, between INITIAL_DELAY and MAX_DELAY
+    """
+    return min(MAX_DELAY, random.uniform(INITIAL_DELAY, delay * 3))
+
+
+class _TrackedJob(object):
+    def __init__(self, r_json=None):
+        self.r_json = r_json
+        self.error = None
+        self.done = threading.Event()
+        self.waiters = 0
+
+
+class JobTracker(object):
+    """
+    Tracks the Cortex jobs being waited for by every thread of the worker.
+
+    Instead of polling each job on its own, a single background thread checks all the
+    outstanding job IDs with one job search per round, and wakes up the waiters of the jobs
+    which completed. The cost of a polling round thus does not grow with the number of jobs.
+    While the circuit of Cortex is open, the waiters are released with CircuitOpenError.
+    """
+
+    def __init__(self, api, logger):
+        self.api = api
+        self.log = logger
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def wait(self, job_id, timeout, r_json=None):
+        """
+        Waits for a job to reach a final state, up to timeout seconds
+
+        :param job_id: ID of the Cortex job
+        :param timeout: Seconds to wait
+        :param r_json: Last known state of the job, if any
+        :return: Last known state of the job
+        :raises CircuitOpenError: if Cortex became unavailable while waiting
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = _TrackedJob(r_json)
+            job.waiters += 1
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_loop, daemon=True,
+                                                name="cortexanalyzer-job-tracker")
+                self._thread.start()
+
+        job.done.wait(timeout)
+
+        # The job is no longer polled once nobody waits for it, whether it completed or timed out
+        with self._lock:
+            job.waiters -= 1
+            if job.waiters == 0 and self._jobs.get(job_id) is job:
+                del self._jobs[job_id]
+
+        if job.error is not None:
+            raise job.error
+
+        return job.r_json
+
+    def poll(self, job_ids):
+        """
+        Checks the status of jobs with one job search per PAGE_SIZE jobs, and releases the waiters
+        of the completed ones
+
+        :param job_ids: List of job IDs
+        :return: Number of jobs which completed
+        """
+        completed = 0
+        for start in range(0, len(job_ids), PAGE_SIZE):
+            query, page_range = status_query(job_ids[start:start + PAGE_SIZE])
+            for job in self.api.jobs.find_all(query, range=page_range):
+                completed += self._update(job.json())
+
+        return completed
+
+    def _update(self, r_json):
+        with self._lock:
+            job = self._jobs.get(r_json.get("id"))
+
+        if job is None:
+            return 0
+
+        job.r_json = r_json
+        if r_json.get("status") not in JOB_FINAL_STATES:
+            return 0
+
+        job.done.set()
+        return 1
+
+    def _fail(self, job_ids, error):
+        with self._lock:
+            jobs = [self._jobs[job_id] for job_id in job_ids if job_id in self._jobs]
+
+        for job in jobs:
+            job.error = error
+            job.done.set()
+
+    def _poll_loop(self):
+        delay = INITIAL_DELAY
+        while True:
+            time.sleep(delay)
+
+            with self._lock:
+                job_ids = [job_id for job_id, job in self._jobs.items() if not job.done.is_set()]
+                if not job_ids:
+                    self._thread = None
+                    return
+
+            try:
+                delay = next_delay(delay, self.poll(job_ids))
+
+            except CircuitOpenError as e:
+                self.log.warning(f'{e}. Releasing the waiters of {len(job_ids)} Cortex jobs')
+                self._fail(job_ids, e)
+
+            except Exception:
+                self.log.warning(f'Unable to check the status of {len(job_ids)} Cortex jobs')
+                self.log.warning(traceback.format_exc())
+                delay = backoff_delay(delay)
+
+
+class AsyncJobTracker(object):
+    """
+    Coroutine counterpart of JobTracker, for the asyncio engine. A single task of the event
+    loop checks all the outstanding jobs with one job search per round.
+    While the circuit of Cortex is open, the waiters are released with CircuitOpenError.
+    """
+
+    def __init__(self, request, logger):
+        """
+        :param request: Coroutine function called with the HTTP method, endpoint and keyword
+                        arguments of a Cortex request, returning its decoded JSON
+        :param logger: Logger
+        """
+        self._request = request
+        self.log = logger
+        self._jobs = {}
+        self._task = None
+
+    async def wait(self, r_json, timeout):
+        """
+        Waits for a job to reach a final state, up to timeout seconds
+
+        :param r_json: Last known state of the job
+        :param timeout: Seconds to wait
+        :return: Last known state of the job
+        """
+        import asyncio
+
+        job_id = r_json["id"]
+        future = self._jobs.get(job_id)
+        if future is None:
+            future = self._jobs[job_id] = asyncio.get_running_loop().create_future()
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._poll_loop())
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+        except asyncio.TimeoutError:
+            self._jobs.pop(job_id, None)
+            return r_json
+
+    async def poll(self, job_ids):
+        """
+        Checks the status of jobs with one job search per PAGE_SIZE jobs, and resolves the
+        futures of the completed ones
+
+        :param job_ids: List of job IDs
+        :return: Number of jobs which completed
+        """
+        completed = 0
+        for start in range(0, len(job_ids), PAGE_SIZE):
+            query, page_range = status_query(job_ids[start:start + PAGE_SIZE])
+            jobs = await self._request('POST', 'job/_search', json={"query": query},
+                                       params={"range": page_range})
+            for r_json in jobs:
+                future = self._jobs.get(r_json.get("id"))
+                if future is not None and r_json.get("status") in JOB_FINAL_STATES:
+                    del self._jobs[r_json["id"]]
+                    future.set_result(r_json)
+                    completed += 1
+
+        return completed
+
+    async def _poll_loop(self):
+        import asyncio
+
+        delay = INITIAL_DELAY
+        try:
+            while self._jobs:
+                await asyncio.sleep(delay)
+
+                job_ids = [job_id for job_id, future in self._jobs.items() if not future.done()]
+                if not job_ids:
+                    continue
+
+                try:
+                    delay = next_delay(delay, await self.poll(job_ids))
+
+                except CircuitOpenError as e:
+                    self.log.warning(f'{e}. Releasing the waiters of {len(job_ids)} Cortex jobs')
+                    for job_id in job_ids:
+                        future = self._jobs.pop(job_id, None)
+                        if future is not None and not future.done():
+                            future.set_exception(e)
+
+                except Exception:
+                    self.log.warning(f'Unable to check the status of {len(job_ids)} Cortex jobs')
+                    self.log.warning(traceback.format_exc())
+                    delay = backoff_delay(delay)
+
+        finally:
+            self._task = None
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_job_tracker(api, logger) -> JobTracker:
+    """
+    Returns the process-wide job tracker of a Cortex client, creating it on first use
+
+    :param api: Cortex client
+    :param logger: Logger used by the tracker
+    :return: JobTracker
+    """
+    with _trackers_lock:
+        tracker = _trackers.get(id(api))
+        if tracker is None or tracker.api is not api:
+            tracker = _trackers[id(api)] = JobTracker(api, logger)
+
+        return tracker
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import time
+from contextlib import closing
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitOpenError
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import JOB_FINAL_STATES
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import get_job_tracker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_stream import CHUNK_SIZE
+
+
+class JobWaiter(object):
+    """
+    Waits for Cortex jobs to complete and fetches their report.
+
+    The blocking /api/job/<id>/waitreport endpoint is used when available, so the
+    report is returned as soon as the job finishes with a single long request.
+    Otherwise, the job is handed over to the job tracker of the worker, which polls
+    all the outstanding jobs together with one job search per round.
+
+    If a ReportReader is given, the responses holding reports are read in chunks with it, so
+    that large reports are never loaded in full.
+    """
+
+    # Longest single waitreport request, so that proxies do not cut the connection
+    waitreport_slice = 30
+
+    def __init__(self, api, logger, timeout=300, use_waitreport=True, reader=None):
+        self.api = api
+        self.log = logger
+        self.timeout = timeout
+        self.use_waitreport = use_waitreport
+        # The response bodies can only be streamed with the module client
+        self.reader = reader if hasattr(api, "do_get_stream") else None
+
+    def wait(self, job_id, r_json=None) -> InterfaceStatus.IIStatus:
+        """
+        Waits for a job to complete, up to the configured timeout
+
+        :param job_id: ID of the Cortex job
+        :param r_json: Job as returned on submission, if any
+        :return: IIStatus, with the job as data. On success, the job holds its report if waitreport
+                 returned it
+        """
+        deadline = time.monotonic() + self.timeout
+
+        if r_json and r_json.get("status") == "Failure":
+            return self._job_failure(r_json)
+
+        if self.use_waitreport:
+            try:
+                r_json = self._wait_with_waitreport(job_id, deadline)
+
+            except CircuitOpenError:
+                raise
+
+            except Exception as e:
+                self.log.warning(f'waitreport is not available ({e}). Falling back to polling')
+                self.use_waitreport = False
+
+        if not self.use_waitreport and (not r_json
+                                        or r_json.get("status") not in JOB_FINAL_STATES):
+            remaining = max(0.0, deadline - time.monotonic())
+            r_json = get_job_tracker(self.api, self.log).wait(job_id, remaining, r_json)
+
+        job_state = r_json.get("status") if r_json else None
+        if job_state == "Success":
+            self.log.info("Job completed successfully")
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                            data=r_json)
+
+        if job_state in JOB_FINAL_STATES:
+            return self._job_failure(r_json)
+
+        self.log.error(f'Job {job_id} failed to complete after {self.timeout} seconds.')
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                        message=f'Job failed to complete after {self.timeout} '
+                                                'seconds.',
+                                        data=r_json)
+
+    def fetch_report(self, job_id):
+        """
+        Fetches the report of a completed job
+
+        :param job_id: ID of the Cortex job
+        :return: Cortex report
+        """
+        if self.reader is not None:
+            return self._read_job(f'job/{job_id}/report')["report"]
+
+        return self.api.jobs.get_report(job_id).json()["report"]
+
+    def _wait_with_waitreport(self, job_id, deadline):
+        """
+        Waits on the blocking waitreport endpoint, in slices, until the job is done or the deadline
+        passed
+        """
+        r_json = None
+        while True:
+            remaining = int(deadline - time.monotonic())
+            if remaining < 1:
+                return r_json
+
+            at_most = min(remaining, self.waitreport_slice)
+            # atMost goes in the query parameters, so that the client adds it to its read timeout
+            params = {"atMost": f'{at_most}seconds'}
+            if self.reader is not None:
+                r_json = self._read_job(f'job/{job_id}/waitreport', params)
+            else:
+                r_json = self.api.do_get(f'job/{job_id}/waitreport', params).json()
+            if r_json.get("status") in JOB_FINAL_STATES:
+                return r_json
+
+    def _read_job(self, endpoint, params=None):
+        """
+        Reads a job returned with its report by Cortex with the report reader
+        """
+        with closing(self.api.do_get_stream(endpoint, params or {})) as response:
+            return self.reader.read(response.iter_content(CHUNK_SIZE))
+
+    def _job_failure(self, r_json):
+        error_message = r_json.get("errorMessage") or r_json.get("report", {}).get("errorMessage")
+        self.log.error(f'Cortex Failure: {error_message}')
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                        message=f'Cortex Failure: {error_message}',
+                                        data=r_json)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the buckets of the stage durations histogram
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Counters exported, with their help text
+COUNTERS = {
+    "report_cache_hits": "Reports served from the report cache",
+    "report_cache_misses": "Reports not found in the report cache",
+    "jobs_submitted": "Cortex jobs submitted",
+    "job_failures": "Cortex jobs which failed",
+    "timeouts": "Cortex jobs which did not complete before the job timeout",
+    "retries": "Rate limited submissions and jobs retried",
+    "circuit_rejections": "Cortex jobs failed fast while the circuit of Cortex was open",
+}
+
+
+class MetricsRegistry(object):
+    """
+    Process-wide metrics of the module: a histogram of the duration of each stage, and
+    counters. They are rendered in the Prometheus text format, and can be written to a
+    file read by the textfile collector of the node exporter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = dict.fromkeys(COUNTERS, 0)
+
+    def observe(self, stage, elapsed):
+        """
+        Adds a run of a stage
+
+        :param stage: Name of the stage
+        :param elapsed: Time spent in the stage, in seconds
+        :return: Nothing
+        """
+        with self._lock:
+            buckets, total, count = self._stages.get(stage, ([0] * len(STAGE_BUCKETS), 0.0, 0))
+            index = bisect_left(STAGE_BUCKETS, elapsed)
+            if index < len(buckets):
+                buckets[index] += 1
+
+            self._stages[stage] = (buckets, total + elapsed, count + 1)
+
+    def inc(self, counter, value=1):
+        """
+        Increments a counter
+
+        :param counter: Name of the counter
+        :param value: Increment
+        :return: Nothing
+        """
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + value
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format
+
+        :return: String
+        """
+        with self._lock:
+            stages = {stage: (list(buckets), total, count)
+                      for stage, (buckets, total, count) in self._stages.items()}
+            counters = dict(self._counters)
+
+        lines = ["# HELP cortexanalyzer_stage_seconds Time spent in each stage of the enrichment",
+                 "# TYPE cortexanalyzer_stage_seconds histogram"]
+        for stage, (buckets, total, count) in sorted(stages.items()):
+            cumulative = 0
+            for bound, bucket in zip(STAGE_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'cortexanalyzer_stage_seconds_bucket{{stage="{stage}",'
+                             f'le="{bound}"}} {cumulative}')
+
+            lines.append(f'cortexanalyzer_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} '
+                         f'{count}')
+            lines.append(f'cortexanalyzer_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'cortexanalyzer_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        for counter, value in sorted(counters.items()):
+            lines.append(f'# HELP cortexanalyzer_{counter}_total {COUNTERS.get(counter, counter)}')
+            lines.append(f'# TYPE cortexanalyzer_{counter}_total counter')
+            lines.append(f'cortexanalyzer_{counter}_total {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the metrics to a file, atomically so that collectors never read a partial file
+
+        :param path: Path of the file. {pid} is replaced by the PID of the worker
+        :return: Nothing
+        """
+        path = path.replace("{pid}", str(os.getpid()))
+        directory = os.path.dirname(os.path.abspath(path))
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".cortexanalyzer-metrics-")
+        try:
+            with os.fdopen(fd, "w") as metrics_file:
+                metrics_file.write(self.render())
+
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Returns the metrics registry of the worker process
+    """
+    return _registry
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import json
+import random
+import re
+import threading
+import time
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_BULK
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import Ticket
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import TicketQueue
+
+# Words of the error messages of analyzers and third-party APIs which ran out of quota. Bare status
+# codes are left out, as they also appear in the hashes and addresses of the analyzed IOCs
+RATE_LIMIT_MARKERS = ("rate limit", "ratelimit", "rate-limit", "too many requests", "quota",
+                      "request limit", "throttl")
+RATE_LIMIT_PATTERN = re.compile(r'\b(?:' + "|".join(re.escape(marker)
+                                                    for marker in RATE_LIMIT_MARKERS) + ')')
+
+# HTTP status codes Cortex answers with when it is throttling the submissions
+RATE_LIMIT_STATUS_CODES = (429, 503)
+
+# Bounds, in seconds, of the delay before retrying a rate limited job
+RETRY_INITIAL_DELAY = 5
+RETRY_MAX_DELAY = 120
+
+
+class TokenBucket(object):
+    """
+    Token bucket releasing jobs of an analyzer at a sustained rate, with bursts of up to burst
+    jobs.
+
+    Each job takes a token before it is submitted. When the bucket is empty, the jobs wait in
+    line for the next tokens, which go to the most urgent priority class first and round robin
+    to the cases within a class, as the slots of the job scheduler do. A manual trigger thus
+    gets the next token even behind a bulk import, whether the callers are threads or coroutines.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: Sustained number of jobs per minute
+        :param burst: Number of jobs which can be released at once after an idle period
+        """
+        self.rate = rate / 60
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._waiting = TicketQueue()
+        self._lock = threading.Lock()
+
+    def waiting(self) -> int:
+        """
+        Returns the number of jobs waiting for a token
+        """
+        with self._lock:
+            return len(self._waiting)
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a token if one is available and no job is waiting for it
+
+        :return: True if a token was taken
+        """
+        with self._lock:
+            self._refill()
+            if self._waiting or self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+            return True
+
+    def acquire(self, priority=PRIORITY_BULK, case=None):
+        """
+        Blocks until a token is granted to the caller
+
+        :param priority: Priority class of the job
+        :param case: Key of the case of the job, used to share the tokens fairly within the class
+        :return: Nothing
+        """
+        granted = threading.Event()
+        delay = self._wait(Ticket(granted.set), priority, case)
+        while not granted.wait(delay):
+            delay = self._grant()
+
+    async def acquire_async(self, priority=PRIORITY_BULK, case=None):
+        """
+        Waits on the running event loop until a token is granted to the caller
+
+        :param priority: Priority class of the job
+        :param case: Key of the case of the job, used to share the tokens fairly within the class
+        :return: Nothing
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        ticket = Ticket(lambda: loop.call_soon_threadsafe(
+            lambda: granted.done() or granted.set_result(True)))
+        delay = self._wait(ticket, priority, case)
+
+        try:
+            while not granted.done():
+                await asyncio.wait({granted}, timeout=delay)
+                if not granted.done():
+                    delay = self._grant()
+
+        except asyncio.CancelledError:
+            self._cancel(ticket, priority, case)
+            raise
+
+    def _wait(self, ticket, priority, case):
+        """
+        Queues a ticket and grants the available tokens
+
+        :return: Seconds until the next token, see _grant
+        """
+        with self._lock:
+            self._waiting.push(ticket, priority, case)
+
+        return self._grant()
+
+    def _cancel(self, ticket, priority, case):
+        with self._lock:
+            if not ticket.granted:
+                self._waiting.remove(ticket, priority, case)
+                return
+
+            # The token was granted while the waiter was being cancelled
+            self._tokens = min(self.burst, self._tokens + 1)
+
+        self._grant()
+
+    def _grant(self):
+        """
+        Grants the available tokens to the waiting tickets, most urgent first
+
+        :return: Seconds until the next token, None if no ticket is left waiting
+        """
+        notifications = []
+        with self._lock:
+            self._refill()
+            while self._waiting and self._tokens >= 1:
+                ticket = self._waiting.pop()
+                ticket.granted = True
+                self._tokens -= 1
+                notifications.append(ticket.notify)
+
+            delay = (1 - self._tokens) / self.rate if self._waiting else None
+
+        for notify in notifications:
+            notify()
+
+        return delay
+
+    def _refill(self):
+        """
+        Adds the tokens earned since the last refill. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+def is_rate_limited(error) -> bool:
+    """
+    Returns True if an error looks like the analyzer or Cortex ran out of quota
+
+    :param error: Error message, or exception raised by cortex4py or aiohttp
+    :return: bool
+    """
+    if isinstance(error, BaseException):
+        status_code = getattr(error, "status", None)
+        response = getattr(error.__cause__, "response", None)
+        if response is not None:
+            status_code = response.status_code
+
+        if status_code in RATE_LIMIT_STATUS_CODES:
+            return True
+
+    return RATE_LIMIT_PATTERN.search(str(error or "").lower()) is not None
+
+
+def retry_delay(attempt) -> float:
+    """
+    Returns the delay before retrying a rate limited job, with an exponential backoff and full
+    jitter
+
+    :param attempt: Number of the retry, starting at 0
+    :return: Delay in seconds
+    """
+    ceiling = min(RETRY_MAX_DELAY, RETRY_INITIAL_DELAY * 2 ** (attempt + 1))
+    return random.uniform(RETRY_INITIAL_DELAY, ceiling)
+
+
+def parse_rate_limits(rate_limits):
+    """
+    Parses the cortexanalyzer_rate_limits setting. Invalid entries are left out and reported.
+
+    :param rate_limits: JSON object, or its text, mapping an analyzer to {"rate": jobs per minute,
+                        "burst": jobs}
+    :return: Tuple of the dict of analyzer name to (rate, burst), and of the list of the problems
+             found
+    """
+    if isinstance(rate_limits, str):
+        try:
+            rate_limits = json.loads(rate_limits) if rate_limits.strip() else {}
+        except ValueError:
+            return {}, ["cortexanalyzer_rate_limits is not valid JSON"]
+
+    if not rate_limits:
+        return {}, []
+
+    if not isinstance(rate_limits, dict):
+        return {}, ["cortexanalyzer_rate_limits must be a JSON object of analyzer name to rate "
+                    "limit"]
+
+    limits = {}
+    problems = []
+    for analyzer, limit in rate_limits.items():
+        try:
+            if not isinstance(limit, dict):
+                raise ValueError(limit)
+            rate = float(limit.get("rate") or 0)
+            burst = int(limit.get("burst") or 1)
+
+        except (TypeError, ValueError):
+            problems.append(f'Rate limit of {analyzer} must be an object such as '
+                            f'{{"rate": 4, "burst": 4}}, not {json.dumps(limit, default=str)}')
+            continue
+
+        # A rate of 0 disables the rate limit of the analyzer
+        if rate > 0:
+            limits[analyzer] = (rate, burst)
+
+    return limits, problems
+
+
+# Buckets shared by every handler of the worker process, keyed by analyzer and settings
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_rate_limiter(analyzer, rate, burst=1) -> TokenBucket:
+    """
+    Returns the process-wide token bucket of an analyzer, creating it if needed
+
+    :param analyzer: Name of the analyzer
+    :param rate: Sustained number of jobs per minute
+    :param burst: Number of jobs which can be released at once
+    :return: TokenBucket
+    """
+    key = (analyzer, rate, burst)
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate, burst)
+
+        return _buckets[key]
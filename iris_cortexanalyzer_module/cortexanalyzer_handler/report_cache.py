@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_normalizer import normalize_value
+
+
+class ReportCache(object):
+    """
+    Cache of the Cortex reports of a Cortex instance, keyed by (analyzer, dataType, normalized
+    value).
+
+    Entries are kept in memory in LRU order, up to max_bytes of serialized reports, and expire
+    after ttl seconds. If a db_path is provided, the entries are also stored in a SQLite database,
+    so that they are shared between the workers and survive restarts. The database holds the
+    reports of every Cortex instance, told apart by their source, within the same bound.
+    """
+
+    def __init__(self, source, ttl=3600, max_bytes=64 * 1024 * 1024, db_path=None):
+        """
+        :param source: Cortex instance the reports come from, see cache_source
+        :param ttl: Time in seconds after which a cached report expires
+        :param max_bytes: Maximum total size of the cached reports, serialized as JSON
+        :param db_path: Path of the SQLite database backing the cache, if any
+        """
+        self.source = source
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+
+        # Entries valued by (creation time, report, size in bytes)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(cortex_reports)")]
+            if columns and "source" not in columns:
+                # Reports cached before they were keyed by Cortex instance cannot be told apart
+                self._db.execute("DROP TABLE cortex_reports")
+            self._db.execute("CREATE TABLE IF NOT EXISTS cortex_reports ("
+                             "source TEXT NOT NULL, analyzer TEXT NOT NULL, "
+                             "data_type TEXT NOT NULL, value TEXT NOT NULL, "
+                             "created REAL NOT NULL, report TEXT NOT NULL, "
+                             "PRIMARY KEY (source, analyzer, data_type, value))")
+            self._db.commit()
+
+    @property
+    def size(self):
+        """
+        Total size, in bytes, of the reports cached in memory
+        """
+        return self._size
+
+    def get(self, analyzer, data_type, value):
+        """
+        Returns the cached report of an IOC value, or None if it is not cached or expired
+
+        :param analyzer: Name of the analyzer
+        :param data_type: Cortex dataType of the IOC
+        :param value: Value of the IOC
+        :return: Report or None
+        """
+        key = (analyzer, data_type, normalize_value(data_type, value))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+            if entry:
+                self._evict(key)
+
+            if self._db is None:
+                return None
+
+            row = self._db.execute("SELECT created, report FROM cortex_reports WHERE source = ? "
+                                   "AND analyzer = ? AND data_type = ? AND value = ?",
+                                   (self.source,) + key).fetchone()
+            if not row or now - row[0] >= self.ttl:
+                return None
+
+            report = json.loads(row[1])
+            self._store(key, row[0], report, len(row[1].encode()))
+
+        return report
+
+    def set(self, analyzer, data_type, value, report):
+        """
+        Caches the report of an IOC value. Reports larger than the cache are not cached.
+
+        :param analyzer: Name of the analyzer
+        :param data_type: Cortex dataType of the IOC
+        :param value: Value of the IOC
+        :param report: Cortex report
+        :return: Nothing
+        """
+        key = (analyzer, data_type, normalize_value(data_type, value))
+        serialized = json.dumps(report)
+        size = len(serialized.encode())
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._store(key, now, report, size)
+
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO cortex_reports VALUES (?, ?, ?, ?, ?, ?)",
+                                 (self.source,) + key + (now, serialized))
+                self._db.execute("DELETE FROM cortex_reports WHERE created < ?", (now - self.ttl,))
+                # The most recent reports are kept, up to max_bytes for all the Cortex instances
+                self._db.execute("DELETE FROM cortex_reports WHERE rowid IN (SELECT rowid FROM ("
+                                 "SELECT rowid, SUM(LENGTH(CAST(report AS BLOB))) OVER "
+                                 "(ORDER BY created DESC, rowid DESC) AS total "
+                                 "FROM cortex_reports) WHERE total > ?)", (self.max_bytes,))
+                self._db.commit()
+
+    def _store(self, key, created, report, size):
+        if key in self._entries:
+            self._evict(key)
+
+        self._entries[key] = (created, report, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        self._size -= self._entries.pop(key)[2]
+
+
+def cache_source(url, api_key) -> str:
+    """
+    Returns the source of the reports of a Cortex instance, so that the reports of different
+    Cortex instances, or of different organizations of an instance, are cached apart
+
+    :param url: Cortex URL
+    :param api_key: Cortex API key
+    :return: URL with the digest of the API key
+    """
+    return f'{url}#{hashlib.sha256((api_key or "").encode()).hexdigest()[:16]}'
+
+
+# Report caches shared by every handler of the worker process, keyed by their settings
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_report_cache(source, ttl, max_bytes, db_path=None) -> ReportCache:
+    """
+    Returns the process-wide report cache matching the settings, creating it if needed
+
+    :param source: Cortex instance the reports come from, see cache_source
+    :param ttl: Time in seconds after which a cached report expires
+    :param max_bytes: Maximum total size of the cached reports
+    :param db_path: Path of the SQLite database backing the cache, if any
+    :return: ReportCache
+    """
+    key = (source, ttl, max_bytes, db_path or None)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ReportCache(source, ttl=ttl, max_bytes=max_bytes,
+                                       db_path=db_path or None)
+
+        return _caches[key]
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import json
+
+# Report storage modes
+STORAGE_FULL = "full"
+STORAGE_SUMMARY = "summary"
+
+
+def summarize_report(report):
+    """
+    Returns the compact part of a Cortex report, I.E its summary, which holds its taxonomies
+
+    :param report: Cortex report
+    :return: Dict
+    """
+    return {
+        "success": report.get("success", True),
+        "summary": report.get("summary") or {},
+    }
+
+
+def bound_results(results, summaries, max_size):
+    """
+    Returns the full results if their JSON fits in max_size bytes, else the summaries with a
+    truncation note, so that huge reports are never rendered inline.
+
+    :param results: Full results to render
+    :param summaries: Summarized results, used when the full ones are too large
+    :param max_size: Size cap in bytes. 0 disables the cap
+    :return: Results to render
+    """
+    if max_size <= 0:
+        return results
+
+    size = len(json.dumps(results, separators=(",", ":")))
+    if size <= max_size:
+        return results
+
+    return {
+        "truncated": f"Full report of {size} bytes exceeds the {max_size} bytes cap. Only the "
+                     "summary is shown",
+        "results": summaries,
+    }
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import json
+import tempfile
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Size in bytes of the response bodies kept in memory before they are spooled to disk
+SPOOL_MEMORY_SIZE = 1024 * 1024
+
+# Size of the chunks the response bodies are read by
+CHUNK_SIZE = 64 * 1024
+
+# Size of the buffer of the incremental parser. Small buffers make huge strings slow to parse
+PARSE_BUFFER_SIZE = 1024 * 1024
+
+# Fields of a job, and of its report, kept when the report is too large to be loaded
+JOB_FIELDS = ("id", "status", "errorMessage", "analyzerId", "analyzerName", "createdAt",
+              "startDate", "endDate")
+REPORT_FIELDS = ("success", "summary", "errorMessage")
+
+_SCALAR_EVENTS = ("null", "boolean", "integer", "double", "number", "string")
+
+
+def is_available() -> bool:
+    """
+    Returns True if large reports can be parsed incrementally, I.E ijson is installed
+    """
+    return ijson is not None
+
+
+def parse_fields(fields):
+    """
+    Returns the JSON paths of the report kept for large reports
+
+    :param fields: Comma separated JSON paths, relative to the report - I.E full.verdict
+    :return: List of paths
+    """
+    if isinstance(fields, str):
+        fields = fields.split(",")
+
+    return [field.strip().strip(".") for field in fields or [] if field.strip().strip(".")]
+
+
+def _set_path(target, path, value):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+
+    target[keys[-1]] = value
+
+
+def extract_fields(file, prefixes):
+    """
+    Extracts the values at a set of JSON paths from a file, in a single pass, without loading
+    the rest of the document
+
+    :param file: Binary file holding a JSON document
+    :param prefixes: JSON paths, in the ijson prefix notation - I.E report.summary
+    :return: Dict of path to value, or to the list of values of a path matched several times
+    """
+    prefixes = set(prefixes)
+    values = {}
+
+    builder = None
+    current = None
+    depth = 0
+    for prefix, event, value in ijson.parse(file, buf_size=PARSE_BUFFER_SIZE, use_float=True):
+        if builder is None:
+            if prefix not in prefixes:
+                continue
+
+            if event in _SCALAR_EVENTS:
+                values.setdefault(prefix, []).append(value)
+                continue
+
+            if event not in ("start_map", "start_array"):
+                continue
+
+            builder = ijson.ObjectBuilder()
+            current = prefix
+            depth = 0
+
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+
+        if depth == 0:
+            values.setdefault(current, []).append(builder.value)
+            builder = None
+
+    return {prefix: matches[0] if len(matches) == 1 else matches
+            for prefix, matches in values.items()}
+
+
+class ReportReader(object):
+    """
+    Reads the jobs returned by Cortex with their report - I.E by waitreport or the job report
+    endpoint - without holding the raw body in memory.
+
+    The body is spooled to disk past SPOOL_MEMORY_SIZE bytes. Bodies up to threshold bytes are
+    then loaded as usual. Larger ones are parsed incrementally, and only the job fields, the
+    summary and taxonomies of the report and the configured JSON paths of the report are kept,
+    so the memory used per job stays bounded whatever the size of the analyzer output.
+    """
+
+    def __init__(self, threshold, fields=None, logger=None):
+        """
+        :param threshold: Size in bytes above which the reports are not loaded in full
+        :param fields: JSON paths of the report kept for large reports - I.E full.verdict
+        :param logger: Logger
+        """
+        self.threshold = threshold
+        self.fields = parse_fields(fields)
+        self.log = logger
+
+    def read(self, chunks) -> dict:
+        """
+        Reads a job from the chunks of a response body
+
+        :param chunks: Iterable of bytes
+        :return: Job, with its report reduced if the body is larger than the threshold
+        """
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE) as spool:
+            size = 0
+            for chunk in chunks:
+                spool.write(chunk)
+                size += len(chunk)
+
+            spool.seek(0)
+            return self.parse(spool, size)
+
+    async def read_async(self, chunks) -> dict:
+        """
+        Reads a job from the chunks of a response body
+
+        :param chunks: Async iterable of bytes
+        :return: Job, with its report reduced if the body is larger than the threshold
+        """
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE) as spool:
+            size = 0
+            async for chunk in chunks:
+                spool.write(chunk)
+                size += len(chunk)
+
+            spool.seek(0)
+            return self.parse(spool, size)
+
+    def parse(self, file, size) -> dict:
+        """
+        Parses a job from a file holding its JSON
+
+        :param file: Binary file
+        :param size: Size of the JSON in bytes
+        :return: Job, with its report reduced if the JSON is larger than the threshold
+        """
+        if self.threshold <= 0 or size <= self.threshold:
+            return json.load(file)
+
+        if not is_available():
+            if self.log is not None:
+                self.log.warning(f'Report of {size} bytes loaded in full. Install ijson to parse '
+                                 'large reports incrementally')
+            return json.load(file)
+
+        prefixes = list(JOB_FIELDS) + [f'report.{field}'
+                                       for field in REPORT_FIELDS + tuple(self.fields)]
+        values = extract_fields(file, prefixes)
+
+        r_json = {}
+        for prefix, value in values.items():
+            _set_path(r_json, prefix, value)
+
+        if "report" in r_json or r_json.get("status") == "Success":
+            # The full part of the report only holds the selected fields, and why
+            full = r_json.setdefault("report", {}).setdefault("full", {})
+            full["truncated"] = (f'Report of {size} bytes exceeds the {self.threshold} bytes '
+                                 'threshold. Only its summary'
+                                 f'{" and selected fields" if self.fields else ""} were kept')
+
+        if self.log is not None:
+            self.log.info(f'Parsed a report of {size} bytes incrementally')
+
+        return r_json
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import hashlib
+import threading
+
+from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader
+
+# Template sources registered so far, keyed by the SHA256 of their content
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def _load_source(name):
+    source = _sources.get(name)
+    if source is None:
+        return None
+
+    # A name is the hash of its content, so a loaded template is always up to date
+    return source, None, lambda: True
+
+
+# Environment shared by the whole worker. Compiled templates are kept in its cache, and their
+# bytecode in a temporary directory, so that other workers of the host do not compile them again
+_environment = Environment(loader=FunctionLoader(_load_source),
+                           bytecode_cache=FileSystemBytecodeCache(),
+                           cache_size=100)
+
+
+def get_template(source):
+    """
+    Returns the compiled template of a template source. A source is only compiled the first
+    time it is requested, the next requests return the compiled template from the cache.
+
+    :param source: Jinja2 template source
+    :return: jinja2.Template
+    """
+    name = hashlib.sha256(source.encode()).hexdigest()
+    with _sources_lock:
+        _sources.setdefault(name, source)
+
+    return _environment.get_template(name)
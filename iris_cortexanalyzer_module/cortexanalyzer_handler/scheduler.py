@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Priority classes of the Cortex jobs. Lower values are scheduled first
+PRIORITY_MANUAL = 0
+PRIORITY_UPDATE = 1
+PRIORITY_BULK = 2
+
+# Priority class of the jobs of each hook. The other callers, I.E the pipeline, are bulk
+HOOK_PRIORITIES = {
+    "on_manual_trigger_ioc": PRIORITY_MANUAL,
+    "on_postload_ioc_update": PRIORITY_UPDATE,
+    "on_postload_ioc_create": PRIORITY_BULK,
+}
+
+
+def hook_priority(hook_name) -> int:
+    """
+    Returns the priority class of the jobs of a hook
+
+    :param hook_name: Name of the hook
+    :return: Priority class
+    """
+    return HOOK_PRIORITIES.get(hook_name, PRIORITY_BULK)
+
+
+class Ticket(object):
+    """
+    Place of a caller waiting for a resource. notify is called once the resource is granted to it
+    """
+    __slots__ = ("notify", "granted")
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+
+
+class TicketQueue(object):
+    """
+    Tickets waiting for a resource. The most urgent priority class is served first, and within
+    a class, the cases with waiting tickets are served round robin. Not thread safe, the owner
+    of the queue holds its own lock.
+    """
+
+    def __init__(self):
+        # Waiting tickets, per priority class, then per case in round robin order
+        self._queues = {}
+
+    def __len__(self):
+        return sum(len(tickets) for cases in self._queues.values() for tickets in cases.values())
+
+    def push(self, ticket, priority=PRIORITY_BULK, case=None):
+        """
+        Queues a ticket
+        """
+        self._queues.setdefault(priority, OrderedDict()).setdefault(case, deque()).append(ticket)
+
+    def pop(self):
+        """
+        Removes and returns the next ticket to serve, None if no ticket is waiting
+        """
+        for priority in sorted(self._queues):
+            cases = self._queues[priority]
+            if not cases:
+                continue
+
+            # The case served goes to the back of the round robin
+            case, tickets = cases.popitem(last=False)
+            ticket = tickets.popleft()
+            if tickets:
+                cases[case] = tickets
+            return ticket
+
+        return None
+
+    def remove(self, ticket, priority=PRIORITY_BULK, case=None) -> bool:
+        """
+        Removes a waiting ticket
+
+        :return: False if the ticket was not waiting
+        """
+        tickets = self._queues.get(priority, {}).get(case)
+        if tickets is None or ticket not in tickets:
+            return False
+
+        tickets.remove(ticket)
+        if not tickets:
+            del self._queues[priority][case]
+        return True
+
+
+class JobScheduler(object):
+    """
+    Shares the Cortex job slots of a worker process between all the hooks it handles.
+
+    A job takes a slot before it is submitted and gives it back once its report is fetched.
+    Free slots go to the waiting jobs of the most urgent priority class first, so a manual
+    trigger does not wait behind a bulk import. Within a class, the slots go round robin
+    to the cases with waiting jobs, so one large case does not starve the others.
+    """
+
+    def __init__(self, slots):
+        self.slots = max(1, slots)
+        self._in_use = 0
+        self._waiting = TicketQueue()
+        self._lock = threading.Lock()
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def waiting(self) -> int:
+        """
+        Returns the number of jobs waiting for a slot
+        """
+        with self._lock:
+            return len(self._waiting)
+
+    def resize(self, slots):
+        """
+        Changes the number of slots, I.E after the module configuration changed
+
+        :param slots: Number of jobs in flight at once
+        :return: Nothing
+        """
+        with self._lock:
+            self.slots = max(1, slots)
+            notifications = self._grant()
+
+        for notify in notifications:
+            notify()
+
+    def acquire(self, priority=PRIORITY_BULK, case=None):
+        """
+        Blocks until a slot is granted to the caller
+
+        :param priority: Priority class of the job
+        :param case: Key of the case of the job, used to share the slots fairly within the class
+        :return: Nothing
+        """
+        granted = threading.Event()
+        self._wait(Ticket(granted.set), priority, case)
+        granted.wait()
+
+    async def acquire_async(self, priority=PRIORITY_BULK, case=None):
+        """
+        Waits on the running event loop until a slot is granted to the caller
+
+        :param priority: Priority class of the job
+        :param case: Key of the case of the job, used to share the slots fairly within the class
+        :return: Nothing
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        ticket = Ticket(lambda: loop.call_soon_threadsafe(
+            lambda: granted.done() or granted.set_result(True)))
+        self._wait(ticket, priority, case)
+
+        try:
+            await granted
+
+        except asyncio.CancelledError:
+            self._cancel(ticket, priority, case)
+            raise
+
+    def release(self):
+        """
+        Gives a slot back and grants it to the next waiting job
+
+        :return: Nothing
+        """
+        with self._lock:
+            self._in_use -= 1
+            notifications = self._grant()
+
+        for notify in notifications:
+            notify()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_BULK, case=None):
+        """
+        Holds a slot for the duration of the block
+        """
+        self.acquire(priority, case)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _wait(self, ticket, priority, case):
+        with self._lock:
+            self._waiting.push(ticket, priority, case)
+            notifications = self._grant()
+
+        for notify in notifications:
+            notify()
+
+    def _cancel(self, ticket, priority, case):
+        with self._lock:
+            if not ticket.granted:
+                self._waiting.remove(ticket, priority, case)
+                return
+
+        # The slot was granted while the waiter was being cancelled
+        self.release()
+
+    def _grant(self):
+        """
+        Grants the free slots to the waiting tickets. Must be called with the lock held.
+
+        :return: List of the callbacks notifying the granted tickets
+        """
+        notifications = []
+        while self._in_use < self.slots:
+            ticket = self._waiting.pop()
+            if ticket is None:
+                break
+
+            ticket.granted = True
+            self._in_use += 1
+            notifications.append(ticket.notify)
+
+        return notifications
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_job_scheduler(slots) -> JobScheduler:
+    """
+    Returns the scheduler of the worker process, creating it on first use
+
+    :param slots: Number of jobs in flight at once for the whole worker
+    :return: JobScheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler(slots)
+        elif _scheduler.slots != max(1, slots):
+            _scheduler.resize(slots)
+
+        return _scheduler
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Stages of the enrichment of an IOC, in order
+STAGE_CLIENT = "client"
+STAGE_RESOLVE = "resolve"
+STAGE_SUBMIT = "submit"
+STAGE_AWAIT = "await"
+# Part of the await stage the job spent queued in Cortex before an analyzer worker started it
+STAGE_CORTEX_QUEUE = "cortex_queue"
+STAGE_FETCH = "fetch"
+STAGE_RENDER = "render"
+STAGE_PERSIST = "persist"
+
+STAGES = (STAGE_CLIENT, STAGE_RESOLVE, STAGE_SUBMIT, STAGE_AWAIT, STAGE_CORTEX_QUEUE, STAGE_FETCH,
+          STAGE_RENDER, STAGE_PERSIST)
+
+
+class StageTimings(object):
+    """
+    Time spent in each stage of the enrichment, and counters of events such as cache hits,
+    accumulated across the threads of a handler. Everything is also added to the metrics
+    registry of the process, if one is given.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._counters = {}
+
+    @contextmanager
+    def measure(self, stage):
+        """
+        Context manager adding the time spent in its block to a stage
+
+        :param stage: Name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, elapsed):
+        """
+        Adds a run of a stage
+
+        :param stage: Name of the stage
+        :param elapsed: Time spent in the stage, in seconds
+        :return: Nothing
+        """
+        with self._lock:
+            count, total, longest = self._stats.get(stage, (0, 0.0, 0.0))
+            self._stats[stage] = (count + 1, total + elapsed, max(longest, elapsed))
+
+        if self.registry is not None:
+            self.registry.observe(stage, elapsed)
+
+    def count(self, counter, value=1):
+        """
+        Increments a counter
+
+        :param counter: Name of the counter - I.E report_cache_hits, retries, timeouts
+        :param value: Increment
+        :return: Nothing
+        """
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + value
+
+        if self.registry is not None:
+            self.registry.inc(counter, value)
+
+    def snapshot(self):
+        """
+        Returns the timings of the stages run so far
+
+        :return: Dict of stage name to (count, total seconds, longest seconds)
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def counters(self):
+        """
+        Returns the counters incremented so far
+
+        :return: Dict of counter name to value
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def summary(self):
+        """
+        Returns a one-line summary of the timings and counters, for the logs
+
+        :return: String
+        """
+        stats = self.snapshot()
+        stages = [stage for stage in STAGES if stage in stats] + sorted(set(stats) - set(STAGES))
+
+        parts = [f'{stage} {stats[stage][0]}x '
+                 f'avg {stats[stage][1] / stats[stage][0] * 1000:.1f}ms '
+                 f'max {stats[stage][2] * 1000:.1f}ms' for stage in stages]
+        parts += [f'{counter} {value}' for counter, value in sorted(self.counters().items())]
+
+        return ", ".join(parts) or "no stage run"
+
+    def as_dict(self):
+        """
+        Returns the timings and counters as a structured summary
+
+        :return: Dict with the stages, in milliseconds, and the counters
+        """
+        return {
+            "stages": {stage: {"count": count, "total_ms": round(total * 1000, 1),
+                               "max_ms": round(longest * 1000, 1)}
+                       for stage, (count, total, longest) in self.snapshot().items()},
+            "counters": self.counters(),
+        }
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import logging
+
+import pytest
+
+import iris_cortexanalyzer_module.IrisCortexanalyzerConfig as interface_conf
+from tests.iris_stubs import install_iris_stubs
+
+# The interface imports the IRIS application, which the stubs stand for
+_writer = install_iris_stubs(interface_conf.module_configuration)
+
+
+@pytest.fixture
+def attribute_writer():
+    """
+    Returns the stand-in of the IRIS attribute writer and database session, with its records reset
+    """
+    _writer.reset()
+    return _writer
+
+
+@pytest.fixture
+def make_handler():
+    """
+    Returns a factory of handlers for a module configuration, with the Cortex URL and key set
+    """
+    from iris_cortexanalyzer_module.cortexanalyzer_handler.cortexanalyzer_handler import (
+        CortexanalyzerHandler,
+    )
+
+    def make(stages=None, **mod_config):
+        mod_config.setdefault("cortexanalyze_url", "http://cortex")
+        mod_config.setdefault("cortexanalyze_key", "key")
+        return CortexanalyzerHandler(mod_config, {}, logging.getLogger(__name__), stages=stages)
+
+    return make
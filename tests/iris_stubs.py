@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import contextlib
+import sys
+import threading
+import time
+import types
+
+
+class AttributeWriter(object):
+    """
+    Stand-in for the IRIS attribute writer and database session. Stores the attributes on the
+    IOC objects like IRIS does, and records the commits and when the report of each IOC was
+    committed.
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.commits = 0
+        self.report_times = {}
+        self._modified = {}
+        self._lock = threading.Lock()
+
+    def add_tab_attribute_field(self, obj, tab_name, field_name, field_type, field_value):
+        attributes = dict(obj.custom_attributes or {})
+        attributes.setdefault(tab_name, {})[field_name] = {"type": field_type,
+                                                           "value": field_value}
+        obj.custom_attributes = attributes
+        self.flag_modified(obj, "custom_attributes")
+        self.commit()
+
+    def flag_modified(self, obj, key):
+        with self._lock:
+            self.writes += 1
+            self._modified[id(obj)] = obj
+
+    def commit(self):
+        now = time.perf_counter()
+        with self._lock:
+            self.commits += 1
+            for obj in self._modified.values():
+                tab = (obj.custom_attributes or {}).get("CORTEX Report") or {}
+                report = tab.get("HTML report")
+                if report and not str(report["value"]).startswith("<p>Cortex analysis pending"):
+                    self.report_times[obj.ioc_id] = now
+            self._modified = {}
+
+    def rollback(self):
+        with self._lock:
+            self._modified = {}
+
+    def reset(self):
+        with self._lock:
+            self.writes = 0
+            self.commits = 0
+            self.report_times = {}
+
+
+class IocType(object):
+    def __init__(self, type_name):
+        self.type_name = type_name
+
+
+class Ioc(object):
+    """
+    Minimal IOC model, with the attributes read by the module
+    """
+    registry = {}
+
+    def __init__(self, ioc_id, ioc_value, type_name):
+        self.ioc_id = ioc_id
+        self.ioc_value = ioc_value
+        self.ioc_type = IocType(type_name)
+        self.custom_attributes = {}
+        Ioc.registry[ioc_id] = self
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install_iris_stubs(module_configuration) -> AttributeWriter:
+    """
+    Installs stand-ins for the IRIS application modules imported by iris_interface and the module,
+    so that the module runs outside of IRIS. The module configuration is served as if set in the
+    GUI.
+
+    :param module_configuration: List of configuration parameters, with their value
+    :return: AttributeWriter recording the attributes written
+    """
+    writer = AttributeWriter()
+
+    class _Status(object):
+        def __init__(self, data):
+            self._data = data
+
+        def get_data(self):
+            return self._data
+
+    class _App(object):
+        @contextlib.contextmanager
+        def app_context(self):
+            yield
+
+    session = types.SimpleNamespace(commit=writer.commit, rollback=writer.rollback,
+                                    remove=lambda: None)
+
+    _module("app", app=_App(), db=types.SimpleNamespace(session=session))
+    _module("app.models", Ioc=Ioc)
+    _module("app.datamgmt")
+    _module("app.datamgmt.manage")
+    _module("app.datamgmt.manage.manage_attribute_db",
+            add_tab_attribute_field=writer.add_tab_attribute_field)
+    _module("app.datamgmt.manage.manage_srv_settings_db", get_server_settings_as_dict=lambda: {})
+    _module("app.datamgmt.iris_engine")
+    _module("app.datamgmt.iris_engine.evidence_storage", EvidenceStorage=object)
+    _module("app.iris_engine")
+    _module("app.iris_engine.module_handler")
+    _module("app.iris_engine.module_handler.module_handler",
+            get_mod_config_by_name=lambda name: _Status(module_configuration),
+            register_hook=lambda *args, **kwargs: (True, []),
+            deregister_from_hook=lambda *args, **kwargs: (True, []))
+
+    try:
+        import celery  # noqa: F401
+    except ImportError:
+        _module("celery", Task=type("Task", (object,), {"request_stack": None}))
+
+    # The session is stubbed, so the modified attributes are tracked by the writer
+    try:
+        import sqlalchemy.orm.attributes as attributes
+        attributes.flag_modified = writer.flag_modified
+    except ImportError:
+        _module("sqlalchemy")
+        _module("sqlalchemy.orm")
+        _module("sqlalchemy.orm.attributes", flag_modified=writer.flag_modified)
+
+    # The deferred completer looks IOCs up by ID
+    Ioc.query = types.SimpleNamespace(filter=lambda ioc_id: types.SimpleNamespace(
+        first=lambda: Ioc.registry.get(ioc_id)))
+    Ioc.ioc_id = _IocIdColumn()
+
+    return writer
+
+
+class _IocIdColumn(object):
+    """
+    Class attribute standing for the ioc_id column, so that Ioc.ioc_id == 1 evaluates to 1
+    """
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.__dict__["ioc_id"]
+
+    def __set__(self, instance, value):
+        instance.__dict__["ioc_id"] = value
+
+    def __eq__(self, other):
+        return other
+
+    def __hash__(self):
+        return id(self)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import types
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler import analyzer_cache
+from iris_cortexanalyzer_module.cortexanalyzer_handler.analyzer_cache import find_analyzer_id
+
+
+class _Analyzers(object):
+    """
+    Stands for the analyzers endpoint of cortex4py, counting the catalogue fetches
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.fetches = 0
+
+    def find_all(self, query, range=None):
+        self.fetches += 1
+        return [types.SimpleNamespace(name=name, id=f'id-{name}') for name in self.names]
+
+
+def make_api(*names):
+    return types.SimpleNamespace(analyzers=_Analyzers(list(names)))
+
+
+def test_missing_analyzer_does_not_refresh_a_recent_catalogue():
+    api = make_api("Enabled_1_0")
+
+    for _ in range(5):
+        assert find_analyzer_id(api, "http://cortex-miss", "key", "Missing_1_0") is None
+
+    assert api.analyzers.fetches == 1
+    assert find_analyzer_id(api, "http://cortex-miss", "key", "Enabled_1_0") == "id-Enabled_1_0"
+
+
+def test_missing_analyzer_refreshes_the_catalogue_once_the_interval_passed(monkeypatch):
+    api = make_api("Enabled_1_0")
+    assert find_analyzer_id(api, "http://cortex-enabled", "key", "Missing_1_0") is None
+
+    api.analyzers.names.append("Missing_1_0")
+    monkeypatch.setattr(analyzer_cache, "MISS_REFRESH_INTERVAL", 0)
+
+    assert find_analyzer_id(api, "http://cortex-enabled", "key", "Missing_1_0") == "id-Missing_1_0"
+    assert api.analyzers.fetches == 2
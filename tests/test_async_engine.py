@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import asyncio
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler import async_engine
+from iris_cortexanalyzer_module.cortexanalyzer_handler.async_engine import AsyncCortexRunner
+from iris_cortexanalyzer_module.cortexanalyzer_handler.async_engine import get_async_session
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_RESOLVE
+
+pytestmark = pytest.mark.skipif(not async_engine.is_available(), reason="aiohttp is not installed")
+
+
+class _CortexHandler(BaseHTTPRequestHandler):
+    """
+    Answers the job submissions, job searches, waitreport and report requests like Cortex, with
+    a report holding the submitted value. The first jobs of the values in server.rate_limited
+    fail for lack of quota.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.record(self)
+        if self.path.startswith("/api/job/_search"):
+            self._answer([self.server.job(job_id) for job_id in self.server.values])
+            return
+
+        self._answer({"id": self.server.submit(body["data"]), "status": "Waiting"})
+
+    def do_GET(self):
+        self.server.record(self)
+        if self.path.split("?")[0].endswith("/waitreport") and self.server.waitreport_status:
+            self._answer({"type": "NotFound"}, status=self.server.waitreport_status)
+            return
+
+        self._answer(self.server.job(self.path.split("/")[3]))
+
+    def _answer(self, body, status=200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Cortex(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _CortexHandler)
+        self.requests = []
+        self.client_ports = set()
+        self.values = {}
+        self.rate_limited = set()
+        self.waitreport_status = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def record(self, handler):
+        self.requests.append((handler.command, handler.path.split("?")[0]))
+        self.client_ports.add(handler.client_address[1])
+
+    def submit(self, value):
+        job_id = f'job-{value}' if f'job-{value}' not in self.values \
+            else f'job-{value}-{len(self.requests)}'
+        self.values[job_id] = value
+        return job_id
+
+    def job(self, job_id):
+        value = self.values.get(job_id, job_id[len("job-"):])
+        if value in self.rate_limited:
+            self.rate_limited.discard(value)
+            return {"id": job_id, "status": "Failure", "errorMessage": "Rate limit exceeded"}
+
+        return {"id": job_id, "status": "Success", "report": {"full": {"value": value}}}
+
+
+@pytest.fixture
+def cortex():
+    server = _Cortex()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_runner(cortex, **kwargs):
+    return AsyncCortexRunner(cortex.url, "key", logging.getLogger(__name__), **kwargs)
+
+
+def test_jobs_are_submitted_and_their_reports_returned_in_order(cortex):
+    statuses = make_runner(cortex, max_in_flight=4).run([
+        ("analyzer-1", "a.com", "domain", None),
+        ("analyzer-1", "b.com", "domain", None),
+    ])
+
+    assert [status.get_data() for status in statuses] == [{"full": {"value": "a.com"}},
+                                                          {"full": {"value": "b.com"}}]
+    assert cortex.requests.count(("POST", "/api/analyzer/analyzer-1/run")) == 2
+
+
+def test_jobs_in_flight_are_only_waited_for(cortex):
+    submitted = []
+
+    statuses = make_runner(cortex).run([("analyzer-1", "a.com", "domain", "job-a.com")],
+                                       on_submitted=lambda *args: submitted.append(args))
+
+    assert statuses[0].get_data() == {"full": {"value": "a.com"}}
+    assert cortex.requests == [("GET", "/api/job/job-a.com/waitreport")]
+    assert submitted == []
+
+
+def test_connections_are_reused_across_runs(cortex):
+    session = get_async_session(cortex.url, "key")
+
+    for value in ("a.com", "b.com", "c.com"):
+        make_runner(cortex, max_in_flight=1).run([("analyzer-1", value, "domain", None)])
+
+    assert get_async_session(cortex.url, "key") is session
+    assert len(cortex.client_ports) == 1
+
+
+def test_runs_from_inside_an_event_loop(cortex):
+    async def hook():
+        return make_runner(cortex).run([("analyzer-1", "a.com", "domain", None)])
+
+    statuses = asyncio.run(hook())
+
+    assert statuses[0].is_success()
+
+
+@pytest.mark.parametrize("status", [404, 405])
+def test_waitreport_is_turned_off_when_cortex_does_not_have_it(cortex, status):
+    cortex.waitreport_status = status
+    runner = make_runner(cortex)
+
+    statuses = runner.run([("analyzer-1", "a.com", "domain", None)])
+
+    assert statuses[0].get_data() == {"full": {"value": "a.com"}}
+    assert ("POST", "/api/job/_search") in cortex.requests
+    assert runner.use_waitreport is False
+
+
+def test_jobs_are_polled_when_waitreport_fails(cortex):
+    cortex.waitreport_status = 500
+    runner = make_runner(cortex)
+
+    statuses = runner.run([("analyzer-1", "a.com", "domain", None)])
+
+    assert statuses[0].get_data() == {"full": {"value": "a.com"}}
+    assert runner.use_waitreport is True
+
+
+def test_rate_limited_jobs_are_discarded_and_submitted_again(cortex, monkeypatch):
+    monkeypatch.setattr(async_engine, "retry_delay", lambda attempt: 0)
+    cortex.rate_limited.add("a.com")
+    submitted, discarded = [], []
+
+    statuses = make_runner(cortex, retries=1).run(
+        [("analyzer-1", "a.com", "domain", None)],
+        on_submitted=lambda *args: submitted.append(args),
+        on_discarded=lambda *args: discarded.append(args))
+
+    assert statuses[0].get_data() == {"full": {"value": "a.com"}}
+    assert discarded == [(0, "job-a.com")]
+    assert len(submitted) == 2 and submitted[1] != (0, "job-a.com")
+
+
+def test_jobs_reused_from_the_journal_are_journaled_for_the_ioc(cortex, make_handler, tmp_path):
+    handler = make_handler(stages={STAGE_RESOLVE: lambda analyzer, refresh=False: "analyzer-1"},
+                           cortexanalyze_url=cortex.url, cortexanalyze_analyzer="Analyzer_1_0",
+                           cortexanalyzer_execution_engine="asyncio",
+                           cortexanalyzer_job_journal_path=str(tmp_path / "jobs.db"))
+    journal = handler.get_job_journal()
+    journal.record("job-a.com", 1, "a.com", "domain", "Analyzer_1_0", 300)
+
+    results = dict(handler.analyze_iocs([("ioc-2", "a.com", "domain", 2)]))
+
+    assert results["ioc-2"].get_data() == {"Analyzer_1_0": {"full": {"value": "a.com"}}}
+    assert ("POST", "/api/analyzer/analyzer-1/run") not in cortex.requests
+    assert journal._db.execute("SELECT ioc_id FROM cortex_jobs ORDER BY ioc_id").fetchall() \
+        == [(1,), (2,)]
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import logging
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.attribute_batch import AttributeBatch
+from tests.iris_stubs import Ioc
+
+
+def test_fields_are_set_right_away_and_committed_per_flush_size(attribute_writer):
+    batch = AttributeBatch(flush_size=2)
+    first, second = Ioc(201, "a.com", "domain"), Ioc(202, "b.com", "domain")
+
+    assert batch.add(first, "CORTEX Report", [("HTML report", "html", "a")]).is_success()
+    assert first.custom_attributes["CORTEX Report"]["HTML report"]["value"] == "a"
+    assert attribute_writer.commits == 0
+    assert len(batch) == 1
+
+    batch.add(second, "CORTEX Report", [("HTML report", "html", "b")])
+
+    assert attribute_writer.commits == 1
+    assert len(batch) == 0
+
+
+def test_fields_of_other_tabs_are_kept(attribute_writer):
+    batch = AttributeBatch(flush_size=1)
+    ioc = Ioc(203, "a.com", "domain")
+    ioc.custom_attributes = {"Other": {"field": {"value": 1}},
+                             "CORTEX Report": {"Score": {"value": 2}}}
+
+    batch.add(ioc, "CORTEX Report", [("HTML report", "html", "a")])
+
+    assert ioc.custom_attributes["Other"] == {"field": {"value": 1}}
+    assert set(ioc.custom_attributes["CORTEX Report"]) == {"Score", "HTML report"}
+
+
+def test_an_ioc_written_twice_is_pending_once(attribute_writer):
+    batch = AttributeBatch(flush_size=2)
+    ioc = Ioc(204, "a.com", "domain")
+
+    batch.add(ioc, "CORTEX Report", [("Summary", "html", "a")])
+    batch.add(ioc, "CORTEX Report", [("HTML report", "html", "a")])
+
+    assert len(batch) == 1
+    assert attribute_writer.commits == 0
+    assert batch.flush().is_success()
+    assert attribute_writer.commits == 1
+    assert batch.flush().is_success()
+    assert attribute_writer.commits == 1
+
+
+def test_failed_commits_are_rolled_back(attribute_writer, monkeypatch, caplog):
+    import app
+
+    def commit():
+        raise RuntimeError("database is locked")
+
+    rollbacks = []
+    monkeypatch.setattr(app.db.session, "commit", commit)
+    monkeypatch.setattr(app.db.session, "rollback", lambda: rollbacks.append(True))
+    batch = AttributeBatch(flush_size=1, logger=logging.getLogger(__name__))
+
+    ioc = Ioc(205, "a.com", "domain")
+
+    status = batch.add(ioc, "CORTEX Report", [("HTML report", "html", "a")])
+
+    assert not status.is_success()
+    assert status.get_message() == "Unable to persist the attributes of 1 IOCs"
+    assert rollbacks == [True]
+    assert len(batch) == 0
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler import circuit_breaker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import STATE_CLOSED
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import STATE_HALF_OPEN
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import STATE_OPEN
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitBreaker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitOpenError
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+def fail(breaker, times=1):
+    for _ in range(times):
+        with pytest.raises(ConnectionError):
+            with breaker.guard(lambda e: True):
+                raise ConnectionError("Cortex is down")
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("http://cortex", failure_threshold=3, reset_timeout=30)
+
+    fail(breaker, 2)
+    assert breaker.state == STATE_CLOSED
+
+    fail(breaker)
+    assert breaker.state == STATE_OPEN
+    assert not breaker.is_available()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("http://cortex", failure_threshold=2)
+
+    fail(breaker)
+    with breaker.guard(lambda e: True):
+        pass
+    fail(breaker)
+
+    assert breaker.state == STATE_CLOSED
+
+
+def test_errors_answered_by_cortex_are_not_failures(clock):
+    breaker = CircuitBreaker("http://cortex", failure_threshold=1)
+
+    with pytest.raises(ValueError):
+        with breaker.guard(lambda e: False):
+            raise ValueError("Unknown analyzer")
+
+    assert breaker.state == STATE_CLOSED
+
+
+def test_single_probe_closes_the_circuit_once_the_reset_timeout_passed(clock):
+    breaker = CircuitBreaker("http://cortex", failure_threshold=1, reset_timeout=30)
+    fail(breaker)
+
+    clock.now += 29
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == STATE_HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+
+    breaker.record(True)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_opens_the_circuit_again(clock):
+    breaker = CircuitBreaker("http://cortex", failure_threshold=1, reset_timeout=30)
+    fail(breaker)
+    clock.now += 30
+
+    fail(breaker)
+
+    assert breaker.state == STATE_OPEN
+    assert breaker.retry_after() == 30
+
+
+def test_cancelled_probe_lets_another_probe_through(clock):
+    breaker = CircuitBreaker("http://cortex", failure_threshold=1, reset_timeout=30)
+    fail(breaker)
+    clock.now += 30
+
+    with pytest.raises(KeyboardInterrupt):
+        with breaker.guard(lambda e: True):
+            raise KeyboardInterrupt()
+
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow()
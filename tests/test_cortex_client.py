@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import logging
+
+import pytest
+import requests
+from cortex4py.exceptions import CortexException
+from cortex4py.exceptions import NotFoundError
+from cortex4py.exceptions import ServiceUnavailableError
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import STATE_CLOSED
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import STATE_OPEN
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitBreaker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitOpenError
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortex_client import CONNECT_TIMEOUT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortex_client import CortexClient
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortex_client import get_cortex_client
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortex_client import held_for
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_waiter import JobWaiter
+
+
+class _Response(object):
+    def __init__(self, body, status_code=200):
+        self._body = body
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error', response=self)
+
+    def json(self):
+        return self._body
+
+
+class _Session(object):
+    """
+    Stands for the requests session of the client, recording the requests sent
+    """
+
+    def __init__(self, body, status_code=200, error=None):
+        self.body = body
+        self.status_code = status_code
+        self.error = error
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        if self.error is not None:
+            raise self.error
+        return _Response(self.body, self.status_code)
+
+
+def make_client(body, timeout=2, **kwargs):
+    client = CortexClient("http://cortex", "key")
+    client.session = _Session(body, **kwargs)
+    client.timeout = timeout
+    return client
+
+
+def test_held_for_reads_at_most_from_params_and_query_string():
+    assert held_for("job/1/waitreport", {"atMost": "30seconds"}) == 30
+    assert held_for("job/1/waitreport?atMost=12seconds", {}) == 12
+    assert held_for("job/1/waitreport?atMost=Inf", None) == 0
+    assert held_for("job/1/report", {"atMost": "30seconds"}) == 0
+    assert held_for("job/_search", {}) == 0
+
+
+def test_waitreport_requests_get_their_hold_time_on_top_of_the_timeout():
+    client = make_client({"id": "job-1", "status": "Success", "report": {}})
+
+    status = JobWaiter(client, logging.getLogger(__name__), timeout=300).wait("job-1")
+
+    assert status.is_success()
+    method, url, kwargs = client.session.requests[0]
+    assert url == "http://cortex/api/job/job-1/waitreport"
+    assert kwargs["params"] == {"atMost": f'{JobWaiter.waitreport_slice}seconds'}
+    assert kwargs["timeout"] == (CONNECT_TIMEOUT, 2 + JobWaiter.waitreport_slice)
+
+
+def test_cortex4py_waitreport_endpoint_gets_its_hold_time():
+    client = make_client({"id": "job-1", "status": "Success"})
+
+    client.jobs.get_report_async("job-1", timeout="30seconds")
+
+    assert client.session.requests[0][2]["timeout"] == (CONNECT_TIMEOUT, 32)
+
+
+def test_other_requests_get_the_request_timeout():
+    client = make_client([])
+
+    client.jobs.find_all({}, range="0-1")
+
+    assert client.session.requests[0][2]["timeout"] == (CONNECT_TIMEOUT, 2)
+
+
+def test_timed_out_requests_open_the_circuit_and_the_next_ones_fail_fast():
+    client = make_client({}, error=requests.ReadTimeout("Read timed out"))
+    client.breaker = CircuitBreaker("http://cortex", failure_threshold=2, reset_timeout=30)
+
+    for _ in range(2):
+        with pytest.raises(CortexException):
+            client.jobs.get_by_id("job-1")
+
+    assert client.breaker.state == STATE_OPEN
+    with pytest.raises(CircuitOpenError):
+        client.jobs.get_by_id("job-1")
+    assert len(client.session.requests) == 2
+
+
+@pytest.mark.parametrize("status_code", [404, 429, 503])
+def test_errors_answered_by_cortex_leave_the_circuit_closed(status_code):
+    client = make_client({}, status_code=status_code)
+    client.breaker = CircuitBreaker("http://cortex", failure_threshold=1)
+
+    with pytest.raises(CortexException):
+        client.jobs.get_by_id("job-1")
+
+    assert client.breaker.state == STATE_CLOSED
+
+
+def test_server_errors_open_the_circuit():
+    client = make_client({}, status_code=500)
+    client.breaker = CircuitBreaker("http://cortex", failure_threshold=1)
+
+    with pytest.raises(CortexException):
+        client.jobs.get_by_id("job-1")
+
+    assert client.breaker.state == STATE_OPEN
+
+
+def test_clients_with_other_timeouts_are_not_shared():
+    breaker = CircuitBreaker("http://cortex-shared")
+    short = get_cortex_client("http://cortex-shared", "key", timeout=2, breaker=breaker)
+    long = get_cortex_client("http://cortex-shared", "key", timeout=60, breaker=breaker)
+
+    assert short is not long
+    assert (short.timeout, long.timeout) == (2, 60)
+    assert get_cortex_client("http://cortex-shared", "key", timeout=2, breaker=breaker) is short
+    assert get_cortex_client("http://cortex-shared", "key", timeout=2).breaker is None
+
+
+def test_errors_are_raised_as_cortex4py_exceptions_with_their_cause():
+    client = make_client({}, status_code=404)
+
+    with pytest.raises(NotFoundError) as error:
+        client.jobs.get_by_id("job-1")
+    assert isinstance(error.value.__cause__, requests.HTTPError)
+
+    client = make_client({}, error=requests.ConnectionError("Connection refused"))
+    with pytest.raises(ServiceUnavailableError):
+        client.jobs.get_by_id("job-1")
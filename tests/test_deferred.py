@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import logging
+import types
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler import deferred
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortexanalyzer_handler import (
+    CortexanalyzerHandler,
+)
+from iris_cortexanalyzer_module.cortexanalyzer_handler.deferred import DeferredCompleter
+from iris_cortexanalyzer_module.cortexanalyzer_handler.deferred import render_pending_report
+from tests.iris_stubs import Ioc
+
+MOD_CONFIG = {"cortexanalyze_url": "http://cortex", "cortexanalyze_key": "key",
+              "cortexanalyze_analyzer": "Analyzer_1_0, Analyzer_2_0",
+              "cortexanalyzer_report_as_attribute": True,
+              "cortexanalyzer_domain_report_template": "{{ results | tojson }}"}
+
+
+@pytest.fixture
+def collected(monkeypatch):
+    """
+    Makes the handlers of the completer collect the reports of the given job IDs, the other
+    jobs failing, and records the jobs collected
+    """
+    collected = types.SimpleNamespace(reports={}, jobs=[])
+
+    class _Handler(CortexanalyzerHandler):
+        def collect_report(self, analyzer, job_id, ioc_value, data_type, r_json=None,
+                           ioc_id=None):
+            collected.jobs.append(job_id)
+            if job_id in collected.reports:
+                return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess,
+                                                data=collected.reports[job_id])
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                            message="Cortex Failure: quota exceeded")
+
+    monkeypatch.setattr(deferred, "CortexanalyzerHandler", _Handler)
+    return collected
+
+
+def complete(ioc_id, reports, jobs):
+    completer = DeferredCompleter(logging.getLogger(__name__), max_workers=1)
+    return completer.enqueue(ioc_id, "example.com", "domain", "Domain", reports, jobs,
+                             MOD_CONFIG, {}).result()
+
+
+def test_pending_report_lists_the_jobs():
+    html = render_pending_report({"Analyzer_1_0": "job-1", "Analyzer_2_0": "job-2"})
+
+    assert "<li>Analyzer_1_0: job job-1</li><li>Analyzer_2_0: job job-2</li>" in html
+
+
+def test_reports_of_the_completed_jobs_are_written_to_the_ioc(collected):
+    collected.reports["job-2"] = {"summary": {}, "full": {"score": 2}}
+    ioc = Ioc(101, "example.com", "domain")
+
+    status = complete(101, {"Analyzer_1_0": {"summary": {}, "full": {"score": 1}}},
+                      {"Analyzer_2_0": "job-2"})
+
+    assert status.is_success()
+    assert collected.jobs == ["job-2"]
+    assert ioc.custom_attributes["CORTEX Report"]["HTML report"]["value"] == (
+        '{"Analyzer_1_0": {"score": 1}, "Analyzer_2_0": {"score": 2}}')
+
+
+def test_failed_jobs_are_left_out_of_the_report(collected):
+    collected.reports["job-1"] = {"summary": {}, "full": {"score": 1}}
+    ioc = Ioc(102, "example.com", "domain")
+
+    status = complete(102, {}, {"Analyzer_1_0": "job-1", "Analyzer_2_0": "job-2"})
+
+    assert status.is_success()
+    assert ioc.custom_attributes["CORTEX Report"]["HTML report"]["value"] == (
+        '{"Analyzer_1_0": {"score": 1}}')
+
+
+def test_nothing_is_written_when_every_job_failed(collected):
+    ioc = Ioc(103, "example.com", "domain")
+
+    status = complete(103, {}, {"Analyzer_1_0": "job-1"})
+
+    assert not status.is_success()
+    assert ioc.custom_attributes == {}
+
+
+def test_iocs_deleted_in_the_meantime_are_skipped(collected):
+    collected.reports["job-1"] = {"summary": {}, "full": {"score": 1}}
+
+    status = complete(104, {}, {"Analyzer_1_0": "job-1"})
+
+    assert not status.is_success()
+    assert status.get_message() == "IOC 104 not found"
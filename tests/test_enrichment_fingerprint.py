@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.enrichment_fingerprint import (
+    FINGERPRINT_FIELD,
+)
+from iris_cortexanalyzer_module.cortexanalyzer_handler.enrichment_fingerprint import is_fresh
+from iris_cortexanalyzer_module.cortexanalyzer_handler.enrichment_fingerprint import (
+    make_fingerprint,
+)
+from iris_cortexanalyzer_module.cortexanalyzer_handler.enrichment_fingerprint import (
+    read_fingerprint,
+)
+from tests.iris_stubs import Ioc
+from tests.iris_stubs import IocType
+
+ANALYZERS = ["Analyzer_1_0", "Analyzer_2_0"]
+
+
+def enriched_ioc(ioc_id, analyzers=ANALYZERS, enriched_at=1000):
+    ioc = Ioc(ioc_id, "example.com", "domain")
+    ioc.custom_attributes = {"CORTEX Report": {FINGERPRINT_FIELD: {
+        "value": make_fingerprint(ioc, analyzers, enriched_at=enriched_at)}}}
+    return ioc
+
+
+def test_fingerprints_are_read_back():
+    ioc = enriched_ioc(301, analyzers=["Analyzer_2_0", "Analyzer_1_0"])
+
+    assert read_fingerprint(ioc) == {"value": "example.com", "type": "domain",
+                                     "analyzers": ANALYZERS, "enriched_at": 1000}
+
+
+@pytest.mark.parametrize("field", [None, "not a dict", {"value": "{not json"},
+                                   {"value": "[1, 2]"}, {"value": None}])
+def test_invalid_fingerprints_are_ignored(field):
+    ioc = Ioc(302, "example.com", "domain")
+    ioc.custom_attributes = {"CORTEX Report": {FINGERPRINT_FIELD: field}}
+
+    assert read_fingerprint(ioc) is None
+    assert not is_fresh(ioc, ANALYZERS, 3600, now=1000)
+
+
+def test_enrichments_are_fresh_within_the_window():
+    ioc = enriched_ioc(303)
+
+    assert is_fresh(ioc, ANALYZERS, 3600, now=1000 + 3599)
+    assert not is_fresh(ioc, ANALYZERS, 3600, now=1000 + 3600)
+    assert not is_fresh(ioc, ANALYZERS, 3600, now=999)
+    assert not is_fresh(ioc, ANALYZERS, 0, now=1000)
+
+
+def test_enrichments_are_stale_once_the_ioc_or_the_analyzers_changed():
+    changed_value, changed_type, partial = enriched_ioc(304), enriched_ioc(305), enriched_ioc(306)
+    changed_value.ioc_value = "other.com"
+    changed_type.ioc_type = IocType("fqdn")
+
+    assert not is_fresh(changed_value, ANALYZERS, 3600, now=1000)
+    assert not is_fresh(changed_type, ANALYZERS, 3600, now=1000)
+    assert not is_fresh(partial, ANALYZERS + ["Analyzer_3_0"], 3600, now=1000)
+    assert is_fresh(partial, ANALYZERS[:1], 3600, now=1000)
+
+
+def test_handlers_only_keep_fresh_enrichments_when_configured(make_handler):
+    ioc = enriched_ioc(307, analyzers=["Analyzer_1_0"], enriched_at=None)
+
+    assert not make_handler(cortexanalyze_analyzer="Analyzer_1_0").is_enrichment_fresh(ioc)
+    assert make_handler(cortexanalyze_analyzer="Analyzer_1_0",
+                        cortexanalyzer_update_freshness=3600).is_enrichment_fresh(ioc)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortexanalyzer_handler import (
+    CortexanalyzerHandler,
+)
+
+
+def report(score):
+    return {"summary": {"taxonomies": []}, "full": {"score": score}}
+
+
+def test_single_analyzer_renders_its_report_unkeyed():
+    reports = {"Analyzer_1_0": report(1)}
+
+    assert CortexanalyzerHandler.combine_reports(reports, keyed=False) == {"score": 1}
+
+
+def test_results_stay_keyed_when_only_one_of_several_analyzers_succeeded(make_handler):
+    handler = make_handler(cortexanalyze_analyzer="Analyzer_1_0, Analyzer_2_0",
+                           cortexanalyzer_domain_report_template="{{ results | tojson }}")
+
+    status = handler.render_report({"Analyzer_2_0": report(2)}, "domain")
+
+    assert status.is_success()
+    assert status.get_data() == '{"Analyzer_2_0": {"score": 2}}'
+
+
+def test_report_label_is_the_one_of_the_ioc_route(make_handler):
+    handler = make_handler(cortexanalyzer_type_mapping='{"ja3": {"data_type": "hash", '
+                                                       '"label": "Fingerprint"}}')
+
+    assert handler.get_report_label("ip") == "IP"
+    assert handler.get_report_label("hash") == "Hash"
+    assert handler.get_report_label("other") == "Other"
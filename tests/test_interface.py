@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import logging
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+import iris_interface.IrisModuleInterface as module_interface
+import pytest
+
+from iris_cortexanalyzer_module.IrisCortexanalyzerInterface import HOOK_SETTINGS
+from iris_cortexanalyzer_module.IrisCortexanalyzerInterface import IrisCortexanalyzerInterface
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortex_client import get_cortex_client
+from iris_cortexanalyzer_module.cortexanalyzer_handler.cortexanalyzer_handler import (
+    CortexanalyzerHandler,
+)
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_AWAIT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_FETCH
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_RESOLVE
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_SUBMIT
+from tests.iris_stubs import Ioc
+
+
+@pytest.fixture
+def make_interface(monkeypatch):
+    """
+    Returns a factory of interfaces serving a module configuration, which record the handlers
+    they build and the hooks they register
+    """
+    def make(**module_conf):
+        monkeypatch.setattr(IrisCortexanalyzerInterface, "module_dict_conf",
+                            property(lambda self: module_conf))
+        interface = IrisCortexanalyzerInterface()
+        interface.log = logging.getLogger(__name__)
+        interface.handlers = []
+        interface.hooks = []
+        monkeypatch.setattr(interface, "_get_handler", interface.handlers.append)
+        monkeypatch.setattr(interface, "register_to_hook",
+                            lambda module_id, iris_hook_name, **kwargs:
+                            interface.hooks.append(iris_hook_name) or interface.register_status)
+        return interface
+
+    return make
+
+
+def enabled_hooks():
+    return {setting: True for setting in HOOK_SETTINGS}
+
+
+def test_nothing_is_validated_while_no_hook_is_enabled(make_interface):
+    interface = make_interface(cortexanalyze_url="http://cortex", cortexanalyze_key="key")
+
+    interface.register_hooks(1)
+
+    assert interface.handlers == []
+    assert interface.hooks == []
+
+
+def test_missing_url_or_key_is_reported_without_building_the_handler(make_interface, caplog):
+    interface = make_interface(cortexanalyze_url="http://cortex", **enabled_hooks())
+    interface.register_status = _success()
+
+    interface.register_hooks(1)
+
+    assert interface.handlers == []
+    assert "The Cortex URL and API key must be set" in caplog.text
+    assert len(interface.hooks) == 3
+
+
+def test_failed_validation_is_logged_and_hooks_registered(make_interface, monkeypatch, caplog):
+    interface = make_interface(cortexanalyze_url="http://cortex", cortexanalyze_key="key",
+                               **enabled_hooks())
+    interface.register_status = _success()
+
+    def fail(handler):
+        raise ValueError("Cortex exploded")
+
+    monkeypatch.setattr("iris_cortexanalyzer_module.cortexanalyzer_handler.config_validation."
+                        "validate_configuration", fail)
+
+    interface.register_hooks(1)
+
+    assert "Unable to validate the module configuration" in caplog.text
+    assert len(interface.hooks) == 3
+
+
+def test_client_without_api_key_is_refused_by_cortex4py():
+    with pytest.raises(TypeError, match="API key are required"):
+        get_cortex_client("http://cortex", None)
+
+
+def test_pipeline_module_registers_its_hooks_with_iris(monkeypatch):
+    registered = []
+    monkeypatch.setattr(module_interface, "iris_register_hook",
+                        lambda module_id, hook_name, *args: registered.append(hook_name)
+                        or (True, []))
+    monkeypatch.setattr(IrisCortexanalyzerInterface, "module_dict_conf",
+                        property(lambda self: enabled_hooks()))
+
+    interface = IrisCortexanalyzerInterface()
+    interface.register_hooks(1)
+
+    assert interface.get_module_type() == module_interface.IrisModuleTypes.module_pipeline
+    assert interface._is_ready
+    assert registered == ["on_postload_ioc_create", "on_postload_ioc_update",
+                          "on_manual_trigger_ioc"]
+
+
+@pytest.mark.parametrize("hook_name", ["on_postload_ioc_create", "on_manual_trigger_ioc"])
+def test_hooks_of_the_pipeline_module_enrich_the_iocs(monkeypatch, hook_name):
+    module_conf = {"cortexanalyze_url": "http://cortex", "cortexanalyze_key": "key",
+                   "cortexanalyze_analyzer": "Analyzer_1_0",
+                   "cortexanalyzer_report_as_attribute": True,
+                   "cortexanalyzer_domain_report_template": "{{ results | tojson }}"}
+    monkeypatch.setattr(IrisCortexanalyzerInterface, "module_dict_conf",
+                        property(lambda self: module_conf))
+    interface = IrisCortexanalyzerInterface()
+    # Cortex answers every job at once with a report
+    stages = {
+        STAGE_RESOLVE: lambda analyzer, refresh=False: "analyzer-1",
+        STAGE_SUBMIT: lambda analyzer_id, ioc_value, data_type: {"id": "job-1"},
+        STAGE_AWAIT: lambda job_id, r_json=None: InterfaceStatus.IIStatus(
+            code=InterfaceStatus.I2CodeSuccess, data={"id": job_id, "status": "Success"}),
+        STAGE_FETCH: lambda job_id, job: {"summary": {}, "full": {"score": 7}},
+    }
+    monkeypatch.setattr(interface, "_get_handler", lambda conf: CortexanalyzerHandler(
+        conf, {}, interface.log, stages=stages))
+    ioc = Ioc(1, "example.com", "domain")
+
+    status = interface.hooks_handler(hook_name, "Run Cortex Analyzer", [ioc])
+
+    assert status.is_success()
+    assert ioc.custom_attributes["CORTEX Report"]["HTML report"]["value"] == '{"score": 7}'
+
+
+def _success():
+    return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success")
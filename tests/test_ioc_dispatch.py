@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import DEFAULT_ROUTES
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import IocRoute
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import build_routes
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import get_routes
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import route_value
+
+
+def test_custom_routes_update_the_default_ones():
+    routes = build_routes({"ja3": "hash", "user-agent": None,
+                           "btc": {"data_type": "other", "label": "Wallet", "part": 1}})
+
+    assert routes["ja3"] == IocRoute("hash", "Hash", None)
+    assert routes["btc"] == IocRoute("other", "Wallet", 1)
+    assert "user-agent" not in routes
+    assert routes["domain"] == DEFAULT_ROUTES["domain"]
+    assert "user-agent" in DEFAULT_ROUTES
+
+
+def test_routes_are_built_once_per_mapping():
+    routes = get_routes('{"ja3": "hash"}')
+
+    assert get_routes({"ja3": "hash"}) is routes
+    assert get_routes("  ") is get_routes(None)
+    assert get_routes(None) == DEFAULT_ROUTES
+
+
+def test_invalid_mappings_are_rejected():
+    with pytest.raises(ValueError):
+        get_routes("{not json")
+
+
+@pytest.mark.parametrize("type_name, ioc_value, expected", [
+    ("domain", "example.com", "example.com"),
+    ("ip-dst|port", "10.0.0.1|443", "10.0.0.1"),
+    ("filename|sha256", "evil.exe | ABCDEF", "ABCDEF"),
+    ("url", "https://example.com/a|b", "https://example.com/a|b"),
+    ("filename|md5", "evil.exe", "evil.exe"),
+])
+def test_the_routed_part_of_composite_values_is_analyzed(type_name, ioc_value, expected):
+    assert route_value(DEFAULT_ROUTES[type_name], ioc_value) == expected
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import json
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_file_parser import IocFileError
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_file_parser import iter_batches
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_file_parser import iter_ioc_values
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_file_parser import iter_unique
+
+
+def test_values_are_read_from_csv_jsonl_and_text_files(tmp_path):
+    (tmp_path / "a.csv").write_text("type,value\ndomain,a.com\nip,10.0.0.1\n")
+    (tmp_path / "b.jsonl").write_text('{"ioc_value": "b.com"}\n\n"c.com"\n')
+    (tmp_path / "c.txt").write_text("# Comment\nd.com\n\n  e.com  \n")
+
+    assert list(iter_ioc_values(tmp_path)) == ["a.com", "10.0.0.1", "b.com", "c.com", "d.com",
+                                               "e.com"]
+
+
+def test_csv_files_without_a_known_header_start_with_a_value(tmp_path):
+    (tmp_path / "iocs.csv").write_text("a.com,domain\nb.com,domain\n")
+
+    assert list(iter_ioc_values(tmp_path / "iocs.csv")) == ["a.com", "b.com"]
+
+
+def test_pretty_printed_json_arrays_are_read_entirely(tmp_path):
+    entries = [{"value": "a.com", "type": "domain"}, "b.com", {"ioc": "10.0.0.1"}, 42]
+    (tmp_path / "iocs.json").write_text(json.dumps(entries, indent=4))
+
+    assert list(iter_ioc_values(tmp_path)) == ["a.com", "b.com", "10.0.0.1"]
+
+
+def test_pretty_printed_json_objects_are_rejected(tmp_path):
+    (tmp_path / "iocs.json").write_text(json.dumps({"iocs": ["a.com", "b.com"]}, indent=4))
+
+    with pytest.raises(IocFileError, match="Line 1 of iocs.json is not a JSON entry"):
+        list(iter_ioc_values(tmp_path))
+
+
+def test_truncated_json_arrays_are_rejected(tmp_path):
+    (tmp_path / "iocs.json").write_text('[\n    "a.com",\n    "b.com"\n')
+
+    with pytest.raises(IocFileError, match="iocs.json is not a valid JSON array"):
+        list(iter_ioc_values(tmp_path))
+
+
+def test_unique_values_are_batched():
+    values = iter_unique(["A.com", "b.com", "a.com", "c.com"], key=str.lower)
+
+    assert list(iter_batches(values, 2)) == [["A.com", "b.com"], ["c.com"]]
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_normalizer import group_iocs
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_normalizer import match_key
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_normalizer import normalize_value
+
+
+@pytest.mark.parametrize("data_type, value, expected", [
+    ("domain", " Example[.]COM. ", "example.com"),
+    ("fqdn", "www(.)Example.com.", "www.example.com"),
+    ("ip", "10{.}0.0.1", "10.0.0.1"),
+    ("ip", "2001:DB8:0:0:0:0:0:1", "2001:db8::1"),
+    ("ip", "Not-An-IP", "not-an-ip"),
+    ("hash", "D41D8CD98F00B204E9800998ECF8427E", "d41d8cd98f00b204e9800998ecf8427e"),
+    ("url", " https://Example.com/Path ", "https://Example.com/Path"),
+])
+def test_values_are_normalized_by_data_type(data_type, value, expected):
+    assert normalize_value(data_type, value) == expected
+
+
+def test_values_of_unknown_type_match_their_normalized_forms():
+    assert match_key("Example[.]com.") == normalize_value("domain", "example.com")
+    assert match_key("2001:db8:0::1") == normalize_value("ip", "2001:DB8::1")
+
+
+def test_iocs_are_grouped_by_normalized_value_in_order():
+    groups = group_iocs([
+        ("a", "Example.com", "domain", 1),
+        ("b", "10.0.0.1", "ip", 2),
+        ("c", "example[.]com.", "domain", 3),
+        ("d", "example.com", "fqdn", None),
+    ])
+
+    assert groups == [("example.com", "domain", [("a", 1), ("c", 3)]),
+                      ("10.0.0.1", "ip", [("b", 2)]),
+                      ("example.com", "fqdn", [("d", None)])]
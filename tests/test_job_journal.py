@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import sqlite3
+import time
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_journal import PROCESS_TOKEN
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_journal import JobJournal
+
+OTHER_WORKER = "1:other"
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return JobJournal(str(tmp_path / "jobs.db"))
+
+
+def record(journal, job_id, ioc_id, owner, lease):
+    journal.record(job_id, ioc_id, f'ioc-{ioc_id}.com', "domain", "Analyzer_1_0", lease)
+    journal._db.execute("UPDATE cortex_jobs SET owner = ? WHERE job_id = ?", (owner, job_id))
+    journal._db.commit()
+
+
+def lease_of(journal, job_id):
+    return journal._db.execute("SELECT lease_until FROM cortex_jobs WHERE job_id = ?",
+                               (job_id,)).fetchone()[0]
+
+
+def test_jobs_are_claimed_once_their_lease_expired(journal):
+    record(journal, "job-1", 1, OTHER_WORKER, 300)
+    record(journal, "job-2", 2, OTHER_WORKER, -1)
+
+    assert journal.claim_orphans(300) == {2: ("ioc-2.com", "domain", {"Analyzer_1_0": "job-2"})}
+    assert journal.claim_orphans(300) == {}
+
+
+def test_own_jobs_are_not_claimed(journal):
+    record(journal, "job-1", 1, PROCESS_TOKEN, -1)
+
+    assert journal.claim_orphans(300) == {}
+
+
+def test_jobs_without_ioc_are_not_recorded(journal):
+    journal.record("job-1", None, "ioc.com", "domain", "Analyzer_1_0", 300)
+
+    assert journal._db.execute("SELECT COUNT(*) FROM cortex_jobs").fetchone()[0] == 0
+
+
+def test_jobs_without_ioc_left_by_previous_versions_are_removed(tmp_path):
+    db = sqlite3.connect(str(tmp_path / "jobs.db"))
+    db.execute("CREATE TABLE cortex_jobs (job_id TEXT NOT NULL, ioc_id INTEGER, "
+               "ioc_value TEXT NOT NULL, data_type TEXT NOT NULL, analyzer TEXT NOT NULL, "
+               "owner TEXT NOT NULL, lease_until REAL NOT NULL, PRIMARY KEY (job_id, ioc_id))")
+    db.executemany("INSERT INTO cortex_jobs VALUES (?, ?, 'ioc.com', 'domain', 'A', 'x', 0)",
+                   [("job-1", None), ("job-1", None), ("job-2", 2)])
+    db.commit()
+
+    journal = JobJournal(str(tmp_path / "jobs.db"))
+
+    assert list(journal.claim_orphans(300)) == [2]
+
+
+def test_workers_renew_the_lease_of_their_own_jobs_only(journal):
+    record(journal, "job-1", 1, PROCESS_TOKEN, -1)
+    record(journal, "job-2", 2, OTHER_WORKER, -1)
+
+    journal.renew("job-1", 300)
+    journal.renew("job-2", 300)
+
+    assert lease_of(journal, "job-1") > time.time() + 200
+    assert lease_of(journal, "job-2") < time.time()
+
+
+def test_claimed_jobs_are_leased_to_the_worker(journal):
+    record(journal, "job-1", 1, OTHER_WORKER, -1)
+    journal.claim_orphans(300)
+
+    owner, lease_until = journal._db.execute(
+        "SELECT owner, lease_until FROM cortex_jobs").fetchone()
+    assert owner == PROCESS_TOKEN
+    assert lease_until > time.time() + 200
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import asyncio
+import logging
+import random
+import threading
+import types
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler import job_tracker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.circuit_breaker import CircuitOpenError
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import INITIAL_DELAY
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import MAX_DELAY
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import AsyncJobTracker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import JobTracker
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_tracker import next_delay
+
+
+class _Api(object):
+    """
+    Stands for a Cortex client, answering the job searches with the state of the jobs in
+    self.states, or raising self.error
+    """
+
+    def __init__(self):
+        self.states = {}
+        self.searches = []
+        self.error = None
+        self.jobs = types.SimpleNamespace(find_all=self._find_all)
+
+    def _find_all(self, query, range="all"):
+        self.searches.append(range)
+        if self.error is not None:
+            raise self.error
+        return [types.SimpleNamespace(json=lambda job=job: job) for job in self.states.values()]
+
+
+@pytest.fixture
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(job_tracker, "INITIAL_DELAY", 0.01)
+    monkeypatch.setattr(job_tracker, "MAX_DELAY", 0.05)
+
+
+def test_delays_are_reset_once_a_job_completed():
+    assert next_delay(MAX_DELAY, 1) == INITIAL_DELAY
+
+
+def test_delays_back_off_with_jitter_within_their_bounds():
+    random.seed(0)
+
+    delays = [next_delay(delay, 0) for delay in (INITIAL_DELAY, 1, MAX_DELAY) for _ in range(200)]
+
+    assert all(INITIAL_DELAY <= delay <= MAX_DELAY for delay in delays)
+    assert len(set(delays[:200])) > 100
+    assert max(delays[:200]) > INITIAL_DELAY * 2
+
+
+@pytest.mark.usefixtures("fast_polling")
+def test_waiters_are_released_once_their_job_completed():
+    api = _Api()
+    api.states["job-1"] = {"id": "job-1", "status": "InProgress"}
+    tracker = JobTracker(api, logging.getLogger(__name__))
+    results = []
+
+    waiters = [threading.Thread(target=lambda: results.append(tracker.wait("job-1", 5)))
+               for _ in range(2)]
+    for waiter in waiters:
+        waiter.start()
+
+    api.states["job-1"] = {"id": "job-1", "status": "Success"}
+    for waiter in waiters:
+        waiter.join()
+
+    assert results == [{"id": "job-1", "status": "Success"}] * 2
+    assert len(tracker) == 0
+
+
+def test_jobs_are_checked_by_pages():
+    api = _Api()
+    tracker = JobTracker(api, logging.getLogger(__name__))
+
+    tracker.poll([f'job-{index}' for index in range(job_tracker.PAGE_SIZE + 1)])
+
+    assert api.searches == [f'0-{job_tracker.PAGE_SIZE}', "0-1"]
+
+
+@pytest.mark.usefixtures("fast_polling")
+def test_jobs_still_running_at_the_timeout_return_their_last_state():
+    api = _Api()
+    api.states["job-1"] = {"id": "job-1", "status": "InProgress"}
+    tracker = JobTracker(api, logging.getLogger(__name__))
+
+    assert tracker.wait("job-1", 0.1) == {"id": "job-1", "status": "InProgress"}
+
+
+@pytest.mark.usefixtures("fast_polling")
+def test_waiters_are_released_while_the_circuit_is_open():
+    api = _Api()
+    api.error = CircuitOpenError("Cortex is unavailable")
+    tracker = JobTracker(api, logging.getLogger(__name__))
+
+    with pytest.raises(CircuitOpenError):
+        tracker.wait("job-1", 5)
+
+
+@pytest.mark.usefixtures("fast_polling")
+def test_async_waiters_share_one_job_search_per_round():
+    api = _Api()
+    api.states = {job_id: {"id": job_id, "status": "Success"} for job_id in ("job-1", "job-2")}
+
+    async def request(method, endpoint, json=None, params=None):
+        return [job.json() for job in api.jobs.find_all(json["query"], range=params["range"])]
+
+    async def wait_all():
+        tracker = AsyncJobTracker(request, logging.getLogger(__name__))
+        return await asyncio.gather(*[tracker.wait({"id": job_id, "status": "Waiting"}, 5)
+                                      for job_id in ("job-1", "job-2")])
+
+    assert [r_json["status"] for r_json in asyncio.run(wait_all())] == ["Success", "Success"]
+    assert api.searches == ["0-2"]
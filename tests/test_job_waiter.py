@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import logging
+import types
+
+from cortex4py.exceptions import NotFoundError
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.job_waiter import JobWaiter
+
+
+class _Api(object):
+    """
+    Stands for a Cortex client, answering the waitreport requests and the job searches with the
+    given jobs
+    """
+
+    def __init__(self, waitreport=None, search=None, report=None):
+        self.waitreport = waitreport
+        self.search = search or []
+        self.gets = []
+        self.searches = 0
+        self.jobs = types.SimpleNamespace(find_all=self._find_all, get_report=self._get_report)
+        self._report = report
+
+    def do_get(self, endpoint, params={}):
+        self.gets.append((endpoint, params))
+        if isinstance(self.waitreport, Exception):
+            raise self.waitreport
+        return types.SimpleNamespace(json=lambda: self.waitreport)
+
+    def _find_all(self, query, range="all"):
+        self.searches += 1
+        return [types.SimpleNamespace(json=lambda job=job: job) for job in self.search]
+
+    def _get_report(self, job_id):
+        return types.SimpleNamespace(json=lambda: {"id": job_id, "report": self._report})
+
+
+def make_waiter(api, **kwargs):
+    return JobWaiter(api, logging.getLogger(__name__), **kwargs)
+
+
+def test_waitreport_returns_the_completed_job_with_its_report():
+    api = _Api(waitreport={"id": "job-1", "status": "Success", "report": {"summary": {}}})
+
+    status = make_waiter(api).wait("job-1", {"id": "job-1", "status": "Waiting"})
+
+    assert status.is_success()
+    assert status.get_data()["report"] == {"summary": {}}
+    assert api.gets == [("job/job-1/waitreport", {"atMost": "30seconds"})]
+    assert api.searches == 0
+
+
+def test_jobs_failed_on_submission_are_not_waited_for():
+    api = _Api()
+
+    status = make_waiter(api).wait("job-1", {"id": "job-1", "status": "Failure",
+                                             "errorMessage": "Invalid observable"})
+
+    assert not status.is_success()
+    assert status.get_message() == "Cortex Failure: Invalid observable"
+    assert api.gets == []
+
+
+def test_failed_jobs_report_the_error_of_their_report():
+    api = _Api(waitreport={"id": "job-1", "status": "Failure",
+                           "report": {"errorMessage": "API quota exceeded"}})
+
+    status = make_waiter(api).wait("job-1")
+
+    assert not status.is_success()
+    assert status.get_message() == "Cortex Failure: API quota exceeded"
+
+
+def test_jobs_are_polled_when_waitreport_is_not_available():
+    api = _Api(waitreport=NotFoundError("Resource not found"),
+               search=[{"id": "job-1", "status": "Success"}])
+    waiter = make_waiter(api, timeout=10)
+
+    status = waiter.wait("job-1")
+
+    assert status.is_success()
+    assert waiter.use_waitreport is False
+    assert api.searches == 1
+
+
+def test_jobs_still_running_at_the_timeout_fail():
+    api = _Api(search=[{"id": "job-1", "status": "InProgress"}])
+
+    status = make_waiter(api, timeout=1, use_waitreport=False).wait("job-1")
+
+    assert not status.is_success()
+    assert status.get_message() == "Job failed to complete after 1 seconds."
+    assert status.get_data() == {"id": "job-1", "status": "InProgress"}
+
+
+def test_fetch_report_returns_the_report_of_the_job():
+    api = _Api(report={"full": {"score": 1}})
+
+    assert make_waiter(api).fetch_report("job-1") == {"full": {"score": 1}}
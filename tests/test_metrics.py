@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import os
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.metrics import MetricsRegistry
+
+
+def test_stage_durations_are_rendered_as_cumulative_histograms():
+    registry = MetricsRegistry()
+    registry.observe("submit", 0.004)
+    registry.observe("submit", 0.3)
+    registry.observe("submit", 600)
+
+    lines = registry.render().splitlines()
+
+    assert 'cortexanalyzer_stage_seconds_bucket{stage="submit",le="0.005"} 1' in lines
+    assert 'cortexanalyzer_stage_seconds_bucket{stage="submit",le="0.25"} 1' in lines
+    assert 'cortexanalyzer_stage_seconds_bucket{stage="submit",le="0.5"} 2' in lines
+    assert 'cortexanalyzer_stage_seconds_bucket{stage="submit",le="300"} 2' in lines
+    assert 'cortexanalyzer_stage_seconds_bucket{stage="submit",le="+Inf"} 3' in lines
+    assert 'cortexanalyzer_stage_seconds_sum{stage="submit"} 600.304000' in lines
+    assert 'cortexanalyzer_stage_seconds_count{stage="submit"} 3' in lines
+
+
+def test_counters_are_exported_even_before_their_first_increment():
+    registry = MetricsRegistry()
+    registry.inc("retries", 2)
+    registry.inc("custom")
+
+    lines = registry.render().splitlines()
+
+    assert "cortexanalyzer_retries_total 2" in lines
+    assert "cortexanalyzer_timeouts_total 0" in lines
+    assert "# HELP cortexanalyzer_custom_total custom" in lines
+    assert "cortexanalyzer_custom_total 1" in lines
+
+
+def test_metrics_are_written_to_the_file_of_the_worker(tmp_path):
+    registry = MetricsRegistry()
+    registry.inc("retries")
+
+    registry.write(str(tmp_path / "cortexanalyzer-{pid}.prom"))
+
+    assert os.listdir(tmp_path) == [f'cortexanalyzer-{os.getpid()}.prom']
+    assert "cortexanalyzer_retries_total 1" in (
+        tmp_path / f'cortexanalyzer-{os.getpid()}.prom').read_text()
+
+
+def test_export_failures_are_only_logged(make_handler, tmp_path, caplog):
+    handler = make_handler(cortexanalyzer_metrics_path=str(tmp_path / "missing" / "metrics.prom"))
+
+    handler.export_metrics()
+
+    assert "Unable to write the metrics" in caplog.text
+    assert not (tmp_path / "missing").exists()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+from iris_cortexanalyzer_module.IrisCortexanalyzerInterface import IrisCortexanalyzerInterface
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import get_routes
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_normalizer import match_key
+
+
+def test_equivalent_values_share_a_match_key():
+    assert match_key("Example.COM.") == match_key("example[.]com")
+    assert match_key("2001:DB8:0:0::1") == match_key("2001:db8::1")
+    assert match_key("44D88612FEA8A8F36DE8") == match_key("44d88612fea8a8f36de8")
+    assert match_key("example.com") != match_key("example.org")
+
+
+def test_uploaded_values_match_the_normalized_and_routed_iocs_of_the_case():
+    index = IrisCortexanalyzerInterface._index_iocs(get_routes(), [
+        (1, "Example.com.", "domain"),
+        (2, "10.0.0.1|443", "ip-dst|port"),
+        (3, "evil[.]org", "domain"),
+        (4, "evil.org", "domain"),
+    ])
+
+    assert index[match_key("example.com")] == {1}
+    assert index[match_key("10.0.0.1")] == {2}
+    assert index[match_key("10.0.0.1|443")] == {2}
+    assert index[match_key("EVIL.ORG")] == {3, 4}
+    assert match_key("10.0.0.2") not in index
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import asyncio
+import threading
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import TokenBucket
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import is_rate_limited
+from iris_cortexanalyzer_module.cortexanalyzer_handler.rate_limiter import parse_rate_limits
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_BULK
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_MANUAL
+from tests.test_scheduler import wait_until
+
+
+def test_burst_tokens_are_available_right_away():
+    bucket = TokenBucket(rate=1, burst=2)
+
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_next_token_goes_to_manual_trigger_queued_after_bulk_jobs():
+    # One token every 0.25 second
+    bucket = TokenBucket(rate=240)
+    assert bucket.try_acquire()
+    order = []
+
+    def job(name, priority):
+        bucket.acquire(priority)
+        order.append(name)
+
+    threads = []
+    for name, priority in (("bulk-1", PRIORITY_BULK), ("bulk-2", PRIORITY_BULK),
+                           ("manual", PRIORITY_MANUAL)):
+        threads.append(threading.Thread(target=job, args=(name, priority)))
+        threads[-1].start()
+        wait_until(lambda: bucket.waiting() == len(threads))
+
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["manual", "bulk-1", "bulk-2"]
+
+
+def test_coroutines_get_their_tokens_by_priority():
+    bucket = TokenBucket(rate=240)
+    assert bucket.try_acquire()
+    order = []
+
+    async def job(name, priority):
+        await bucket.acquire_async(priority)
+        order.append(name)
+
+    async def main():
+        await asyncio.gather(job("bulk", PRIORITY_BULK), job("manual", PRIORITY_MANUAL))
+
+    asyncio.run(main())
+
+    assert order == ["manual", "bulk"]
+
+
+def test_cancelled_coroutine_leaves_the_queue():
+    bucket = TokenBucket(rate=1)
+    assert bucket.try_acquire()
+
+    async def main():
+        task = asyncio.ensure_future(bucket.acquire_async())
+        await asyncio.sleep(0.01)
+        assert bucket.waiting() == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+
+    assert bucket.waiting() == 0
+
+
+def test_rate_limits_which_are_not_objects_are_reported_and_ignored():
+    limits, problems = parse_rate_limits('{"VirusTotal_GetReport_3_0": 4, '
+                                         '"AbuseIPDB_1_0": {"rate": 2, "burst": 3}, '
+                                         '"Shodan_Host_1_0": {"rate": "fast"}, '
+                                         '"Disabled_1_0": {"rate": 0}}')
+
+    assert limits == {"AbuseIPDB_1_0": (2.0, 3)}
+    assert len(problems) == 2
+    assert "VirusTotal_GetReport_3_0" in problems[0]
+
+
+def test_rate_limits_which_are_not_a_json_object_are_reported():
+    assert parse_rate_limits("") == ({}, [])
+    assert parse_rate_limits("{not json")[1]
+    assert parse_rate_limits("[4]")[1]
+
+
+def test_rate_limited_errors_are_told_by_status_code_or_message():
+    class _ResponseError(Exception):
+        status = 429
+
+    assert is_rate_limited(_ResponseError("Cortex answered"))
+    assert is_rate_limited("Request failed: 429 Client Error: Too Many Requests")
+    assert is_rate_limited("Monthly quota exceeded")
+    assert is_rate_limited("Request throttled by the API")
+
+
+def test_status_codes_in_ioc_values_are_not_rate_limits():
+    assert not is_rate_limited("No report for 44d88612fea8a8f36de82e1278abb429")
+    assert not is_rate_limited("Invalid observable 10.0.4.29")
+    assert not is_rate_limited("Job of 192.168.1.429 failed")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import json
+import logging
+import sqlite3
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler import cortexanalyzer_handler
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_cache import ReportCache
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_cache import cache_source
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_BULK
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_MANUAL
+
+
+def report(size):
+    return {"summary": "x" * (size - len(json.dumps({"summary": ""})))}
+
+
+def test_least_recently_used_reports_are_evicted_past_the_size_in_bytes():
+    cache = ReportCache("cortex", max_bytes=300)
+    cache.set("Analyzer", "domain", "a.com", report(100))
+    cache.set("Analyzer", "domain", "b.com", report(100))
+    cache.get("Analyzer", "domain", "a.com")
+    cache.set("Analyzer", "domain", "c.com", report(150))
+
+    assert cache.get("Analyzer", "domain", "a.com") is not None
+    assert cache.get("Analyzer", "domain", "b.com") is None
+    assert cache.get("Analyzer", "domain", "c.com") is not None
+    assert cache.size == 250
+
+
+def test_reports_larger_than_the_cache_are_not_cached():
+    cache = ReportCache("cortex", max_bytes=100)
+    cache.set("Analyzer", "domain", "a.com", report(101))
+
+    assert cache.get("Analyzer", "domain", "a.com") is None
+    assert cache.size == 0
+
+
+def test_cortex_instances_do_not_share_reports(tmp_path):
+    db_path = str(tmp_path / "reports.db")
+    first = ReportCache(cache_source("http://cortex-1", "key"), db_path=db_path)
+    second = ReportCache(cache_source("http://cortex-2", "key"), db_path=db_path)
+    other_key = ReportCache(cache_source("http://cortex-1", "other"), db_path=db_path)
+
+    first.set("Analyzer", "domain", "a.com", {"summary": "first"})
+
+    reopened = ReportCache(first.source, db_path=db_path)
+    assert reopened.get("Analyzer", "domain", "a.com") is not None
+    assert second.get("Analyzer", "domain", "a.com") is None
+    assert other_key.get("Analyzer", "domain", "a.com") is None
+
+
+def test_database_is_bounded_in_bytes(tmp_path):
+    db_path = str(tmp_path / "reports.db")
+    cache = ReportCache("cortex", max_bytes=250, db_path=db_path)
+    for value in ("a.com", "b.com", "c.com"):
+        cache.set("Analyzer", "domain", value, report(100))
+
+    rows = sqlite3.connect(db_path).execute("SELECT value FROM cortex_reports").fetchall()
+    assert sorted(row[0] for row in rows) == ["b.com", "c.com"]
+
+
+def test_database_of_reports_without_source_is_reset(tmp_path):
+    db_path = str(tmp_path / "reports.db")
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE cortex_reports (analyzer TEXT NOT NULL, data_type TEXT NOT NULL, "
+               "value TEXT NOT NULL, created REAL NOT NULL, report TEXT NOT NULL, "
+               "PRIMARY KEY (analyzer, data_type, value))")
+    db.commit()
+
+    cache = ReportCache("cortex", db_path=db_path)
+    cache.set("Analyzer", "domain", "a.com", {"summary": "fresh"})
+
+    reopened = ReportCache("cortex", db_path=db_path)
+    assert reopened.get("Analyzer", "domain", "a.com") == {"summary": "fresh"}
+
+
+def test_manual_triggers_bypass_the_cache():
+    mod_config = {"cortexanalyze_url": "http://cortex", "cortexanalyze_key": "key",
+                  "cortexanalyzer_report_cache_ttl": 60, "cortexanalyzer_report_cache_max_mb": 1}
+    handler = cortexanalyzer_handler.CortexanalyzerHandler(mod_config, {},
+                                                           logging.getLogger(__name__))
+    handler.get_report_cache().set("Analyzer", "domain", "a.com", {"summary": "cached"})
+
+    assert handler.get_cached_report("Analyzer", "a.com", "domain", PRIORITY_MANUAL) is None
+    assert handler.get_cached_report("Analyzer", "a.com", "domain", PRIORITY_BULK) is not None
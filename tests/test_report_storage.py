@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import json
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_storage import bound_results
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_storage import summarize_report
+from tests.iris_stubs import Ioc
+
+TAXONOMIES = [{"level": "malicious", "namespace": "VT", "predicate": "GetReport", "value": "7"}]
+REPORT = {"success": True, "summary": {"taxonomies": TAXONOMIES}, "full": {"scans": ["x"] * 100}}
+
+
+def test_summaries_hold_the_taxonomies_once():
+    assert summarize_report(REPORT) == {"success": True, "summary": {"taxonomies": TAXONOMIES}}
+    assert summarize_report({"full": {}}) == {"success": True, "summary": {}}
+
+
+def test_results_within_the_cap_are_kept_in_full():
+    results = {"scans": ["x"] * 100}
+
+    assert bound_results(results, {}, 0) is results
+    assert bound_results(results, {}, len(json.dumps(results, separators=(",", ":")))) is results
+
+
+def test_results_over_the_cap_are_replaced_by_their_summaries():
+    results = {"scans": ["x"] * 100}
+    size = len(json.dumps(results, separators=(",", ":")))
+
+    bounded = bound_results(results, {"summary": {}}, 100)
+
+    assert bounded == {
+        "truncated": f"Full report of {size} bytes exceeds the 100 bytes cap. Only the summary "
+                     "is shown",
+        "results": {"summary": {}},
+    }
+
+
+def test_summary_mode_only_stores_the_rendered_summary_on_the_ioc(make_handler):
+    handler = make_handler(cortexanalyze_analyzer="Analyzer_1_0",
+                           cortexanalyzer_report_as_attribute=True,
+                           cortexanalyzer_report_storage_mode="summary",
+                           cortexanalyzer_domain_report_template="{{ results | tojson }}")
+    ioc = Ioc(1, "example.com", "domain")
+
+    status = handler.add_report_attribute(ioc, {"Analyzer_1_0": REPORT}, "Domain",
+                                          data_type="domain")
+    handler.flush_attributes()
+
+    assert status.is_success()
+    fields = ioc.custom_attributes["CORTEX Report"]
+    assert json.loads(fields["HTML report"]["value"]) == summarize_report(REPORT)
+    assert "scans" not in json.dumps(fields)
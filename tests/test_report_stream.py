@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import asyncio
+import json
+
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_stream import ReportReader
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_stream import parse_fields
+
+pytest.importorskip("ijson")
+
+JOB = {
+    "id": "job-1",
+    "status": "Success",
+    "analyzerName": "Analyzer_1_0",
+    "report": {
+        "success": True,
+        "summary": {"taxonomies": [{"level": "malicious", "value": "3/70"}]},
+        "full": {"verdict": "malicious",
+                 "scans": [{"engine": f'engine-{index}'} for index in range(500)]},
+    },
+}
+
+
+def chunks(document, size=1024):
+    body = json.dumps(document).encode()
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+def test_reports_under_the_threshold_are_loaded_in_full():
+    assert ReportReader(threshold=1024 * 1024).read(chunks(JOB)) == JOB
+
+
+def test_large_reports_keep_the_job_fields_summary_and_selected_fields():
+    r_json = ReportReader(threshold=1024, fields="full.verdict").read(chunks(JOB))
+
+    assert r_json["id"] == "job-1"
+    assert r_json["status"] == "Success"
+    assert r_json["report"]["summary"] == JOB["report"]["summary"]
+    assert r_json["report"]["full"]["verdict"] == "malicious"
+    assert "scans" not in r_json["report"]["full"]
+    assert "truncated" in r_json["report"]["full"]
+
+
+def test_large_reports_are_read_from_async_chunks():
+    async def iterate():
+        for chunk in chunks(JOB, size=100):
+            yield chunk
+
+    r_json = asyncio.run(ReportReader(threshold=1024).read_async(iterate()))
+
+    assert r_json["report"]["summary"] == JOB["report"]["summary"]
+
+
+def test_selected_fields_are_trimmed_paths():
+    assert parse_fields(" full.verdict, .full.score. ,,") == ["full.verdict", "full.score"]
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import iris_cortexanalyzer_module.IrisCortexanalyzerConfig as interface_conf
+from iris_cortexanalyzer_module.cortexanalyzer_handler.ioc_dispatch import DEFAULT_ROUTES
+from iris_cortexanalyzer_module.cortexanalyzer_handler.report_templates import get_template
+
+
+def test_templates_are_compiled_once_per_source():
+    template = get_template("{{ results.score }}")
+
+    assert get_template("{{ results.score }}") is template
+    assert get_template("{{ results.value }}") is not template
+    assert template.render(results={"score": 3}) == "3"
+
+
+def test_dispatched_types_have_a_template_setting():
+    settings = {param["param_name"] for param in interface_conf.module_configuration}
+    data_types = {"ip", "hash", "fqdn", "url", "mail", "filename"}
+
+    assert data_types <= {route.data_type for route in DEFAULT_ROUTES.values()}
+    for data_type in data_types:
+        assert f"cortexanalyzer_{data_type}_report_template" in settings
+
+
+def test_types_without_a_template_of_their_own_use_the_default_one(make_handler):
+    handler = make_handler(cortexanalyzer_domain_report_template="default",
+                           cortexanalyzer_url_report_template="url",
+                           cortexanalyzer_mail_report_template="")
+
+    assert handler.get_report_template("url") == "url"
+    assert handler.get_report_template("mail") == "default"
+    assert handler.get_report_template("registry") == "default"
+
+
+def test_compile_report_templates_reports_invalid_templates(make_handler):
+    assert make_handler(cortexanalyzer_url_report_template="{{ results }}") \
+        .compile_report_templates().is_success()
+    assert not make_handler(cortexanalyzer_url_report_template="{% if %}") \
+        .compile_report_templates().is_success()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import threading
+import time
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_BULK
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_MANUAL
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import PRIORITY_UPDATE
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import JobScheduler
+from iris_cortexanalyzer_module.cortexanalyzer_handler.scheduler import TicketQueue
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_tickets_are_served_by_priority_then_round_robin_between_cases():
+    queue = TicketQueue()
+    for ticket, priority, case in (("bulk-a1", PRIORITY_BULK, "a"),
+                                   ("bulk-a2", PRIORITY_BULK, "a"),
+                                   ("bulk-b1", PRIORITY_BULK, "b"),
+                                   ("update", PRIORITY_UPDATE, "a"),
+                                   ("manual", PRIORITY_MANUAL, "c")):
+        queue.push(ticket, priority, case)
+
+    assert [queue.pop() for _ in range(5)] == ["manual", "update", "bulk-a1", "bulk-b1", "bulk-a2"]
+    assert queue.pop() is None
+
+
+def test_removed_tickets_are_not_served():
+    queue = TicketQueue()
+    queue.push("first", PRIORITY_BULK, "a")
+    queue.push("second", PRIORITY_BULK, "a")
+
+    assert queue.remove("first", PRIORITY_BULK, "a")
+    assert not queue.remove("first", PRIORITY_BULK, "a")
+    assert len(queue) == 1
+    assert queue.pop() == "second"
+
+
+def test_free_slot_goes_to_manual_trigger_queued_after_bulk_job():
+    scheduler = JobScheduler(1)
+    scheduler.acquire()
+    order = []
+
+    def job(name, priority):
+        with scheduler.slot(priority):
+            order.append(name)
+
+    bulk = threading.Thread(target=job, args=("bulk", PRIORITY_BULK))
+    bulk.start()
+    wait_until(lambda: scheduler.waiting() == 1)
+    manual = threading.Thread(target=job, args=("manual", PRIORITY_MANUAL))
+    manual.start()
+    wait_until(lambda: scheduler.waiting() == 2)
+
+    scheduler.release()
+    bulk.join(5)
+    manual.join(5)
+
+    assert order == ["manual", "bulk"]
+    assert scheduler.in_use == 0
+
+
+def test_worker_slots_are_only_shared_when_configured(make_handler):
+    import iris_cortexanalyzer_module.IrisCortexanalyzerConfig as interface_conf
+
+    default = next(param["default"] for param in interface_conf.module_configuration
+                   if param["param_name"] == "cortexanalyzer_worker_max_in_flight")
+
+    assert make_handler(cortexanalyzer_worker_max_in_flight=default).get_job_scheduler() is None
+    assert make_handler(cortexanalyzer_worker_max_in_flight=8).get_job_scheduler() is not None
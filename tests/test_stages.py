@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+#
+#
+#  IRIS cortexanalyzer Source Code
+#  Copyright (C) 2023 - SOCFortress
+#  info@socfortress.co
+#  Created by SOCFortress - 2023-03-06
+#
+#  License MIT
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+import pytest
+
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_AWAIT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_FETCH
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_RESOLVE
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import STAGE_SUBMIT
+from iris_cortexanalyzer_module.cortexanalyzer_handler.stages import StageTimings
+
+
+class _Registry(object):
+    def __init__(self):
+        self.observed = []
+        self.incremented = []
+
+    def observe(self, stage, elapsed):
+        self.observed.append((stage, elapsed))
+
+    def inc(self, counter, value):
+        self.incremented.append((counter, value))
+
+
+def test_stage_runs_and_counters_are_accumulated():
+    registry = _Registry()
+    timings = StageTimings(registry=registry)
+
+    timings.add(STAGE_SUBMIT, 0.2)
+    timings.add(STAGE_SUBMIT, 0.4)
+    timings.count("retries")
+    timings.count("retries", 2)
+
+    assert timings.snapshot() == {STAGE_SUBMIT: (2, pytest.approx(0.6), 0.4)}
+    assert timings.counters() == {"retries": 3}
+    assert registry.observed == [(STAGE_SUBMIT, 0.2), (STAGE_SUBMIT, 0.4)]
+    assert registry.incremented == [("retries", 1), ("retries", 2)]
+
+
+def test_failed_stages_are_measured_too():
+    timings = StageTimings()
+
+    with pytest.raises(RuntimeError):
+        with timings.measure(STAGE_FETCH):
+            raise RuntimeError()
+
+    assert timings.snapshot()[STAGE_FETCH][0] == 1
+
+
+def test_summaries_list_the_stages_in_order():
+    timings = StageTimings()
+    timings.add("custom", 0.001)
+    timings.add(STAGE_AWAIT, 0.002)
+    timings.add(STAGE_SUBMIT, 0.001)
+    timings.count("jobs_submitted")
+
+    assert StageTimings().summary() == "no stage run"
+    assert timings.summary() == ("submit 1x avg 1.0ms max 1.0ms, await 1x avg 2.0ms max 2.0ms, "
+                                 "custom 1x avg 1.0ms max 1.0ms, jobs_submitted 1")
+    assert timings.as_dict()["stages"][STAGE_AWAIT] == {"count": 1, "total_ms": 2.0, "max_ms": 2.0}
+
+
+def test_custom_stages_replace_the_cortex_calls(make_handler):
+    calls = []
+    handler = make_handler(stages={
+        STAGE_RESOLVE: lambda analyzer, refresh=False: "analyzer-1",
+        STAGE_SUBMIT: lambda analyzer_id, ioc_value, data_type: (
+            calls.append((analyzer_id, ioc_value, data_type)) or {"id": "job-1"}),
+        STAGE_AWAIT: lambda job_id, r_json=None: InterfaceStatus.IIStatus(
+            code=InterfaceStatus.I2CodeSuccess, data={"id": job_id, "status": "Success"}),
+        STAGE_FETCH: lambda job_id, job: {"full": {"job": job_id}},
+    }, cortexanalyze_analyzer="Analyzer_1_0")
+
+    results = dict(handler.analyze_iocs([("ioc", "example.com", "domain", None)]))
+
+    assert results["ioc"].get_data() == {"Analyzer_1_0": {"full": {"job": "job-1"}}}
+    assert calls == [("analyzer-1", "example.com", "domain")]
+    assert {STAGE_RESOLVE, STAGE_SUBMIT, STAGE_AWAIT, STAGE_FETCH} <= set(
+        handler.timings.snapshot())